@@ -1,16 +1,113 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory, session, redirect
+from flask import Flask, render_template, request, jsonify, send_file, send_from_directory, session, redirect, make_response, Response
 import folium  
-from folium import plugins
+from folium.elements import JSCSSMixin
+from folium.template import Template
+from folium.utilities import camelize, remove_empty
+import codecs
+import hashlib
+import itertools
+import base64
+import bisect
 import json
+import math
+import mimetypes
+import numpy as np
+import pandas as pd
 import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
 from datetime import datetime, date
+from werkzeug.security import safe_join
 
-app = Flask(__name__)
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+try:
+    import zstandard
+except ImportError:  # Opcional: sin zstandard los backups se comprimen con gzip
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:  # Opcional: sin brotli las respuestas solo se negocian con gzip
+    brotli = None
+
+# Los estáticos los sirve serve_static (huellas, caché inmutable y variantes .gz/.br)
+app = Flask(__name__, static_folder=None)
 app.secret_key = 'clave_secreta_mantenimiento_2025'
 
 DATABASE_PATH = 'database'
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# Motor de almacenamiento: 'json' (por defecto) o 'sqlite'
+STORAGE_BACKEND = os.environ.get('MAPAS_STORAGE', 'json')
+SQLITE_PATH = os.path.join(DATABASE_PATH, 'mapas.db')
+
+# Diario de cambios (motor JSON): fsync cada N operaciones o cada X segundos,
+# y compactación sobre la instantánea cuando el diario supera el tamaño máximo
+JOURNAL_FSYNC_LOTE = 32
+JOURNAL_FSYNC_INTERVALO = 1.0
+JOURNAL_MAX_BYTES = 1024 * 1024
+
+# Registro global de cambios (/api/cambios): al superar el tamaño se deja solo
+# el último cambio de cada registro
+CAMBIOS_MAX_BYTES = 1024 * 1024
+CAMBIOS_COMPACTAR_CADA = 5000  # SQLite: compactar cada N secuencias
+
+# Caché en disco de teselas GeoJSON (/tiles/<capa>/<z>/<x>/<y>), con límite LRU
+TESELAS_PATH = os.path.join(DATABASE_PATH, 'teselas')
+TESELAS_MAX_BYTES = 64 * 1024 * 1024
+
+# Almacén de backups: instantáneas por colección direccionadas por contenido,
+# deltas por registro y retención de los últimos N backups, todos los de hoy
+# y el más reciente de cada uno de los últimos N días / N semanas
+BACKUPS_PATH = os.path.join(DATABASE_PATH, 'backups')
+BACKUPS_RECIENTES = int(os.environ.get('MAPAS_BACKUPS_RECIENTES', 10))
+BACKUPS_DIARIOS = int(os.environ.get('MAPAS_BACKUPS_DIARIOS', 7))
+BACKUPS_SEMANALES = int(os.environ.get('MAPAS_BACKUPS_SEMANALES', 4))
+BACKUPS_MAX_DELTAS = 10
+
+# Compresión de respuestas (gzip, o brotli si está instalado) a partir de este
+# tamaño; las versiones comprimidas de respuestas con ETag se reutilizan
+COMPRESION_MIN_BYTES = 1024
+COMPRESION_CACHE_BYTES = 32 * 1024 * 1024
+TIPOS_COMPRIMIBLES = {
+    'text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+    'application/json', 'application/geo+json', 'image/svg+xml'
+}
+# Variantes .gz/.br de los archivos estáticos generadas al pedirlas por primera vez
+ESTATICOS_COMPRIMIDOS_PATH = os.path.join(DATABASE_PATH, 'estaticos')
+
+ARCHIVOS_COLECCIONES = [
+    'centros_distribucion.json',
+    'distribuidores_autorizados.json',
+    'tiendas_oro.json',
+    'tiendas_satelite.json'
+]
+
+# Tipo de ubicación -> archivo de la colección y prefijo de sus IDs
+ARCHIVOS_POR_TIPO = {
+    'distribuidores': 'distribuidores_autorizados.json',
+    'tiendas_oro': 'tiendas_oro.json',
+    'tiendas_satelite': 'tiendas_satelite.json',
+    'centros_distribucion': 'centros_distribucion.json'
+}
+PREFIJOS_ID = {
+    'distribuidores': 'D',
+    'tiendas_oro': 'TO',
+    'tiendas_satelite': 'TS',
+    'centros_distribucion': 'CD'
+}
+
 # PIN hardcodeado
 MAINTENANCE_PIN = "2025"
 
@@ -18,18 +115,7 @@ MAINTENANCE_PIN = "2025"
 # Agregar cerca de las otras funciones de datos
 def inicializar_datos_si_no_existen():
     """Inicializar datos vacíos si los archivos no existen"""
-    archivos = [
-        'centros_distribucion.json',
-        'distribuidores_autorizados.json', 
-        'tiendas_oro.json',
-        'tiendas_satelite.json'
-    ]
-    
-    for archivo in archivos:
-        ruta = os.path.join(DATABASE_PATH, archivo)
-        if not os.path.exists(ruta):
-            guardar_datos_en_json(archivo, [])
-            print(f"✅ Archivo inicializado: {archivo}")
+    almacen.inicializar(ARCHIVOS_COLECCIONES)
 
 
 
@@ -38,54 +124,333 @@ def inicializar_datos_si_no_existen():
 # RUTAS PARA IMPORTAR/EXPORTAR DATOS
 # ============================================================================
 
+# Colecciones del documento de exportación/backup, en orden
+CATEGORIAS_EXPORTACION = [
+    'centros_distribucion',
+    'distribuidores_autorizados',
+    'tiendas_oro',
+    'tiendas_satelite'
+]
+
+# Tamaño aproximado de cada trozo enviado/escrito al exportar
+TAMANO_TROZO_EXPORTACION = 64 * 1024
+
+def generar_exportacion(encabezado, resumen):
+    """Genera el documento de exportación en trozos de texto, registro a registro
+
+    Nunca se tiene más de un trozo en memoria; `resumen` se va llenando con
+    la cantidad de registros de cada categoría y el total se escribe al final.
+    """
+    trozo = ['{']
+    tamano = 1
+    for clave, valor in encabezado.items():
+        trozo.append(f'\n  {json.dumps(clave)}: {json.dumps(valor, ensure_ascii=False)},')
+
+    for categoria in CATEGORIAS_EXPORTACION:
+        trozo.append(f'\n  {json.dumps(categoria)}: [')
+        cantidad = 0
+        for registro in almacen.iterar(f'{categoria}.json'):
+            texto = ('' if cantidad == 0 else ',') + '\n    ' + json.dumps(registro, ensure_ascii=False)
+            trozo.append(texto)
+            tamano += len(texto)
+            cantidad += 1
+            if tamano >= TAMANO_TROZO_EXPORTACION:
+                yield ''.join(trozo)
+                trozo, tamano = [], 0
+        trozo.append('\n  ],')
+        resumen[categoria] = cantidad
+
+    trozo.append(f'\n  "total_ubicaciones": {sum(resumen.values())}\n}}\n')
+    yield ''.join(trozo)
+
+def comprimir_trozos(trozos, codificacion='gzip'):
+    """Comprime (gzip o brotli) un generador de trozos de texto o bytes sin juntarlos"""
+    if codificacion == 'br':
+        compresor = brotli.Compressor(quality=5)
+        comprimir, terminar = compresor.process, compresor.finish
+    else:
+        compresor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 = formato gzip
+        comprimir, terminar = compresor.compress, compresor.flush
+    originales = enviados = 0
+    try:
+        for trozo in trozos:
+            if isinstance(trozo, str):
+                trozo = trozo.encode('utf-8')
+            originales += len(trozo)
+            comprimido = comprimir(trozo)
+            if comprimido:
+                enviados += len(comprimido)
+                yield comprimido
+        comprimido = terminar()
+        enviados += len(comprimido)
+        yield comprimido
+    finally:
+        sumar_compresion(originales, enviados)
+
 @app.route('/api/exportar-datos')
 def exportar_datos():
-    """Exportar todos los datos como un solo JSON"""
+    """Exportar todos los datos como un solo JSON, enviado en streaming (?comprimir=1 para gzip)"""
     if not session.get('mantenimiento_autorizado'):
         return jsonify({'error': 'No autorizado'}), 401
     
     try:
-        datos_exportados = {
-            'version': '1.0',
-            'exportado': datetime.now().isoformat(),
-            'total_ubicaciones': 0,
-            'centros_distribucion': cargar_datos_desde_json('centros_distribucion.json'),
-            'distribuidores_autorizados': cargar_datos_desde_json('distribuidores_autorizados.json'),
-            'tiendas_oro': cargar_datos_desde_json('tiendas_oro.json'),
-            'tiendas_satelite': cargar_datos_desde_json('tiendas_satelite.json')
+        # Cantidades desde los contadores del almacén (O(1)); el documento lleva las definitivas
+        resumen = {
+            'centros': almacen.estadisticas('centros_distribucion.json')['total'],
+            'distribuidores': almacen.estadisticas('distribuidores_autorizados.json')['total'],
+            'tiendas_oro': almacen.estadisticas('tiendas_oro.json')['total'],
+            'tiendas_satelite': almacen.estadisticas('tiendas_satelite.json')['total']
         }
+        resumen['total'] = sum(resumen.values())
+        print(f"📤 Exportando {resumen['total']} ubicaciones...")
         
-        # Calcular total
-        total = (len(datos_exportados['centros_distribucion']) + 
-                len(datos_exportados['distribuidores_autorizados']) + 
-                len(datos_exportados['tiendas_oro']) + 
-                len(datos_exportados['tiendas_satelite']))
-        datos_exportados['total_ubicaciones'] = total
-        
-        print(f"📤 Exportando {total} ubicaciones...")
-        
-        return jsonify({
-            'success': True, 
-            'datos': datos_exportados,
-            'resumen': {
-                'centros': len(datos_exportados['centros_distribucion']),
-                'distribuidores': len(datos_exportados['distribuidores_autorizados']),
-                'tiendas_oro': len(datos_exportados['tiendas_oro']),
-                'tiendas_satelite': len(datos_exportados['tiendas_satelite']),
-                'total': total
-            }
-        })
+        encabezado = {'version': '1.0', 'exportado': datetime.now().isoformat()}
+        trozos = generar_exportacion(encabezado, {})
+        nombre = f"backup_datos_carnes_san_martin_{date.today().isoformat()}.json"
+        if request.args.get('comprimir') in ('1', 'true', 'gzip'):
+            respuesta = Response(comprimir_trozos(trozos), mimetype='application/gzip')
+            nombre += '.gz'
+        else:
+            respuesta = Response(trozos, mimetype='application/json')
+        respuesta.headers['Content-Disposition'] = f'attachment; filename="{nombre}"'
+        respuesta.headers['X-Resumen-Exportacion'] = json.dumps(resumen)
+        return respuesta
     
     except Exception as e:
         print(f"❌ Error exportando datos: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Importación incremental (?modo=upsert): registros por lote y errores reportados
+TAMANO_LOTE_IMPORTACION = 500
+MAX_ERRORES_IMPORTACION = 500
+CAMPOS_REQUERIDOS_UBICACION = ['nombre', 'ciudad', 'direccion', 'lat', 'lon']
+ESTADOS_VALIDOS = {'activo', 'planeado', 'proxima_apertura', 'en_construccion'}
+
+class LectorJSONIncremental:
+    """Lee un documento de exportación desde un flujo, registro a registro
+
+    Solo se mantiene en memoria el trozo pendiente de analizar: los arreglos
+    de cada categoría se recorren elemento por elemento con `raw_decode` y el
+    resto de claves (versión, fecha, total) se leen enteras y se descartan.
+    Acepta también el documento comprimido con gzip que genera la exportación.
+    """
+
+    def __init__(self, flujo, tamano_trozo=TAMANO_TROZO_EXPORTACION):
+        self._flujo = flujo
+        self._tamano_trozo = tamano_trozo
+        self._decodificador = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._gzip = None
+        self._primer_trozo = True
+        self._texto = ''
+        self._pos = 0
+        self._descartados = 0
+        self._fin = False
+
+    def _leer(self):
+        """Añade el siguiente trozo del flujo al texto pendiente; False al terminar"""
+        if self._fin:
+            return False
+        datos = self._flujo.read(self._tamano_trozo)
+        if self._primer_trozo:
+            # Una lectura corta podría dejar partida la firma de gzip
+            while 0 < len(datos) < 2:
+                resto = self._flujo.read(self._tamano_trozo)
+                if not resto:
+                    break
+                datos += resto
+            if datos[:2] == b'\x1f\x8b':
+                self._gzip = zlib.decompressobj(31)
+        self._primer_trozo = False
+        if not datos:
+            self._fin = True
+            datos = self._gzip.flush() if self._gzip else b''
+        elif self._gzip:
+            datos = self._gzip.decompress(datos)
+        # Compactar lo ya consumido antes de añadir el trozo nuevo
+        self._descartados += self._pos
+        self._texto = self._texto[self._pos:] + self._utf8.decode(datos, final=self._fin)
+        self._pos = 0
+        return True
+
+    def _error(self, mensaje):
+        return ValueError(f'{mensaje} (carácter {self._descartados + self._pos})')
+
+    def _siguiente(self):
+        """Devuelve el siguiente carácter que no sea espacio, sin consumirlo"""
+        while True:
+            while self._pos < len(self._texto) and self._texto[self._pos] in ' \t\r\n':
+                self._pos += 1
+            if self._pos < len(self._texto):
+                return self._texto[self._pos]
+            if not self._leer():
+                raise self._error('Fin inesperado del JSON')
+
+    def _consumir(self, esperados):
+        caracter = self._siguiente()
+        if caracter not in esperados:
+            raise self._error(f"Se esperaba {' o '.join(repr(c) for c in esperados)}")
+        self._pos += 1
+        return caracter
+
+    def _valor(self):
+        """Decodifica un valor completo, leyendo más trozos si quedó cortado"""
+        self._siguiente()
+        while True:
+            try:
+                valor, fin = self._decodificador.raw_decode(self._texto, self._pos)
+            except json.JSONDecodeError as e:
+                if not self._leer():
+                    raise self._error(f'JSON inválido: {e.msg}')
+                continue
+            # Un número al final del trozo podría continuar en el siguiente
+            if fin == len(self._texto) and self._leer():
+                continue
+            self._pos = fin
+            return valor
+
+    def registros(self, categorias):
+        """Genera (categoria, indice, registro) para cada elemento de las categorías"""
+        self._consumir('{')
+        if self._siguiente() == '}':
+            return
+        while True:
+            clave = self._valor()
+            if not isinstance(clave, str):
+                raise self._error('Se esperaba el nombre de una clave')
+            self._consumir(':')
+            if clave in categorias and self._siguiente() == '[':
+                self._pos += 1
+                indice = 0
+                if self._siguiente() == ']':
+                    self._pos += 1
+                else:
+                    while True:
+                        yield clave, indice, self._valor()
+                        indice += 1
+                        if self._consumir(',]') == ']':
+                            break
+            else:
+                self._valor()
+            if self._consumir(',}') == '}':
+                return
+
+def validar_ubicacion(registro, parcial=False):
+    """Devuelve el motivo por el que un registro no es válido, o None
+
+    Con `parcial` solo se revisan los campos presentes (cambios de una edición).
+    """
+    if not isinstance(registro, dict):
+        return 'El registro no es un objeto JSON'
+    for campo in CAMPOS_REQUERIDOS_UBICACION:
+        if parcial and campo not in registro:
+            continue
+        if campo not in registro or registro[campo] is None or not str(registro[campo]).strip():
+            return f'Campo requerido: {campo}'
+    for campo, limite in (('lat', 90), ('lon', 180)):
+        if campo not in registro:
+            continue
+        valor = registro[campo]
+        if isinstance(valor, bool):
+            return f'{campo} debe ser numérico'
+        try:
+            numero = float(valor)
+        except (TypeError, ValueError):
+            return f'{campo} debe ser numérico'
+        if not math.isfinite(numero) or abs(numero) > limite:
+            return f'{campo} fuera de rango: {valor}'
+    if 'estado' in registro and registro['estado'] not in ESTADOS_VALIDOS:
+        return f"Estado desconocido: {registro['estado']}"
+    if 'id' in registro and (not isinstance(registro['id'], str) or not registro['id'].strip()):
+        return 'El id debe ser un texto no vacío'
+    return None
+
+def validar_coleccion_completa(registros):
+    """Motivo por el que una colección no puede reemplazar a la actual, o None
+
+    Cada registro necesita un id y no puede repetirse (comparado como texto,
+    igual que el índice único de SQLite), así los dos motores aceptan lo mismo.
+    """
+    if not isinstance(registros, list):
+        return 'Se esperaba una lista de registros'
+    vistos, repetidos = set(), set()
+    for posicion, registro in enumerate(registros):
+        if not isinstance(registro, dict) or registro.get('id') is None:
+            return f'Registro {posicion} sin id'
+        registro_id = str(registro['id'])
+        if registro_id in vistos:
+            repetidos.add(registro_id)
+        vistos.add(registro_id)
+    if repetidos:
+        return f"IDs duplicados: {', '.join(sorted(repetidos))}"
+    return None
+
+def importar_por_lotes(flujo):
+    """Inserta o actualiza por id los registros de un documento de exportación
+
+    Los registros válidos se acumulan por colección y se escriben en lotes de
+    TAMANO_LOTE_IMPORTACION (una sola escritura por colección y lote); los
+    inválidos se saltan y se devuelven en la lista de errores. Un error de
+    sintaxis detiene la lectura, pero los lotes ya escritos se conservan.
+    """
+    tipos = {archivo: tipo for tipo, archivo in ARCHIVOS_POR_TIPO.items()}
+    resumen = {categoria: {'insertados': 0, 'actualizados': 0, 'errores': 0} for categoria in CATEGORIAS_EXPORTACION}
+    pendientes = {categoria: {} for categoria in CATEGORIAS_EXPORTACION}
+    errores = []
+
+    def escribir(categoria):
+        lote = pendientes[categoria]
+        if lote:
+            insertados, actualizados = almacen.upsert_lote(f'{categoria}.json', list(lote.values()))
+            resumen[categoria]['insertados'] += insertados
+            resumen[categoria]['actualizados'] += actualizados
+            pendientes[categoria] = {}
+
+    def anotar_error(categoria, indice, registro, mensaje):
+        resumen[categoria]['errores'] += 1
+        if len(errores) < MAX_ERRORES_IMPORTACION:
+            registro_id = registro.get('id') if isinstance(registro, dict) else None
+            errores.append({'categoria': categoria, 'indice': indice, 'id': registro_id, 'error': mensaje})
+
+    error_lectura = None
+    try:
+        for categoria, indice, registro in LectorJSONIncremental(flujo).registros(CATEGORIAS_EXPORTACION):
+            error = validar_ubicacion(registro)
+            if error:
+                anotar_error(categoria, indice, registro, error)
+                continue
+            if 'id' not in registro:
+                tipo = tipos[f'{categoria}.json']
+                registro['id'] = generar_id_unico(tipo)
+                # El ID reservado podría coincidir con uno del lote aún sin escribir
+                while registro['id'] in pendientes[categoria]:
+                    registro['id'] = generar_id_unico(tipo)
+            # Dentro del lote, la última aparición de un id es la que vale
+            pendientes[categoria][registro['id']] = registro
+            if len(pendientes[categoria]) >= TAMANO_LOTE_IMPORTACION:
+                escribir(categoria)
+    except ValueError as e:
+        error_lectura = str(e)
+
+    for categoria in CATEGORIAS_EXPORTACION:
+        escribir(categoria)
+
+    return {
+        'resumen': resumen,
+        'errores': errores,
+        'total_errores': sum(r['errores'] for r in resumen.values()),
+        'error_lectura': error_lectura
+    }
+
 @app.route('/api/importar-datos', methods=['POST'])
 def importar_datos():
-    """Importar datos desde JSON (reemplaza todo)"""
+    """Importar datos desde JSON (reemplaza todo, o ?modo=upsert para actualizar por id)"""
     if not session.get('mantenimiento_autorizado'):
         return jsonify({'error': 'No autorizado'}), 401
     
+    if request.args.get('modo') == 'upsert':
+        return importar_datos_upsert()
+    
     try:
         datos = request.get_json()
         
@@ -107,6 +472,12 @@ def importar_datos():
             'tiendas_satelite': datos.get('tiendas_satelite', [])
         }
         
+        # Se valida todo antes de reemplazar ninguna colección
+        for categoria, datos_categoria in categorias.items():
+            error = validar_coleccion_completa(datos_categoria)
+            if error:
+                return jsonify({'success': False, 'error': f'{categoria}: {error}'}), 400
+        
         for categoria, datos_categoria in categorias.items():
             archivo = f"{categoria}.json"
             if guardar_datos_en_json(archivo, datos_categoria):
@@ -129,42 +500,275 @@ def importar_datos():
         print(f"❌ Error importando datos: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def importar_datos_upsert():
+    """Importación incremental: lee el cuerpo en streaming, valida y actualiza por id"""
+    try:
+        resultado = importar_por_lotes(request.stream)
+        resumen = resultado['resumen']
+        total = sum(r['insertados'] + r['actualizados'] for r in resumen.values())
+        print(f"📥 Importación incremental: {total} registros, {resultado['total_errores']} con errores")
+        
+        if resultado['error_lectura']:
+            print(f"⚠️  Importación interrumpida: {resultado['error_lectura']}")
+            return jsonify({
+                'success': False,
+                'error': f"Archivo inválido: {resultado['error_lectura']}",
+                **resultado,
+                'total': total
+            }), 400
+        
+        return jsonify({
+            'success': True,
+            'message': 'Datos importados correctamente',
+            **resultado,
+            'total': total
+        })
+    
+    except Exception as e:
+        print(f"❌ Error importando datos: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+class AlmacenBackups:
+    """Backups como manifiestos que apuntan a objetos comprimidos por colección
+
+    Cada objeto se guarda una vez en `objetos/<sha256>` (zstd si está
+    instalado, si no gzip): una colección que no cambió entre dos backups
+    reutiliza el mismo objeto. Si cambió poco, el objeto es un delta por
+    registro sobre el del backup anterior (hasta BACKUPS_MAX_DELTAS seguidos).
+    Cada manifiesto guarda la cadena completa de objetos que necesita, así la
+    retención borra los que ya no alcanza ningún manifiesto sin descomprimir.
+    """
+
+    def __init__(self, ruta, recientes, diarios, semanales, max_deltas):
+        self.ruta = ruta
+        self.recientes = recientes
+        self.diarios = diarios
+        self.semanales = semanales
+        self.max_deltas = max_deltas
+        self._ultimos = {}  # categoría -> (versión del almacén, entrada del manifiesto)
+
+    def _ruta_objeto(self, clave):
+        for extension in ('.zst', '.gz'):
+            ruta = os.path.join(self.ruta, 'objetos', clave + extension)
+            if os.path.exists(ruta):
+                return ruta
+        return None
+
+    def _ruta_manifiesto(self, backup_id):
+        return os.path.join(self.ruta, 'manifiestos', backup_id + '.json')
+
+    def _escribir_objeto(self, contenido):
+        """Guarda el objeto si no existe; devuelve (clave, bytes escritos)"""
+        texto = json.dumps(contenido, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        clave = hashlib.sha256(texto).hexdigest()
+        if self._ruta_objeto(clave):
+            return clave, 0
+        if zstandard:
+            comprimido, extension = zstandard.ZstdCompressor(level=10).compress(texto), '.zst'
+        else:
+            compresor = zlib.compressobj(9, zlib.DEFLATED, 31)
+            comprimido, extension = compresor.compress(texto) + compresor.flush(), '.gz'
+        ruta = os.path.join(self.ruta, 'objetos', clave + extension)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta + '.tmp', 'wb') as f:
+            f.write(comprimido)
+        os.replace(ruta + '.tmp', ruta)
+        return clave, len(comprimido)
+
+    def _leer_objeto(self, clave):
+        ruta = self._ruta_objeto(clave)
+        if ruta is None:
+            raise FileNotFoundError(f'Objeto de backup no encontrado: {clave}')
+        with open(ruta, 'rb') as f:
+            datos = f.read()
+        if ruta.endswith('.zst'):
+            if zstandard is None:
+                raise RuntimeError('Este backup usa zstd: instala el paquete zstandard para restaurarlo')
+            datos = zstandard.ZstdDecompressor().decompress(datos)
+        else:
+            datos = zlib.decompress(datos, 31)
+        return json.loads(datos)
+
+    def _registros(self, clave, cache):
+        """Reconstruye los registros de un objeto, aplicando la cadena de deltas"""
+        if clave not in cache:
+            objeto = self._leer_objeto(clave)
+            if 'base' in objeto:
+                base = {registro.get('id'): registro for registro in self._registros(objeto['base'], cache)}
+                cambios = {registro['id']: registro for registro in objeto['cambios']}
+                cache[clave] = [cambios[i] if i in cambios else base[i] for i in objeto['ids']]
+            else:
+                cache[clave] = objeto['registros']
+        return cache[clave]
+
+    @staticmethod
+    def _huella(registros):
+        texto = json.dumps(registros, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+    def manifiestos(self):
+        """Manifiestos guardados, del más reciente al más antiguo"""
+        carpeta = os.path.join(self.ruta, 'manifiestos')
+        if not os.path.isdir(carpeta):
+            return []
+        resultado = []
+        for nombre in os.listdir(carpeta):
+            if nombre.endswith('.json'):
+                with open(os.path.join(carpeta, nombre), 'r', encoding='utf-8') as f:
+                    resultado.append(json.load(f))
+        return sorted(resultado, key=lambda manifiesto: manifiesto['creado'], reverse=True)
+
+    def _entrada_coleccion(self, categoria, anterior, cache):
+        """Objeto del backup para una colección: reutilizado, delta o completo"""
+        archivo = f'{categoria}.json'
+        version = almacen.version(archivo)
+        ultimo = self._ultimos.get(categoria)
+        # Sin escrituras desde el último backup de este proceso: ni siquiera se serializa
+        if ultimo and ultimo[0] == version and anterior and anterior['huella'] == ultimo[1]['huella'] \
+                and all(self._ruta_objeto(clave) for clave in anterior['cadena']):
+            return dict(anterior, modo='reutilizado', bytes=0)
+
+        registros = almacen.cargar(archivo)
+        huella = self._huella(registros)
+        if anterior and anterior['huella'] == huella and all(self._ruta_objeto(clave) for clave in anterior['cadena']):
+            entrada = dict(anterior, modo='reutilizado', bytes=0)
+        else:
+            entrada = None
+            # El delta se arma por id: registros sin id (o con ids repetidos) van en un objeto completo
+            con_id = all(isinstance(registro, dict) and registro.get('id') is not None for registro in registros)
+            ids = [registro['id'] for registro in registros] if con_id else []
+            if anterior and con_id and len(anterior['cadena']) <= self.max_deltas and len(set(ids)) == len(ids):
+                try:
+                    base = {registro.get('id'): registro for registro in self._registros(anterior['objeto'], cache)}
+                except (OSError, ValueError, RuntimeError):
+                    base = None
+                if base is not None:
+                    # Solo los registros nuevos o modificados; los eliminados no aparecen en `ids`
+                    cambios = [registro for registro in registros if base.get(registro['id']) != registro]
+                    if len(cambios) <= len(registros) // 2:
+                        clave, escritos = self._escribir_objeto({'base': anterior['objeto'], 'ids': ids, 'cambios': cambios})
+                        entrada = {'objeto': clave, 'cadena': [clave] + anterior['cadena'], 'modo': 'delta', 'bytes': escritos}
+            if entrada is None:
+                clave, escritos = self._escribir_objeto({'registros': registros})
+                entrada = {'objeto': clave, 'cadena': [clave], 'modo': 'completo', 'bytes': escritos}
+            entrada.update(huella=huella, registros=len(registros))
+        self._ultimos[categoria] = (version, entrada)
+        return entrada
+
+    def crear(self):
+        """Crea un backup de las cuatro colecciones y aplica la retención; devuelve el manifiesto"""
+        os.makedirs(os.path.join(self.ruta, 'manifiestos'), exist_ok=True)
+        with _bloqueo_archivo(os.path.join(self.ruta, '.lock')):
+            manifiestos = self.manifiestos()
+            anterior = manifiestos[0]['colecciones'] if manifiestos else {}
+            cache = {}
+            ahora = datetime.now()
+            backup_id = f"backup_{ahora.strftime('%Y%m%d_%H%M%S')}"
+            sufijo = 1
+            while os.path.exists(self._ruta_manifiesto(backup_id)):
+                sufijo += 1
+                backup_id = f"backup_{ahora.strftime('%Y%m%d_%H%M%S')}_{sufijo}"
+
+            manifiesto = {
+                'id': backup_id,
+                'creado': ahora.isoformat(),
+                'colecciones': {
+                    categoria: self._entrada_coleccion(categoria, anterior.get(categoria), cache)
+                    for categoria in CATEGORIAS_EXPORTACION
+                }
+            }
+            ruta = self._ruta_manifiesto(backup_id)
+            with open(ruta + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(manifiesto, f, indent=4, ensure_ascii=False)
+            os.replace(ruta + '.tmp', ruta)
+            manifiesto['eliminados'] = self._aplicar_retencion()
+        return manifiesto
+
+    def _aplicar_retencion(self):
+        """Conserva los N más recientes, todos los de hoy y el más reciente de
+        cada uno de los últimos N días y N semanas"""
+        manifiestos = self.manifiestos()
+        # Un id recién devuelto por /api/backup-datos sigue siendo restaurable
+        # aunque se creen más backups el mismo día
+        conservar = {manifiesto['id'] for manifiesto in manifiestos[:max(self.recientes, 1)]}
+        hoy = datetime.now().date()
+        dias, semanas = set(), set()
+        for manifiesto in manifiestos:
+            creado = datetime.fromisoformat(manifiesto['creado'])
+            dia, semana = creado.date(), tuple(creado.isocalendar())[:2]
+            if dia == hoy:
+                conservar.add(manifiesto['id'])
+            if dia not in dias and len(dias) < self.diarios:
+                dias.add(dia)
+                conservar.add(manifiesto['id'])
+            if semana not in semanas and len(semanas) < self.semanales:
+                semanas.add(semana)
+                conservar.add(manifiesto['id'])
+
+        eliminados = []
+        alcanzables = set()
+        for manifiesto in manifiestos:
+            if manifiesto['id'] in conservar:
+                for entrada in manifiesto['colecciones'].values():
+                    alcanzables.update(entrada['cadena'])
+            else:
+                os.remove(self._ruta_manifiesto(manifiesto['id']))
+                eliminados.append(manifiesto['id'])
+
+        carpeta = os.path.join(self.ruta, 'objetos')
+        for nombre in os.listdir(carpeta) if os.path.isdir(carpeta) else []:
+            if nombre.split('.')[0] not in alcanzables:
+                os.remove(os.path.join(carpeta, nombre))
+        return eliminados
+
+    def restaurar(self, backup_id):
+        """Reconstruye las colecciones de un backup y las guarda; devuelve {categoría: registros}"""
+        ruta = self._ruta_manifiesto(backup_id)
+        if not re.fullmatch(r'backup_[\w]+', backup_id) or not os.path.exists(ruta):
+            return None
+        with open(ruta, 'r', encoding='utf-8') as f:
+            manifiesto = json.load(f)
+
+        # Se reconstruye y verifica todo antes de escribir nada
+        cache = {}
+        colecciones = {}
+        for categoria, entrada in manifiesto['colecciones'].items():
+            registros = self._registros(entrada['objeto'], cache)
+            if self._huella(registros) != entrada['huella']:
+                raise ValueError(f'El backup {backup_id} está dañado ({categoria})')
+            colecciones[categoria] = registros
+
+        for categoria, registros in colecciones.items():
+            almacen.guardar(f'{categoria}.json', registros)
+        return {categoria: len(registros) for categoria, registros in colecciones.items()}
+
+almacen_backups = AlmacenBackups(BACKUPS_PATH, BACKUPS_RECIENTES, BACKUPS_DIARIOS, BACKUPS_SEMANALES, BACKUPS_MAX_DELTAS)
+
 @app.route('/api/backup-datos', methods=['POST'])
 def backup_datos():
-    """Crear backup con timestamp"""
+    """Crear backup incremental (solo se guardan las colecciones que cambiaron)"""
     if not session.get('mantenimiento_autorizado'):
         return jsonify({'error': 'No autorizado'}), 401
     
     try:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_data = {
-            'version': '1.0',
-            'backup_timestamp': timestamp,
-            'exportado': datetime.now().isoformat(),
-            'centros_distribucion': cargar_datos_desde_json('centros_distribucion.json'),
-            'distribuidores_autorizados': cargar_datos_desde_json('distribuidores_autorizados.json'),
-            'tiendas_oro': cargar_datos_desde_json('tiendas_oro.json'),
-            'tiendas_satelite': cargar_datos_desde_json('tiendas_satelite.json')
-        }
-        
-        # Guardar archivo de backup
-        backup_filename = f'backup_{timestamp}.json'
-        backup_path = os.path.join(DATABASE_PATH, backup_filename)
-        
-        with open(backup_path, 'w', encoding='utf-8') as f:
-            json.dump(backup_data, f, indent=2, ensure_ascii=False)
-        
-        print(f"💾 Backup creado: {backup_filename}")
+        manifiesto = almacen_backups.crear()
+        colecciones = manifiesto['colecciones']
+        escritos = sum(entrada['bytes'] for entrada in colecciones.values())
+        print(f"💾 Backup creado: {manifiesto['id']} ({escritos} bytes nuevos, "
+              f"{len(manifiesto['eliminados'])} backups antiguos eliminados)")
         
         return jsonify({
             'success': True, 
-            'backup_file': backup_filename,
-            'timestamp': timestamp,
+            'backup_file': manifiesto['id'],
+            'timestamp': manifiesto['creado'],
+            'bytes_escritos': escritos,
+            'modos': {categoria: entrada['modo'] for categoria, entrada in colecciones.items()},
+            'eliminados': manifiesto['eliminados'],
             'resumen': {
-                'centros': len(backup_data['centros_distribucion']),
-                'distribuidores': len(backup_data['distribuidores_autorizados']),
-                'tiendas_oro': len(backup_data['tiendas_oro']),
-                'tiendas_satelite': len(backup_data['tiendas_satelite'])
+                'centros': colecciones['centros_distribucion']['registros'],
+                'distribuidores': colecciones['distribuidores_autorizados']['registros'],
+                'tiendas_oro': colecciones['tiendas_oro']['registros'],
+                'tiendas_satelite': colecciones['tiendas_satelite']['registros']
             }
         })
     
@@ -172,11 +776,218 @@ def backup_datos():
         print(f"❌ Error creando backup: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/backups')
+def listar_backups():
+    """Backups disponibles para restaurar"""
+    if not session.get('mantenimiento_autorizado'):
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    return jsonify([
+        {
+            'id': manifiesto['id'],
+            'creado': manifiesto['creado'],
+            'registros': {categoria: entrada['registros'] for categoria, entrada in manifiesto['colecciones'].items()}
+        }
+        for manifiesto in almacen_backups.manifiestos()
+    ])
+
+@app.route('/api/backups/<backup_id>/restaurar', methods=['POST'])
+def restaurar_backup(backup_id):
+    """Restaurar todas las colecciones al estado de un backup (reemplaza todo)"""
+    if not session.get('mantenimiento_autorizado'):
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    try:
+        resumen = almacen_backups.restaurar(backup_id)
+        if resumen is None:
+            return jsonify({'success': False, 'error': 'Backup no encontrado'}), 404
+        print(f"♻️  Backup restaurado: {backup_id} ({sum(resumen.values())} registros)")
+        return jsonify({'success': True, 'resumen': resumen, 'total': sum(resumen.values())})
+    
+    except Exception as e:
+        print(f"❌ Error restaurando backup: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+# ============================================================================
+# COMPRESIÓN DE RESPUESTAS Y ARCHIVOS ESTÁTICOS
+# ============================================================================
+
+_contadores_compresion = {
+    'respuestas_comprimidas': 0,
+    'reutilizadas': 0,
+    'estaticos_precomprimidos': 0,
+    'bytes_originales': 0,
+    'bytes_enviados': 0
+}
+_cache_comprimidos = OrderedDict()  # (etag, codificación) -> (tamaño original, bytes comprimidos)
+_cache_comprimidos_bytes = 0
+_compresion_lock = threading.Lock()
+_huellas_estaticos = {}  # ruta relativa -> (mtime, huella del contenido)
+
+# /static/js/mapa.3f2a9c1b7d4e.js -> js/mapa.js con huella 3f2a9c1b7d4e
+PATRON_HUELLA = re.compile(r'(.+)\.([0-9a-f]{12})(\.[^./]+)')
+
+def sumar_compresion(originales, enviados, contador='respuestas_comprimidas'):
+    with _compresion_lock:
+        _contadores_compresion[contador] += 1
+        _contadores_compresion['bytes_originales'] += originales
+        _contadores_compresion['bytes_enviados'] += enviados
+
+def obtener_estadisticas_compresion():
+    with _compresion_lock:
+        estadisticas = dict(_contadores_compresion)
+        estadisticas['bytes_ahorrados'] = estadisticas['bytes_originales'] - estadisticas['bytes_enviados']
+        estadisticas['cache_bytes'] = _cache_comprimidos_bytes
+        estadisticas['codificaciones'] = ['br', 'gzip'] if brotli else ['gzip']
+        return estadisticas
+
+def elegir_codificacion():
+    """Content-Encoding preferido que acepta el cliente: 'br', 'gzip' o None"""
+    if brotli and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+def comprimir_bytes(datos, codificacion):
+    if codificacion == 'br':
+        return brotli.compress(datos, quality=5)
+    compresor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compresor.compress(datos) + compresor.flush()
+
+def obtener_comprimido(etag, codificacion, datos):
+    """Versión comprimida de un cuerpo con ETag fuerte, reutilizada mientras no cambie"""
+    global _cache_comprimidos_bytes
+    clave = (etag, codificacion)
+    with _compresion_lock:
+        entrada = _cache_comprimidos.get(clave)
+        if entrada and entrada[0] == len(datos):
+            _cache_comprimidos.move_to_end(clave)
+            _contadores_compresion['reutilizadas'] += 1
+            return entrada[1]
+
+    comprimido = comprimir_bytes(datos, codificacion)
+    with _compresion_lock:
+        anterior = _cache_comprimidos.pop(clave, None)
+        if anterior:
+            _cache_comprimidos_bytes -= len(anterior[1])
+        _cache_comprimidos[clave] = (len(datos), comprimido)
+        _cache_comprimidos_bytes += len(comprimido)
+        while _cache_comprimidos_bytes > COMPRESION_CACHE_BYTES and len(_cache_comprimidos) > 1:
+            _, (_, viejo) = _cache_comprimidos.popitem(last=False)
+            _cache_comprimidos_bytes -= len(viejo)
+    return comprimido
+
+@app.after_request
+def comprimir_respuesta(respuesta):
+    """Comprime según Accept-Encoding las respuestas de texto que superan el umbral"""
+    if respuesta.mimetype not in TIPOS_COMPRIMIBLES or 'Content-Encoding' in respuesta.headers:
+        return respuesta
+    respuesta.vary.add('Accept-Encoding')
+    if respuesta.status_code != 200 or respuesta.direct_passthrough or request.method == 'HEAD':
+        return respuesta
+    codificacion = elegir_codificacion()
+    if codificacion is None:
+        return respuesta
+
+    etag, debil = respuesta.get_etag()
+    if respuesta.is_streamed:
+        # Exportaciones en streaming: se comprimen trozo a trozo
+        respuesta.response = comprimir_trozos(respuesta.response, codificacion)
+        respuesta.headers.pop('Content-Length', None)
+    else:
+        datos = respuesta.get_data()
+        if len(datos) < COMPRESION_MIN_BYTES:
+            return respuesta
+        if etag and not debil:
+            comprimido = obtener_comprimido(etag, codificacion, datos)
+        else:
+            comprimido = comprimir_bytes(datos, codificacion)
+        respuesta.set_data(comprimido)
+        sumar_compresion(len(datos), len(comprimido))
+
+    respuesta.headers['Content-Encoding'] = codificacion
+    if etag:
+        # Otra representación del mismo contenido: ETag débil (If-None-Match sigue validando)
+        respuesta.set_etag(etag, weak=True)
+    return respuesta
+
+def huella_estatico(ruta):
+    """Huella del contenido de un archivo estático (None si no existe)"""
+    completa = safe_join(os.path.join(BASE_DIR, 'static'), ruta)
+    try:
+        mtime = os.path.getmtime(completa) if completa else None
+    except OSError:
+        mtime = None
+    if mtime is None:
+        return None
+    entrada = _huellas_estaticos.get(ruta)
+    if entrada and entrada[0] == mtime:
+        return entrada[1]
+    with open(completa, 'rb') as f:
+        huella = hashlib.sha256(f.read()).hexdigest()[:12]
+    _huellas_estaticos[ruta] = (mtime, huella)
+    return huella
+
+@app.template_global()
+def url_estatica(ruta):
+    """URL de un estático con la huella de su contenido, cacheable como inmutable"""
+    huella = huella_estatico(ruta)
+    if huella is None:
+        return f'/static/{ruta}'
+    base, extension = os.path.splitext(ruta)
+    return f'/static/{base}.{huella}{extension}'
+
+def variante_comprimida(ruta, codificacion):
+    """Ruta del .gz/.br de un estático: el que venga junto al archivo o uno generado en la caché"""
+    completa = safe_join(os.path.join(BASE_DIR, 'static'), ruta)
+    extension = '.br' if codificacion == 'br' else '.gz'
+    if not completa or not os.path.isfile(completa) or os.path.getsize(completa) < COMPRESION_MIN_BYTES:
+        return None
+    mtime = os.path.getmtime(completa)
+    for variante in (completa + extension, os.path.abspath(os.path.join(ESTATICOS_COMPRIMIDOS_PATH, ruta + extension))):
+        if os.path.exists(variante) and os.path.getmtime(variante) >= mtime:
+            return variante
+
+    with open(completa, 'rb') as f:
+        comprimido = comprimir_bytes(f.read(), codificacion)
+    os.makedirs(os.path.dirname(variante), exist_ok=True)
+    ruta_temporal = f"{variante}.{os.getpid()}.tmp"
+    with open(ruta_temporal, 'wb') as f:
+        f.write(comprimido)
+    os.replace(ruta_temporal, variante)
+    return variante
 
 # Ruta para archivos estáticos
 @app.route('/static/<path:path>')
 def serve_static(path):
-    return send_from_directory('static', path)
+    """Estáticos: con huella se cachean un año como inmutables; variante .br/.gz si el cliente la acepta"""
+    inmutable = False
+    coincidencia = PATRON_HUELLA.fullmatch(path)
+    if coincidencia:
+        ruta_real = coincidencia.group(1) + coincidencia.group(3)
+        huella = huella_estatico(ruta_real)
+        if huella is not None:
+            # Una huella antigua sirve el contenido actual, pero sin caché larga
+            inmutable = huella == coincidencia.group(2)
+            path = ruta_real
+
+    mimetype = mimetypes.guess_type(path)[0]
+    codificacion = elegir_codificacion() if mimetype in TIPOS_COMPRIMIBLES else None
+    variante = variante_comprimida(path, codificacion) if codificacion else None
+    if variante:
+        respuesta = send_file(variante, mimetype=mimetype, conditional=True)
+        respuesta.headers['Content-Encoding'] = codificacion
+        respuesta.vary.add('Accept-Encoding')
+        if respuesta.status_code == 200:
+            original = os.path.getsize(safe_join(os.path.join(BASE_DIR, 'static'), path))
+            sumar_compresion(original, os.path.getsize(variante), 'estaticos_precomprimidos')
+    else:
+        respuesta = send_from_directory('static', path)
+
+    respuesta.headers['Cache-Control'] = 'public, max-age=31536000, immutable' if inmutable else 'no-cache'
+    return respuesta
 
 @app.route('/acceso-mantenimiento')
 def acceso_mantenimiento():
@@ -229,28 +1040,1199 @@ def mantenimiento():
         return redirect('/acceso-mantenimiento')
     return render_template('mantenimiento.html')
 
+@app.route('/api/cache-estadisticas')
+def cache_estadisticas():
+    """Contadores de la caché de colecciones"""
+    if not session.get('mantenimiento_autorizado'):
+        return jsonify({'error': 'No autorizado'}), 401
+    estadisticas = obtener_estadisticas_cache()
+    estadisticas['ids_duplicados'] = almacen.duplicados()
+    estadisticas['compresion'] = obtener_estadisticas_compresion()
+    return jsonify(estadisticas)
+
 @app.route('/logout-mantenimiento')
 def logout_mantenimiento():
     """Cerrar sesión de mantenimiento"""
     session.pop('mantenimiento_autorizado', None)
     return redirect('/')
 
+# ============================================================================
+# CACHÉ DE COLECCIONES EN MEMORIA
+# ============================================================================
+
+# Caché compartida por todo el proceso: archivo -> {'firma': ..., 'datos': [...]}
+# La firma (mtime, tamaño, inodo en JSON; versión en SQLite) permite detectar
+# cambios hechos por otros workers sin necesidad de reiniciar.
+_cache_colecciones = {}
+_cache_lock = threading.Lock()
+_cache_contadores = {'aciertos': 0, 'fallos': 0}
+# Cada cambio observado en una colección recibe un número de versión nuevo
+_contador_versiones = itertools.count(1)
+
+def _firma_archivo(ruta):
+    """Devuelve (mtime, tamaño, inodo) del archivo o None si no existe"""
+    try:
+        st = os.stat(ruta)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def _copiar_registros(datos):
+    """Copia superficial de cada registro para que la caché no se modifique desde las rutas"""
+    return [dict(item) if isinstance(item, dict) else item for item in datos]
+
+def obtener_estadisticas_cache():
+    """Devuelve los contadores de aciertos/fallos de la caché de colecciones"""
+    with _cache_lock:
+        total = _cache_contadores['aciertos'] + _cache_contadores['fallos']
+        return {
+            'aciertos': _cache_contadores['aciertos'],
+            'fallos': _cache_contadores['fallos'],
+            'tasa_aciertos': round(_cache_contadores['aciertos'] / total, 4) if total else 0.0,
+            'colecciones': sorted(_cache_colecciones.keys()),
+            'motor': almacen.nombre
+        }
+
+# ============================================================================
+# MOTORES DE ALMACENAMIENTO (JSON / SQLITE)
+# ============================================================================
+
+class ContadoresEstadisticas:
+    """Activos, estados y aperturas por año de una colección, ajustados registro a registro
+
+    Los motores de almacenamiento los mantienen al insertar, actualizar o
+    eliminar, así las estadísticas no recorren la colección en cada consulta.
+    """
+
+    def __init__(self, registros=()):
+        self.total = 0
+        self.activos = 0
+        self.por_estado = {}
+        self.por_anio = {}
+        for registro in registros:
+            self.sumar(registro)
+
+    def sumar(self, registro, signo=1):
+        """Cuenta (signo=1) o descuenta (signo=-1) un registro"""
+        self.total += signo
+        estado = registro.get('estado', 'activo')
+        self.por_estado[estado] = self.por_estado.get(estado, 0) + signo
+        if not self.por_estado[estado]:
+            del self.por_estado[estado]
+        if registro.get('estado') == 'activo':
+            self.activos += signo
+        fecha = registro.get('fecha_apertura', '')
+        if fecha:
+            anio = str(fecha)[:4]
+            self.por_anio[anio] = self.por_anio.get(anio, 0) + signo
+            if not self.por_anio[anio]:
+                del self.por_anio[anio]
+
+    def resumen(self):
+        return {
+            'total': self.total,
+            'activos': self.activos,
+            'por_estado': dict(self.por_estado),
+            'aperturas_2026': self.por_anio.get('2026', 0),
+            'aperturas_por_anio': dict(sorted(self.por_anio.items()))
+        }
+
+
+@contextmanager
+def _bloqueo_archivo(ruta):
+    """Bloqueo exclusivo entre procesos (y reentrante dentro del mismo hilo)"""
+    activos = getattr(_bloqueos_hilo, 'rutas', None)
+    if activos is None:
+        activos = _bloqueos_hilo.rutas = set()
+    if ruta in activos:
+        yield
+        return
+
+    with open(ruta, 'a+b') as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        activos.add(ruta)
+        try:
+            yield
+        finally:
+            activos.discard(ruta)
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+_bloqueos_hilo = threading.local()
+
+
+def _numero_de_id(registro_id, prefijo):
+    """Parte numérica de un ID con el prefijo dado (D015 -> 15) o None"""
+    coincidencia = re.fullmatch(re.escape(prefijo) + r'(\d+)', str(registro_id))
+    return int(coincidencia.group(1)) if coincidencia else None
+
+def _maximo_numero_de_id(ids, prefijo):
+    return max((n for n in (_numero_de_id(i, prefijo) for i in ids) if n is not None), default=0)
+
+def _coordenadas(registro):
+    """(lat, lon) del registro como números, o None si no se puede ubicar"""
+    try:
+        return float(registro['lat']), float(registro['lon'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class ConflictoLote(Exception):
+    """Otra escritura cambió una colección del lote después de validarlo"""
+
+
+class ColeccionIndexada:
+    """Registros de una colección con índice id -> posición
+
+    Las búsquedas, reemplazos y eliminaciones por id son O(1). Las
+    eliminaciones dejan un hueco que se compacta cuando hay demasiados, así
+    se conserva el orden original de los registros. Los IDs duplicados que ya
+    existan en disco se detectan al construir el índice: la primera aparición
+    es la indexada (igual que la búsqueda lineal anterior) y las demás quedan
+    en `duplicados` para que vuelvan a indexarse si se elimina la primera.
+    """
+
+    def __init__(self, registros=(), archivo=''):
+        self.archivo = archivo
+        self._registros = []
+        self._huecos = 0
+        self.indice = {}
+        self.duplicados = {}
+        self.contadores = ContadoresEstadisticas()
+        for registro in registros:
+            self._agregar(registro)
+        if self.duplicados:
+            resumen = ', '.join(sorted(str(k) for k in self.duplicados))
+            print(f"⚠️  IDs duplicados en {archivo or 'colección'}: {resumen}")
+
+    def _agregar(self, registro):
+        registro_id = registro.get('id')
+        posicion = len(self._registros)
+        self._registros.append(registro)
+        self.contadores.sumar(registro)
+        if registro_id in self.indice:
+            self.duplicados.setdefault(registro_id, []).append(posicion)
+        else:
+            self.indice[registro_id] = posicion
+
+    def __iter__(self):
+        return (registro for registro in self._registros if registro is not None)
+
+    def __len__(self):
+        return len(self._registros) - self._huecos
+
+    def __contains__(self, registro_id):
+        return registro_id in self.indice
+
+    def ids(self):
+        return self.indice.keys()
+
+    def obtener(self, registro_id):
+        posicion = self.indice.get(registro_id)
+        return None if posicion is None else self._registros[posicion]
+
+    def reemplazar(self, registro):
+        """Inserta el registro o reemplaza el que tenga su mismo id"""
+        posicion = self.indice.get(registro.get('id'))
+        if posicion is None:
+            self._agregar(registro)
+        else:
+            self.contadores.sumar(self._registros[posicion], -1)
+            self.contadores.sumar(registro)
+            self._registros[posicion] = registro
+
+    def eliminar(self, registro_id):
+        posicion = self.indice.pop(registro_id, None)
+        if posicion is None:
+            return False
+        self.contadores.sumar(self._registros[posicion], -1)
+        self._registros[posicion] = None
+        self._huecos += 1
+        pendientes = self.duplicados.get(registro_id)
+        if pendientes:
+            self.indice[registro_id] = pendientes.pop(0)
+            if not pendientes:
+                del self.duplicados[registro_id]
+        if self._huecos > 32 and self._huecos > len(self._registros) // 2:
+            self._compactar()
+        return True
+
+    def _compactar(self):
+        """Reconstruye la lista sin huecos (mismo orden, mismo índice)"""
+        registros = [registro for registro in self._registros if registro is not None]
+        self._registros = []
+        self._huecos = 0
+        self.indice = {}
+        self.duplicados = {}
+        self.contadores = ContadoresEstadisticas()
+        for registro in registros:
+            self._agregar(registro)
+
+
+class AlmacenJSON:
+    """Motor de almacenamiento con un archivo JSON por colección
+
+    Cada colección es una instantánea (`<coleccion>.json`) más un diario de
+    cambios de solo-anexar (`<coleccion>.json.journal`) con una línea JSON por
+    inserción/actualización/eliminación. Las ediciones de un solo registro
+    solo escriben una línea; un hilo en segundo plano hace fsync por lotes y
+    compacta el diario sobre la instantánea cuando crece demasiado. Además,
+    cada cambio se anexa con una secuencia global a `cambios.jsonl`, que es lo
+    que lee /api/cambios.
+    """
+
+    nombre = 'json'
+
+    def __init__(self):
+        self._diarios = {}
+        self._pendientes_fsync = {}
+        self._lock_diarios = threading.RLock()
+        self._hilo = None
+        # Copia en memoria de cambios.jsonl, puesta al día leyendo solo lo anexado
+        self._cambios = {'ino': None, 'offset': 0, 'compactado': 0, 'seqs': [], 'entradas': []}
+        self._lock_cambios = threading.RLock()
+        self._escrituras = threading.local()
+
+    def _ruta(self, archivo):
+        return os.path.join(DATABASE_PATH, archivo)
+
+    def _ruta_diario(self, archivo):
+        return self._ruta(archivo) + '.journal'
+
+    def _ruta_bloqueo(self, archivo):
+        return self._ruta(archivo) + '.lock'
+
+    def inicializar(self, archivos):
+        """Crea los archivos vacíos que no existan y recupera los diarios y lotes pendientes"""
+        if os.path.isdir(DATABASE_PATH):
+            self._recuperar_lotes()
+        for archivo in archivos:
+            if not os.path.exists(self._ruta(archivo)):
+                self.guardar(archivo, [])
+                print(f"✅ Archivo inicializado: {archivo}")
+                continue
+            firma_diario = _firma_archivo(self._ruta_diario(archivo))
+            if firma_diario and firma_diario[1] > 0:
+                operaciones = self.compactar(archivo)
+                print(f"♻️  Diario recuperado: {archivo} ({operaciones} operaciones)")
+
+    # ------------------------------------------------------------------
+    # Lectura: instantánea + reproducción del diario
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _aplicar_operacion(datos, operacion):
+        """Aplica una línea del diario sobre la colección (idempotente por id)"""
+        op = operacion.get('op')
+        if op in ('insertar', 'actualizar'):
+            datos.reemplazar(operacion['registro'])
+        elif op == 'eliminar':
+            datos.eliminar(operacion.get('id'))
+
+    def _reproducir_diario(self, archivo, datos, desde, ino_esperado=None):
+        """Aplica las líneas completas del diario a partir de `desde`; devuelve (offset, operaciones)
+
+        Si se indica `ino_esperado` y el diario fue rotado por otro worker,
+        devuelve None para forzar una recarga completa.
+        """
+        ruta_diario = self._ruta_diario(archivo)
+        try:
+            with open(ruta_diario, 'rb') as f:
+                if ino_esperado is not None and os.fstat(f.fileno()).st_ino != ino_esperado:
+                    return None
+                f.seek(desde)
+                contenido = f.read()
+        except OSError:
+            return None if ino_esperado is not None else (desde, 0)
+
+        # Solo se consumen líneas terminadas en salto de línea: una línea
+        # a medio escribir (caída del proceso) se ignora hasta completarse
+        fin = contenido.rfind(b'\n') + 1
+        operaciones = 0
+        for linea in contenido[:fin].splitlines():
+            if not linea.strip():
+                continue
+            try:
+                operacion = json.loads(linea)
+            except ValueError:
+                print(f"⚠️  Línea de diario inválida en {archivo}, se ignora")
+                continue
+            self._aplicar_operacion(datos, operacion)
+            operaciones += 1
+        return desde + fin, operaciones
+
+    def _datos(self, archivo):
+        """Lista cacheada de la colección (sin copiar, solo para uso interno)"""
+        ruta_archivo = self._ruta(archivo)
+        firma = _firma_archivo(ruta_archivo)
+        if firma is None:
+            return []
+        firma_diario = _firma_archivo(self._ruta_diario(archivo))
+        ino_diario = firma_diario[2] if firma_diario else None
+        tamano_diario = firma_diario[1] if firma_diario else 0
+
+        with _cache_lock:
+            entrada = _cache_colecciones.get(archivo)
+            if entrada and entrada['firma'] == firma and entrada['ino_diario'] == ino_diario:
+                if entrada['offset'] >= tamano_diario:
+                    _cache_contadores['aciertos'] += 1
+                    return entrada['datos']
+                # Solo creció el diario: reproducir únicamente las líneas nuevas
+                resultado = self._reproducir_diario(archivo, entrada['datos'], entrada['offset'], ino_diario)
+                if resultado is not None:
+                    _cache_contadores['aciertos'] += 1
+                    entrada['offset'], operaciones = resultado
+                    entrada['operaciones'] += operaciones
+                    if operaciones:
+                        entrada['version'] = next(_contador_versiones)
+                    return entrada['datos']
+            _cache_contadores['fallos'] += 1
+
+        with _bloqueo_archivo(self._ruta_bloqueo(archivo)):
+            firma = _firma_archivo(ruta_archivo)
+            if firma is None:
+                return []
+            with open(ruta_archivo, 'r', encoding='utf-8') as f:
+                datos = ColeccionIndexada(json.load(f), archivo)
+            firma_diario = _firma_archivo(self._ruta_diario(archivo))
+            offset, operaciones = self._reproducir_diario(archivo, datos, 0)
+
+        with _cache_lock:
+            _cache_colecciones[archivo] = {
+                'firma': firma,
+                'ino_diario': firma_diario[2] if firma_diario else None,
+                'offset': offset,
+                'operaciones': operaciones,
+                'version': next(_contador_versiones),
+                'datos': datos
+            }
+        return datos
+
+    def cargar(self, archivo):
+        return _copiar_registros(self._datos(archivo))
+
+    def version(self, archivo):
+        """Versión de la colección en este proceso (cambia con cada modificación)"""
+        self._datos(archivo)
+        with _cache_lock:
+            return _cache_colecciones.get(archivo, {}).get('version', 0)
+
+    def version_compartida(self, archivo):
+        """Versión igual en todos los procesos para el mismo contenido: firma de la
+        instantánea, inodo del diario y posición leída (`version` es propia del proceso)"""
+        self._datos(archivo)
+        with _cache_lock:
+            entrada = _cache_colecciones.get(archivo)
+            return None if entrada is None else (entrada['firma'], entrada['ino_diario'], entrada['offset'])
+
+    def ultima_escritura(self, archivo):
+        """(versión compartida antes, después) de la última escritura de este hilo en la colección"""
+        return getattr(self._escrituras, 'versiones', {}).get(archivo)
+
+    # ------------------------------------------------------------------
+    # Escritura: diario de solo-anexar + compactación
+    # ------------------------------------------------------------------
+
+    def _escribir_instantanea(self, archivo, datos, version=None):
+        """Escribe la instantánea y vacía el diario (con el bloqueo tomado)"""
+        ruta_archivo = self._ruta(archivo)
+        # Escritura atómica: archivo temporal + reemplazo (cambia el inodo,
+        # así los demás workers detectan el cambio aunque el mtime coincida)
+        ruta_temporal = f"{ruta_archivo}.{os.getpid()}.tmp"
+        with open(ruta_temporal, 'w', encoding='utf-8') as f:
+            json.dump(list(datos), f, indent=4, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(ruta_temporal, ruta_archivo)
+
+        # Diario nuevo (inodo nuevo) para que los demás workers reabran el suyo
+        ruta_diario = self._ruta_diario(archivo)
+        ruta_temporal = f"{ruta_diario}.{os.getpid()}.tmp"
+        open(ruta_temporal, 'wb').close()
+        os.replace(ruta_temporal, ruta_diario)
+        self._cerrar_diario(archivo)
+
+        firma_diario = _firma_archivo(ruta_diario)
+        with _cache_lock:
+            _cache_colecciones[archivo] = {
+                'firma': _firma_archivo(ruta_archivo),
+                'ino_diario': firma_diario[2] if firma_diario else None,
+                'offset': 0,
+                'operaciones': 0,
+                'version': version or next(_contador_versiones),
+                'datos': ColeccionIndexada(_copiar_registros(datos), archivo)
+            }
+
+    def guardar(self, archivo, datos):
+        with _bloqueo_archivo(self._ruta_bloqueo(archivo)):
+            self._escribir_instantanea(archivo, datos)
+            self._registrar_cambios(archivo, [(None, 'reiniciar', None)])
+        return True
+
+    def compactar(self, archivo):
+        """Incorpora el diario a la instantánea; devuelve las operaciones compactadas"""
+        with _bloqueo_archivo(self._ruta_bloqueo(archivo)):
+            self._sincronizar_diario(archivo)
+            datos = self._datos(archivo)
+            with _cache_lock:
+                entrada = _cache_colecciones.get(archivo, {})
+                operaciones = entrada.get('operaciones', 0)
+                version = entrada.get('version')
+            # Compactar no cambia los datos: se conserva la versión
+            self._escribir_instantanea(archivo, datos, version)
+        return operaciones
+
+    def _abrir_diario(self, archivo):
+        """Devuelve el descriptor del diario, reabriéndolo si otro worker lo rotó"""
+        ruta_diario = self._ruta_diario(archivo)
+        f = self._diarios.get(archivo)
+        if f is not None:
+            firma = _firma_archivo(ruta_diario)
+            if firma is None or firma[2] != os.fstat(f.fileno()).st_ino:
+                self._cerrar_diario(archivo)
+                f = None
+        if f is None:
+            f = open(ruta_diario, 'ab')
+            self._diarios[archivo] = f
+            self._pendientes_fsync[archivo] = 0
+        return f
+
+    def _cerrar_diario(self, archivo):
+        with self._lock_diarios:
+            f = self._diarios.pop(archivo, None)
+            self._pendientes_fsync.pop(archivo, None)
+        if f is not None:
+            try:
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+
+    def _sincronizar_diario(self, archivo):
+        with self._lock_diarios:
+            f = self._diarios.get(archivo)
+            if f is not None and self._pendientes_fsync.get(archivo):
+                os.fsync(f.fileno())
+                self._pendientes_fsync[archivo] = 0
+
+    def _anexar(self, archivo, operacion):
+        """Escribe una operación en el diario y la aplica a la caché"""
+        return self._anexar_lote(archivo, [operacion])
+
+    def _anexar_lote(self, archivo, operaciones):
+        """Escribe varias operaciones en el diario con una sola escritura"""
+        linea = ''.join(json.dumps(operacion, ensure_ascii=False) + '\n' for operacion in operaciones).encode('utf-8')
+        with _bloqueo_archivo(self._ruta_bloqueo(archivo)):
+            # Asegura que la caché está al día antes de anexar
+            antes = self.version_compartida(archivo)
+            with _cache_lock:
+                offset = _cache_colecciones.get(archivo, {}).get('offset', 0)
+            with self._lock_diarios:
+                f = self._abrir_diario(archivo)
+                # Una línea incompleta (proceso caído a mitad de escritura) se
+                # cierra antes de anexar para no corromper la operación nueva
+                if os.fstat(f.fileno()).st_size > offset:
+                    linea = b'\n' + linea
+                f.write(linea)
+                f.flush()
+                self._pendientes_fsync[archivo] += len(operaciones)
+                if self._pendientes_fsync[archivo] >= JOURNAL_FSYNC_LOTE:
+                    os.fsync(f.fileno())
+                    self._pendientes_fsync[archivo] = 0
+            # Lee solo las líneas recién escritas (con el bloqueo tomado no hay otras)
+            if not hasattr(self._escrituras, 'versiones'):
+                self._escrituras.versiones = {}
+            self._escrituras.versiones[archivo] = (antes, self.version_compartida(archivo))
+            self._registrar_cambios(archivo, [
+                (operacion['id'], operacion['op'], operacion.get('registro')) for operacion in operaciones
+            ])
+        self._iniciar_mantenimiento()
+        return True
+
+    # ------------------------------------------------------------------
+    # Registro global de cambios (secuencia compartida por las colecciones)
+    # ------------------------------------------------------------------
+
+    def _ruta_cambios(self):
+        return os.path.join(DATABASE_PATH, 'cambios.jsonl')
+
+    def _leer_cambios(self):
+        """Pone al día la copia en memoria del registro (con _lock_cambios tomado)"""
+        try:
+            with open(self._ruta_cambios(), 'rb') as f:
+                ino = os.fstat(f.fileno()).st_ino
+                if ino != self._cambios['ino']:
+                    # Registro nuevo o compactado por otro worker: se relee entero
+                    self._cambios = {'ino': ino, 'offset': 0, 'compactado': None, 'seqs': [], 'entradas': []}
+                f.seek(self._cambios['offset'])
+                contenido = f.read()
+        except OSError:
+            return self._cambios
+
+        fin = contenido.rfind(b'\n') + 1
+        for linea in contenido[:fin].splitlines():
+            try:
+                entrada = json.loads(linea)
+            except ValueError:
+                continue
+            self._cambios['seqs'].append(entrada['seq'])
+            self._cambios['entradas'].append(entrada)
+        self._cambios['offset'] += fin
+        if self._cambios['compactado'] is None:
+            self._cambios['compactado'] = self._cambios['offset']
+        return self._cambios
+
+    def _registrar_cambios(self, archivo, cambios):
+        """Anexa ternas (id, op, registro nuevo o None) al registro con secuencias
+        consecutivas (seguro entre workers); de cada registro se guarda su posición"""
+        ruta = self._ruta_cambios()
+        with _bloqueo_archivo(ruta + '.lock'), self._lock_cambios:
+            estado = self._leer_cambios()
+            seq = estado['seqs'][-1] if estado['seqs'] else 0
+            lineas = []
+            for registro_id, op, registro in cambios:
+                seq += 1
+                entrada = {'seq': seq, 'archivo': archivo, 'id': registro_id, 'op': op}
+                coordenadas = _coordenadas(registro) if registro else None
+                if coordenadas:
+                    entrada['lat'], entrada['lon'] = coordenadas
+                lineas.append(json.dumps(entrada, ensure_ascii=False) + '\n')
+            contenido = ''.join(lineas).encode('utf-8')
+            with open(ruta, 'ab') as f:
+                # Igual que en el diario: una línea a medias se cierra antes de anexar
+                if os.fstat(f.fileno()).st_size > estado['offset']:
+                    contenido = b'\n' + contenido
+                f.write(contenido)
+            estado = self._leer_cambios()
+            if estado['offset'] >= max(CAMBIOS_MAX_BYTES, 2 * estado['compactado']):
+                self._compactar_cambios()
+
+    def _compactar_cambios(self):
+        """Deja solo el último cambio de cada registro y nada anterior al último
+        reinicio de su colección (con el bloqueo del registro tomado)
+
+        Quien pregunte desde cualquier secuencia sigue recibiendo todos los
+        registros que cambiaron después, y la última secuencia se conserva.
+        """
+        entradas = self._cambios['entradas']
+        reinicios = {entrada['archivo']: entrada['seq'] for entrada in entradas if entrada['op'] == 'reiniciar'}
+        ultimas = {}
+        for entrada in entradas:
+            if entrada['seq'] >= reinicios.get(entrada['archivo'], 0):
+                ultimas[(entrada['archivo'], entrada['id'])] = entrada
+        conservadas = sorted(ultimas.values(), key=lambda entrada: entrada['seq'])
+
+        ruta = self._ruta_cambios()
+        ruta_temporal = f"{ruta}.{os.getpid()}.tmp"
+        with open(ruta_temporal, 'w', encoding='utf-8') as f:
+            for entrada in conservadas:
+                f.write(json.dumps(entrada, ensure_ascii=False) + '\n')
+        os.replace(ruta_temporal, ruta)
+        firma = _firma_archivo(ruta)
+        self._cambios = {
+            'ino': firma[2],
+            'offset': firma[1],
+            'compactado': firma[1],
+            'seqs': [entrada['seq'] for entrada in conservadas],
+            'entradas': conservadas
+        }
+
+    def cambios_desde(self, desde):
+        """Última secuencia y entradas {'seq', 'archivo', 'id', 'op'} posteriores a `desde`
+        (con 'lat' y 'lon' si el registro quedó ubicado)"""
+        with self._lock_cambios:
+            estado = self._leer_cambios()
+            inicio = bisect.bisect_right(estado['seqs'], desde)
+            return (estado['seqs'][-1] if estado['seqs'] else 0), estado['entradas'][inicio:]
+
+    # ------------------------------------------------------------------
+    # Lotes de varias colecciones
+    # ------------------------------------------------------------------
+
+    def aplicar_cambios(self, cambios, versiones):
+        """Aplica {archivo: [operaciones]} todo o nada, con una escritura por colección
+
+        Con los bloqueos de todas las colecciones tomados se comprueba que
+        ninguna cambió desde `versiones` (si no, ConflictoLote). El lote se
+        escribe antes en un archivo `.lote` para que, si el proceso cae entre
+        dos colecciones, `inicializar` lo vuelva a aplicar completo (las
+        operaciones del diario son idempotentes por id).
+        """
+        archivos = sorted(cambios)
+        with ExitStack() as bloqueos:
+            for archivo in archivos:
+                bloqueos.enter_context(_bloqueo_archivo(self._ruta_bloqueo(archivo)))
+            for archivo in archivos:
+                if self.version(archivo) != versiones[archivo]:
+                    raise ConflictoLote(archivo)
+
+            ruta_lote = os.path.join(DATABASE_PATH, f"{os.getpid()}_{threading.get_ident()}.lote")
+            with open(ruta_lote + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(cambios, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(ruta_lote + '.tmp', ruta_lote)
+
+            for archivo in archivos:
+                self._anexar_lote(archivo, cambios[archivo])
+                self._sincronizar_diario(archivo)
+            os.remove(ruta_lote)
+        return {archivo: self.version(archivo) for archivo in archivos}
+
+    def _recuperar_lotes(self):
+        """Vuelve a aplicar los lotes que quedaron a medias por una caída"""
+        for nombre in sorted(os.listdir(DATABASE_PATH)):
+            if not nombre.endswith('.lote'):
+                continue
+            ruta_lote = os.path.join(DATABASE_PATH, nombre)
+            try:
+                with open(ruta_lote, 'r', encoding='utf-8') as f:
+                    cambios = json.load(f)
+            except (OSError, ValueError):
+                continue
+            with ExitStack() as bloqueos:
+                for archivo in sorted(cambios):
+                    bloqueos.enter_context(_bloqueo_archivo(self._ruta_bloqueo(archivo)))
+                # Si otro worker lo está aplicando, al soltar los bloqueos ya no existe
+                if not os.path.exists(ruta_lote):
+                    continue
+                for archivo in sorted(cambios):
+                    self._anexar_lote(archivo, cambios[archivo])
+                    self._sincronizar_diario(archivo)
+                os.remove(ruta_lote)
+            print(f"♻️  Lote recuperado: {nombre}")
+
+    def _iniciar_mantenimiento(self):
+        if self._hilo is None:
+            self._hilo = threading.Thread(target=self._bucle_mantenimiento, name='diario-json', daemon=True)
+            self._hilo.start()
+
+    def _bucle_mantenimiento(self):
+        """fsync periódico de los diarios y compactación en segundo plano"""
+        while True:
+            time.sleep(JOURNAL_FSYNC_INTERVALO)
+            for archivo in list(self._diarios):
+                try:
+                    self._sincronizar_diario(archivo)
+                    firma = _firma_archivo(self._ruta_diario(archivo))
+                    if firma and firma[1] >= JOURNAL_MAX_BYTES:
+                        operaciones = self.compactar(archivo)
+                        print(f"🗜️  Diario compactado: {archivo} ({operaciones} operaciones)")
+                except Exception as e:
+                    print(f"❌ Error en mantenimiento del diario {archivo}: {e}")
+
+    # ------------------------------------------------------------------
+    # Operaciones de un solo registro
+    # ------------------------------------------------------------------
+
+    def ids(self, archivo):
+        return self._datos(archivo).ids()
+
+    def obtener(self, archivo, registro_id):
+        registro = self._datos(archivo).obtener(registro_id)
+        return None if registro is None else dict(registro)
+
+    def iterar(self, archivo):
+        """Recorre los registros sin copiarlos (las escrituras reemplazan, no modifican)"""
+        return iter(list(self._datos(archivo)))
+
+    def duplicados(self):
+        """IDs duplicados detectados al indexar cada colección cargada"""
+        resultado = {}
+        for archivo in ARCHIVOS_COLECCIONES:
+            duplicados = self._datos(archivo).duplicados if os.path.exists(self._ruta(archivo)) else {}
+            if duplicados:
+                resultado[archivo] = sorted(duplicados)
+        return resultado
+
+    def insertar(self, archivo, registro):
+        return self._anexar(archivo, {'op': 'insertar', 'id': registro['id'], 'registro': registro})
+
+    def actualizar(self, archivo, registro_id, registro):
+        if self.obtener(archivo, registro_id) is None:
+            return False
+        return self._anexar(archivo, {'op': 'actualizar', 'id': registro_id, 'registro': registro})
+
+    def eliminar(self, archivo, registro_id):
+        if self.obtener(archivo, registro_id) is None:
+            return False
+        return self._anexar(archivo, {'op': 'eliminar', 'id': registro_id})
+
+    def upsert_lote(self, archivo, registros):
+        """Inserta o reemplaza por id un lote de registros; devuelve (insertados, actualizados)"""
+        with _bloqueo_archivo(self._ruta_bloqueo(archivo)):
+            existentes = self._datos(archivo)
+            actualizados = sum(1 for registro in registros if registro['id'] in existentes)
+            self._anexar_lote(archivo, [
+                {'op': 'actualizar' if registro['id'] in existentes else 'insertar', 'id': registro['id'], 'registro': registro}
+                for registro in registros
+            ])
+        return len(registros) - actualizados, actualizados
+
+    def estadisticas(self, archivo):
+        datos = self._datos(archivo)
+        with _cache_lock:
+            if datos.contadores.total != len(datos):
+                print(f"⚠️  Contadores desajustados en {archivo}; se recalculan")
+                datos.contadores = ContadoresEstadisticas(datos)
+            return datos.contadores.resumen()
+
+    def siguiente_id(self, archivo, prefijo):
+        """Reserva el siguiente ID de la secuencia del prefijo (seguro entre workers)"""
+        ruta_secuencias = os.path.join(DATABASE_PATH, 'secuencias.json')
+        with _bloqueo_archivo(ruta_secuencias + '.lock'):
+            try:
+                with open(ruta_secuencias, 'r', encoding='utf-8') as f:
+                    secuencias = json.load(f)
+            except (OSError, ValueError):
+                secuencias = {}
+
+            ids = self._datos(archivo).ids() if os.path.exists(self._ruta(archivo)) else set()
+            # La primera vez la secuencia parte del mayor ID existente
+            valor = secuencias.get(prefijo)
+            if valor is None:
+                valor = _maximo_numero_de_id(ids, prefijo)
+            valor += 1
+            # Saltar IDs ocupados (por ejemplo, creados por una importación)
+            while f"{prefijo}{valor:03d}" in ids:
+                valor += 1
+            secuencias[prefijo] = valor
+
+            ruta_temporal = f"{ruta_secuencias}.{os.getpid()}.tmp"
+            with open(ruta_temporal, 'w', encoding='utf-8') as f:
+                json.dump(secuencias, f, indent=4)
+            os.replace(ruta_temporal, ruta_secuencias)
+        return f"{prefijo}{valor:03d}"
+
+
+class AlmacenSQLite:
+    """Motor de almacenamiento SQLite (modo WAL, una tabla por colección)
+
+    Cada registro se guarda completo como JSON en la columna `datos`; `id`,
+    `estado` y `fecha_apertura` se copian a columnas indexadas para que las
+    rutas CRUD y las estadísticas trabajen con sentencias de una sola fila.
+    Cada escritura anota también sus cambios en `_cambios` (secuencia global)
+    dentro de la misma transacción.
+    """
+
+    nombre = 'sqlite'
+
+    def __init__(self, ruta_db):
+        self.ruta_db = ruta_db
+        self._local = threading.local()
+        self._tablas_creadas = set()
+        self._contadores = {}  # archivo -> (versión, ContadoresEstadisticas)
+        self._lock_contadores = threading.Lock()
+
+    def _conexion(self):
+        con = getattr(self._local, 'conexion', None)
+        if con is None:
+            os.makedirs(os.path.dirname(self.ruta_db) or '.', exist_ok=True)
+            con = sqlite3.connect(self.ruta_db, timeout=30)
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute('PRAGMA synchronous=NORMAL')
+            con.execute(
+                'CREATE TABLE IF NOT EXISTS _versiones ('
+                'coleccion TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)'
+            )
+            con.execute(
+                'CREATE TABLE IF NOT EXISTS _secuencias ('
+                'prefijo TEXT PRIMARY KEY, valor INTEGER NOT NULL)'
+            )
+            con.execute(
+                'CREATE TABLE IF NOT EXISTS _cambios ('
+                'seq INTEGER PRIMARY KEY AUTOINCREMENT, archivo TEXT NOT NULL, id TEXT, op TEXT NOT NULL, '
+                'lat REAL, lon REAL)'
+            )
+            # Bases creadas antes de guardar la posición de cada cambio
+            columnas = {fila[1] for fila in con.execute('PRAGMA table_info(_cambios)')}
+            for columna in ('lat', 'lon'):
+                if columna not in columnas:
+                    con.execute(f'ALTER TABLE _cambios ADD COLUMN {columna} REAL')
+            con.execute('CREATE INDEX IF NOT EXISTS idx__cambios_registro ON _cambios(archivo, id)')
+            con.commit()
+            self._local.conexion = con
+        return con
+
+    @staticmethod
+    def _tabla(archivo):
+        return os.path.splitext(archivo)[0]
+
+    def _asegurar_tabla(self, archivo):
+        tabla = self._tabla(archivo)
+        if tabla in self._tablas_creadas:
+            return tabla
+        con = self._conexion()
+        with con:
+            con.execute(
+                f'CREATE TABLE IF NOT EXISTS "{tabla}" ('
+                'orden INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'id TEXT NOT NULL, '
+                'estado TEXT, '
+                'fecha_apertura TEXT, '
+                'datos TEXT NOT NULL)'
+            )
+            con.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "idx_{tabla}_id" ON "{tabla}"(id)')
+            con.execute(f'CREATE INDEX IF NOT EXISTS "idx_{tabla}_estado" ON "{tabla}"(estado)')
+            con.execute(f'CREATE INDEX IF NOT EXISTS "idx_{tabla}_fecha_apertura" ON "{tabla}"(fecha_apertura)')
+            con.execute('INSERT OR IGNORE INTO _versiones (coleccion, version) VALUES (?, 0)', (tabla,))
+        self._tablas_creadas.add(tabla)
+        return tabla
+
+    @staticmethod
+    def _fila(registro):
+        fecha = registro.get('fecha_apertura')
+        return (
+            str(registro['id']),
+            registro.get('estado'),
+            str(fecha) if fecha is not None else None,
+            json.dumps(registro, ensure_ascii=False)
+        )
+
+    def _incrementar_version(self, con, tabla):
+        """Incrementa la versión de la tabla dentro de la transacción y devuelve la nueva"""
+        con.execute('UPDATE _versiones SET version = version + 1 WHERE coleccion = ?', (tabla,))
+        version = con.execute('SELECT version FROM _versiones WHERE coleccion = ?', (tabla,)).fetchone()[0]
+        # La transacción tiene el bloqueo de escritura: la anterior es exactamente version - 1
+        if not hasattr(self._local, 'escrituras'):
+            self._local.escrituras = {}
+        self._local.escrituras[tabla] = (version - 1, version)
+        return version
+
+    def _registrar_cambios(self, con, archivo, cambios):
+        """Anota ternas (id, op, registro nuevo o None) en _cambios dentro de la
+        transacción en curso, con la posición del registro"""
+        filas = []
+        for registro_id, op, registro in cambios:
+            lat, lon = (_coordenadas(registro) if registro else None) or (None, None)
+            filas.append((archivo, registro_id, op, lat, lon))
+        cursor = con.executemany('INSERT INTO _cambios (archivo, id, op, lat, lon) VALUES (?, ?, ?, ?, ?)', filas)
+        seq = con.execute('SELECT MAX(seq) FROM _cambios').fetchone()[0]
+        if seq // CAMBIOS_COMPACTAR_CADA != (seq - cursor.rowcount) // CAMBIOS_COMPACTAR_CADA:
+            # Solo hace falta el último cambio de cada registro, y nada anterior
+            # al último reinicio de su colección
+            con.execute('DELETE FROM _cambios WHERE seq NOT IN (SELECT MAX(seq) FROM _cambios GROUP BY archivo, id)')
+            con.execute(
+                'DELETE FROM _cambios WHERE seq < (SELECT MAX(r.seq) FROM _cambios r '
+                "WHERE r.archivo = _cambios.archivo AND r.op = 'reiniciar')"
+            )
+
+    def cambios_desde(self, desde):
+        """Última secuencia y entradas {'seq', 'archivo', 'id', 'op'} posteriores a `desde`
+        (con 'lat' y 'lon' si el registro quedó ubicado)"""
+        con = self._conexion()
+        # Una sola transacción de lectura: la secuencia y las filas son coherentes
+        with con:
+            con.execute('BEGIN')
+            seq = con.execute('SELECT MAX(seq) FROM _cambios').fetchone()[0] or 0
+            entradas = []
+            for fila in con.execute('SELECT seq, archivo, id, op, lat, lon FROM _cambios WHERE seq > ? ORDER BY seq', (desde,)):
+                entrada = {'seq': fila[0], 'archivo': fila[1], 'id': fila[2], 'op': fila[3]}
+                if fila[4] is not None:
+                    entrada['lat'], entrada['lon'] = fila[4], fila[5]
+                entradas.append(entrada)
+        return seq, entradas
+
+    def _ajustar_contadores(self, archivo, version, anterior=None, nuevo=None, cambios=()):
+        """Aplica una escritura (o un lote de pares anterior/nuevo) a los contadores
+        si estaban al día con la versión previa"""
+        with self._lock_contadores:
+            entrada = self._contadores.get(archivo)
+            if entrada is None or entrada[0] != version - 1:
+                # Otro proceso escribió entre medias: se recalculan al consultarlos
+                self._contadores.pop(archivo, None)
+                return
+            contadores = entrada[1]
+            for anterior, nuevo in list(cambios) or [(anterior, nuevo)]:
+                if anterior is not None:
+                    contadores.sumar(anterior, -1)
+                if nuevo is not None:
+                    contadores.sumar(nuevo)
+            self._contadores[archivo] = (version, contadores)
+
+    def _version(self, tabla):
+        fila = self._conexion().execute(
+            'SELECT version FROM _versiones WHERE coleccion = ?', (tabla,)
+        ).fetchone()
+        return fila[0] if fila else 0
+
+    def version(self, archivo):
+        return self._version(self._asegurar_tabla(archivo))
+
+    def version_compartida(self, archivo):
+        """La versión de SQLite ya es la misma para todos los procesos"""
+        return self.version(archivo)
+
+    def ultima_escritura(self, archivo):
+        """(versión antes, después) de la última escritura de este hilo en la colección"""
+        return getattr(self._local, 'escrituras', {}).get(self._tabla(archivo))
+
+    def _invalidar(self, archivo):
+        with _cache_lock:
+            _cache_colecciones.pop(archivo, None)
+
+    def inicializar(self, archivos):
+        for archivo in archivos:
+            self._asegurar_tabla(archivo)
+
+    def _datos(self, archivo):
+        tabla = self._asegurar_tabla(archivo)
+        firma = ('sqlite', self._version(tabla))
+        with _cache_lock:
+            entrada = _cache_colecciones.get(archivo)
+            if entrada and entrada['firma'] == firma:
+                _cache_contadores['aciertos'] += 1
+                return entrada['datos']
+            _cache_contadores['fallos'] += 1
+
+        con = self._conexion()
+        datos = [json.loads(fila[0]) for fila in con.execute(f'SELECT datos FROM "{tabla}" ORDER BY orden')]
+        if self._version(tabla) == firma[1]:
+            with _cache_lock:
+                _cache_colecciones[archivo] = {'firma': firma, 'datos': datos}
+        return datos
+
+    def cargar(self, archivo):
+        return _copiar_registros(self._datos(archivo))
+
+    def guardar(self, archivo, datos):
+        """Reemplaza la colección completa (usado por la importación)"""
+        tabla = self._asegurar_tabla(archivo)
+        con = self._conexion()
+        with con:
+            con.execute(f'DELETE FROM "{tabla}"')
+            con.executemany(
+                f'INSERT INTO "{tabla}" (id, estado, fecha_apertura, datos) VALUES (?, ?, ?, ?)',
+                (self._fila(registro) for registro in datos)
+            )
+            version = self._incrementar_version(con, tabla)
+            self._registrar_cambios(con, archivo, [(None, 'reiniciar', None)])
+        self._invalidar(archivo)
+        with self._lock_contadores:
+            self._contadores[archivo] = (version, ContadoresEstadisticas(datos))
+        return True
+
+    def duplicados(self):
+        # El índice único sobre `id` impide duplicados en SQLite
+        return {}
+
+    def ids(self, archivo):
+        tabla = self._asegurar_tabla(archivo)
+        return {fila[0] for fila in self._conexion().execute(f'SELECT id FROM "{tabla}"')}
+
+    def iterar(self, archivo):
+        """Recorre los registros fila a fila desde la base, sin cargar la tabla entera"""
+        tabla = self._asegurar_tabla(archivo)
+        for fila in self._conexion().execute(f'SELECT datos FROM "{tabla}" ORDER BY orden'):
+            yield json.loads(fila[0])
+
+    def obtener(self, archivo, registro_id):
+        tabla = self._asegurar_tabla(archivo)
+        fila = self._conexion().execute(
+            f'SELECT datos FROM "{tabla}" WHERE id = ?', (registro_id,)
+        ).fetchone()
+        return json.loads(fila[0]) if fila else None
+
+    def insertar(self, archivo, registro):
+        tabla = self._asegurar_tabla(archivo)
+        con = self._conexion()
+        with con:
+            con.execute(
+                f'INSERT INTO "{tabla}" (id, estado, fecha_apertura, datos) VALUES (?, ?, ?, ?)',
+                self._fila(registro)
+            )
+            version = self._incrementar_version(con, tabla)
+            self._registrar_cambios(con, archivo, [(str(registro['id']), 'insertar', registro)])
+        self._invalidar(archivo)
+        self._ajustar_contadores(archivo, version, nuevo=registro)
+        return True
+
+    def actualizar(self, archivo, registro_id, registro):
+        tabla = self._asegurar_tabla(archivo)
+        con = self._conexion()
+        with con:
+            # BEGIN IMMEDIATE: el registro anterior no puede cambiar antes del UPDATE
+            con.execute('BEGIN IMMEDIATE')
+            fila = con.execute(f'SELECT datos FROM "{tabla}" WHERE id = ?', (registro_id,)).fetchone()
+            if fila is None:
+                return False
+            _, estado, fecha, datos = self._fila(registro)
+            con.execute(
+                f'UPDATE "{tabla}" SET estado = ?, fecha_apertura = ?, datos = ? WHERE id = ?',
+                (estado, fecha, datos, registro_id)
+            )
+            version = self._incrementar_version(con, tabla)
+            self._registrar_cambios(con, archivo, [(registro_id, 'actualizar', registro)])
+        self._invalidar(archivo)
+        self._ajustar_contadores(archivo, version, json.loads(fila[0]), registro)
+        return True
+
+    def eliminar(self, archivo, registro_id):
+        tabla = self._asegurar_tabla(archivo)
+        con = self._conexion()
+        with con:
+            con.execute('BEGIN IMMEDIATE')
+            fila = con.execute(f'SELECT datos FROM "{tabla}" WHERE id = ?', (registro_id,)).fetchone()
+            if fila is None:
+                return False
+            con.execute(f'DELETE FROM "{tabla}" WHERE id = ?', (registro_id,))
+            version = self._incrementar_version(con, tabla)
+            self._registrar_cambios(con, archivo, [(registro_id, 'eliminar', None)])
+        self._invalidar(archivo)
+        self._ajustar_contadores(archivo, version, anterior=json.loads(fila[0]))
+        return True
+
+    def upsert_lote(self, archivo, registros):
+        """Inserta o reemplaza por id un lote de registros en una transacción; devuelve (insertados, actualizados)"""
+        tabla = self._asegurar_tabla(archivo)
+        con = self._conexion()
+        with con:
+            con.execute('BEGIN IMMEDIATE')
+            ids = [str(registro['id']) for registro in registros]
+            anteriores = {}
+            for inicio in range(0, len(ids), 500):
+                parte = ids[inicio:inicio + 500]
+                marcas = ', '.join('?' * len(parte))
+                for registro_id, datos in con.execute(f'SELECT id, datos FROM "{tabla}" WHERE id IN ({marcas})', parte):
+                    anteriores[registro_id] = json.loads(datos)
+            con.executemany(
+                f'INSERT INTO "{tabla}" (id, estado, fecha_apertura, datos) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(id) DO UPDATE SET estado = excluded.estado, '
+                'fecha_apertura = excluded.fecha_apertura, datos = excluded.datos',
+                (self._fila(registro) for registro in registros)
+            )
+            version = self._incrementar_version(con, tabla)
+            self._registrar_cambios(con, archivo, [
+                (registro_id, 'actualizar' if registro_id in anteriores else 'insertar', registro)
+                for registro_id, registro in zip(ids, registros)
+            ])
+        self._invalidar(archivo)
+        self._ajustar_contadores(archivo, version, cambios=[
+            (anteriores.get(registro_id), registro) for registro_id, registro in zip(ids, registros)
+        ])
+        return len(registros) - len(anteriores), len(anteriores)
+
+    def aplicar_cambios(self, cambios, versiones):
+        """Aplica {archivo: [operaciones]} en una sola transacción (todo o nada)
+
+        Si alguna colección cambió desde `versiones` lanza ConflictoLote.
+        """
+        tablas = {archivo: self._asegurar_tabla(archivo) for archivo in cambios}
+        contadores = {archivo: [] for archivo in cambios}
+        nuevas = {}
+        con = self._conexion()
+        with con:
+            con.execute('BEGIN IMMEDIATE')
+            for archivo, tabla in tablas.items():
+                if self._version(tabla) != versiones[archivo]:
+                    raise ConflictoLote(archivo)
+            for archivo, operaciones in cambios.items():
+                tabla = tablas[archivo]
+                for operacion in operaciones:
+                    fila = con.execute(f'SELECT datos FROM "{tabla}" WHERE id = ?', (operacion['id'],)).fetchone()
+                    anterior = json.loads(fila[0]) if fila else None
+                    if operacion['op'] == 'eliminar':
+                        con.execute(f'DELETE FROM "{tabla}" WHERE id = ?', (operacion['id'],))
+                        contadores[archivo].append((anterior, None))
+                    else:
+                        con.execute(
+                            f'INSERT INTO "{tabla}" (id, estado, fecha_apertura, datos) VALUES (?, ?, ?, ?) '
+                            'ON CONFLICT(id) DO UPDATE SET estado = excluded.estado, '
+                            'fecha_apertura = excluded.fecha_apertura, datos = excluded.datos',
+                            self._fila(operacion['registro'])
+                        )
+                        contadores[archivo].append((anterior, operacion['registro']))
+                nuevas[archivo] = self._incrementar_version(con, tabla)
+                self._registrar_cambios(con, archivo, [
+                    (operacion['id'], operacion['op'], operacion.get('registro')) for operacion in operaciones
+                ])
+        for archivo, version in nuevas.items():
+            self._invalidar(archivo)
+            self._ajustar_contadores(archivo, version, cambios=contadores[archivo])
+        return nuevas
+
+    def siguiente_id(self, archivo, prefijo):
+        """Reserva el siguiente ID de la secuencia del prefijo (seguro entre workers)"""
+        tabla = self._asegurar_tabla(archivo)
+        con = self._conexion()
+        with con:
+            # BEGIN IMMEDIATE toma el bloqueo de escritura antes de leer la secuencia
+            con.execute('BEGIN IMMEDIATE')
+            fila = con.execute('SELECT valor FROM _secuencias WHERE prefijo = ?', (prefijo,)).fetchone()
+            if fila is None:
+                ids = (f[0] for f in con.execute(f'SELECT id FROM "{tabla}" WHERE id LIKE ?', (prefijo + '%',)))
+                valor = _maximo_numero_de_id(ids, prefijo)
+            else:
+                valor = fila[0]
+            valor += 1
+            while con.execute(f'SELECT 1 FROM "{tabla}" WHERE id = ?', (f"{prefijo}{valor:03d}",)).fetchone():
+                valor += 1
+            con.execute(
+                'INSERT INTO _secuencias (prefijo, valor) VALUES (?, ?) '
+                'ON CONFLICT(prefijo) DO UPDATE SET valor = excluded.valor',
+                (prefijo, valor)
+            )
+        return f"{prefijo}{valor:03d}"
+
+    def estadisticas(self, archivo):
+        version = self.version(archivo)
+        with self._lock_contadores:
+            entrada = self._contadores.get(archivo)
+            if entrada and entrada[0] == version:
+                return entrada[1].resumen()
+        # Al arrancar o si otro proceso modificó la tabla: recalcular desde cero
+        contadores = ContadoresEstadisticas(self._datos(archivo))
+        if self.version(archivo) == version:
+            with self._lock_contadores:
+                self._contadores[archivo] = (version, contadores)
+        return contadores.resumen()
+
+
+def crear_almacen(motor):
+    """Crea el motor de almacenamiento configurado ('json' o 'sqlite')"""
+    if motor == 'sqlite':
+        return AlmacenSQLite(SQLITE_PATH)
+    return AlmacenJSON()
+
+almacen = crear_almacen(STORAGE_BACKEND)
+
+def migrar_json_a_sqlite(ruta_db=None):
+    """Copia (una sola vez) las colecciones JSON actuales a la base SQLite"""
+    origen = AlmacenJSON()
+    destino = AlmacenSQLite(ruta_db or SQLITE_PATH)
+    resumen = {}
+    for archivo in ARCHIVOS_COLECCIONES:
+        registros = []
+        vistos = set()
+        for registro in origen.cargar(archivo):
+            if registro.get('id') in vistos:
+                print(f"⚠️  ID duplicado omitido en {archivo}: {registro.get('id')}")
+                continue
+            vistos.add(registro.get('id'))
+            registros.append(registro)
+        destino.guardar(archivo, registros)
+        resumen[archivo] = len(registros)
+        print(f"✅ Migrados {len(registros)} registros de {archivo}")
+    return resumen
+
 def cargar_datos_desde_json(archivo):
-    """Carga datos desde JSON"""
+    """Carga una colección completa desde el motor de almacenamiento"""
     try:
-        ruta_archivo = os.path.join(DATABASE_PATH, archivo)
-        with open(ruta_archivo, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return almacen.cargar(archivo)
     except:
         return []
 
 def guardar_datos_en_json(archivo, datos):
-    """Guarda datos en JSON"""
+    """Guarda (reemplaza) una colección completa en el motor de almacenamiento"""
     try:
-        ruta_archivo = os.path.join(DATABASE_PATH, archivo)
-        with open(ruta_archivo, 'w', encoding='utf-8') as f:
-            json.dump(datos, f, indent=4, ensure_ascii=False)
-        return True
+        return almacen.guardar(archivo, datos)
     except Exception as e:
         print(f"Error guardando {archivo}: {e}")
         return False
@@ -258,78 +2240,50 @@ def guardar_datos_en_json(archivo, datos):
 def obtener_estadisticas_totales():
     """Estadísticas totales por tipo - SOLO ACTIVOS"""
     try:
-        distribuidores = cargar_datos_desde_json('distribuidores_autorizados.json')
-        tiendas_oro = cargar_datos_desde_json('tiendas_oro.json')
-        tiendas_satelite = cargar_datos_desde_json('tiendas_satelite.json')
-        centros_distribucion = cargar_datos_desde_json('centros_distribucion.json')
-        
-        # ✅ FILTRAR SOLO LOS ACTIVOS para estadísticas principales
-        distribuidores_activos = [d for d in distribuidores if d.get('estado') == 'activo']
-        tiendas_oro_activas = [t for t in tiendas_oro if t.get('estado') == 'activo']
-        tiendas_satelite_activas = [t for t in tiendas_satelite if t.get('estado') == 'activo']
-        centros_activos = [c for c in centros_distribucion if c.get('estado') == 'activo']
-        
-        # Estadísticas por estado (para información adicional)
-        def contar_por_estado(datos):
-            estados = {}
-            for item in datos:
-                estado = item.get('estado', 'activo')
-                estados[estado] = estados.get(estado, 0) + 1
-            return estados
-        
-        # 🔥 CORREGIDO: Contar aperturas 2026 en TODOS los elementos, no solo activos
-        def contar_2026(datos):
-            count = 0
-            for item in datos:
-                fecha = item.get('fecha_apertura', '')
-                if fecha and fecha.startswith('2026'):
-                    count += 1
-                    print(f"📅 Encontrada apertura 2026: {item.get('nombre', 'Sin nombre')} - {fecha}")
-            return count
+        # El motor de almacenamiento mantiene contadores de activos, estados y
+        # aperturas por año que se ajustan en cada escritura: esto es O(1)
+        distribuidores = almacen.estadisticas('distribuidores_autorizados.json')
+        tiendas_oro = almacen.estadisticas('tiendas_oro.json')
+        tiendas_satelite = almacen.estadisticas('tiendas_satelite.json')
+        centros_distribucion = almacen.estadisticas('centros_distribucion.json')
         
         stats = {
             # ✅ SOLO CONTAR ACTIVOS para estadísticas principales
-            'distribuidores': len(distribuidores_activos),
-            'tiendas_oro': len(tiendas_oro_activas),
-            'tiendas_satelite': len(tiendas_satelite_activas),
-            'centros_distribucion': len(centros_activos),
-            'total_general': len(distribuidores_activos) + len(tiendas_oro_activas) + len(tiendas_satelite_activas) + len(centros_activos),
+            'distribuidores': distribuidores['activos'],
+            'tiendas_oro': tiendas_oro['activos'],
+            'tiendas_satelite': tiendas_satelite['activos'],
+            'centros_distribucion': centros_distribucion['activos'],
+            'total_general': distribuidores['activos'] + tiendas_oro['activos'] + tiendas_satelite['activos'] + centros_distribucion['activos'],
             
             # Información adicional (opcional)
             'por_estado': {
-                'distribuidores': contar_por_estado(distribuidores),
-                'tiendas_oro': contar_por_estado(tiendas_oro),
-                'tiendas_satelite': contar_por_estado(tiendas_satelite),
-                'centros_distribucion': contar_por_estado(centros_distribucion)
+                'distribuidores': distribuidores['por_estado'],
+                'tiendas_oro': tiendas_oro['por_estado'],
+                'tiendas_satelite': tiendas_satelite['por_estado'],
+                'centros_distribucion': centros_distribucion['por_estado']
             },
             # 🔥 CORREGIDO: Contar 2026 en TODOS los datos, no solo activos
             'aperturas_2026': {
-                'distribuidores': contar_2026(distribuidores),
-                'tiendas_oro': contar_2026(tiendas_oro),
-                'tiendas_satelite': contar_2026(tiendas_satelite),
-                'centros_distribucion': contar_2026(centros_distribucion)
+                'distribuidores': distribuidores['aperturas_2026'],
+                'tiendas_oro': tiendas_oro['aperturas_2026'],
+                'tiendas_satelite': tiendas_satelite['aperturas_2026'],
+                'centros_distribucion': centros_distribucion['aperturas_2026']
+            },
+            'aperturas_por_anio': {
+                'distribuidores': distribuidores['aperturas_por_anio'],
+                'tiendas_oro': tiendas_oro['aperturas_por_anio'],
+                'tiendas_satelite': tiendas_satelite['aperturas_por_anio'],
+                'centros_distribucion': centros_distribucion['aperturas_por_anio']
             },
             # Totales reales (para debug)
             '_totales_reales': {
-                'distribuidores': len(distribuidores),
-                'tiendas_oro': len(tiendas_oro),
-                'tiendas_satelite': len(tiendas_satelite),
-                'centros_distribucion': len(centros_distribucion)
+                'distribuidores': distribuidores['total'],
+                'tiendas_oro': tiendas_oro['total'],
+                'tiendas_satelite': tiendas_satelite['total'],
+                'centros_distribucion': centros_distribucion['total']
             }
         }
         
-        print(f"📊 Estadísticas calculadas - Activos: {stats['total_general']}")
-        print(f"📊 Detalle - Distribuidores: {stats['distribuidores']}/{len(distribuidores)} activos")
-        print(f"📊 Detalle - Tiendas Oro: {stats['tiendas_oro']}/{len(tiendas_oro)} activas")
-        print(f"📊 Detalle - Tiendas Satélite: {stats['tiendas_satelite']}/{len(tiendas_satelite)} activas")
-        print(f"📊 Detalle - Centros: {stats['centros_distribucion']}/{len(centros_distribucion)} activos")
-        
-        # 🔥 DEBUG: Mostrar aperturas 2026
-        print(f"📅 Aperturas 2026 - Distribuidores: {stats['aperturas_2026']['distribuidores']}")
-        print(f"📅 Aperturas 2026 - Tiendas Oro: {stats['aperturas_2026']['tiendas_oro']}")
-        print(f"📅 Aperturas 2026 - Tiendas Satélite: {stats['aperturas_2026']['tiendas_satelite']}")
-        print(f"📅 Aperturas 2026 - Centros: {stats['aperturas_2026']['centros_distribucion']}")
-        
         return stats
         
     except Exception as e:
@@ -347,6 +2301,7 @@ def obtener_estadisticas_totales():
                 'tiendas_satelite': 0,
                 'centros_distribucion': 0
             },
+            'aperturas_por_anio': {},
             '_totales_reales': {}
         }
     
@@ -354,6 +2309,169 @@ def obtener_estadisticas_totales():
 
 
 
+# ============================================================================
+# ESTADÍSTICAS AGRUPADAS (VISTA COLUMNAR CON PANDAS)
+# ============================================================================
+
+# Columnas por las que /api/estadisticas puede agrupar
+COLUMNAS_AGRUPABLES = ['tipo', 'ciudad', 'estado', 'zona_cobertura', 'anio', 'mes']
+
+MAX_ESTADISTICAS_CACHEADAS = 128
+
+# Tabla de la versión actual de los datos y resultados por (versión, parámetros), LRU
+_cache_analitica = {'version': None, 'tabla': None, 'resultados': OrderedDict()}
+_cache_analitica_lock = threading.Lock()
+
+
+def construir_tabla_analitica():
+    """DataFrame con una fila por ubicación de las cuatro colecciones"""
+    columnas = {'tipo': [], 'ciudad': [], 'estado': [], 'zona_cobertura': [], 'fecha_apertura': []}
+    for tipo, archivo in ARCHIVOS_POR_TIPO.items():
+        for item in cargar_datos_desde_json(archivo):
+            columnas['tipo'].append(tipo)
+            columnas['ciudad'].append(item.get('ciudad'))
+            columnas['estado'].append(item.get('estado', 'activo'))
+            columnas['zona_cobertura'].append(item.get('zona_cobertura'))
+            columnas['fecha_apertura'].append(item.get('fecha_apertura'))
+
+    tabla = pd.DataFrame(columnas)
+    for columna in ('tipo', 'ciudad', 'estado', 'zona_cobertura'):
+        tabla[columna] = tabla[columna].astype('category')
+    fechas = pd.to_datetime(tabla.pop('fecha_apertura'), errors='coerce', format='ISO8601')
+    tabla['fecha'] = fechas
+    tabla['anio'] = fechas.dt.year.astype('Int64')
+    tabla['mes'] = fechas.dt.strftime('%Y-%m')
+    return tabla
+
+def obtener_tabla_analitica():
+    """(versión, tabla analítica), reconstruida solo cuando cambian los datos"""
+    version = obtener_version_datos()
+    with _cache_analitica_lock:
+        if _cache_analitica['version'] != version:
+            _cache_analitica.update(version=version, tabla=construir_tabla_analitica(), resultados=OrderedDict())
+        return version, _cache_analitica['tabla']
+
+def obtener_estadisticas_agrupadas(agrupar, desde=None, hasta=None):
+    """Grupos de agrupar_estadisticas, cacheados por versión de los datos y parámetros"""
+    version, tabla = obtener_tabla_analitica()
+    clave = (version, tuple(agrupar), desde, hasta)
+    with _cache_analitica_lock:
+        resultados = _cache_analitica['resultados']
+        if clave in resultados:
+            resultados.move_to_end(clave)
+            return resultados[clave]
+
+    grupos = agrupar_estadisticas(tabla, agrupar, desde, hasta)
+
+    with _cache_analitica_lock:
+        resultados = _cache_analitica['resultados']
+        resultados[clave] = grupos
+        while len(resultados) > MAX_ESTADISTICAS_CACHEADAS:
+            resultados.popitem(last=False)
+    return grupos
+
+def leer_fecha_estadisticas(texto):
+    """Fecha de ?desde/?hasta como Timestamp sin zona (las de los datos no la tienen)"""
+    fecha = pd.Timestamp(texto)
+    if pd.isna(fecha):
+        raise ValueError(f'{texto!r} no es una fecha')
+    if fecha.tzinfo is not None:
+        fecha = fecha.tz_convert('UTC').tz_localize(None)
+    return fecha
+
+def agrupar_estadisticas(tabla, agrupar, desde=None, hasta=None):
+    """Cuenta ubicaciones por las columnas de `agrupar` dentro del rango de fechas de apertura"""
+    if desde is not None:
+        tabla = tabla[tabla['fecha'] >= desde]
+    if hasta is not None:
+        tabla = tabla[tabla['fecha'] <= hasta]
+
+    if not agrupar:
+        return [{'cantidad': int(len(tabla))}]
+
+    conteo = tabla.groupby(agrupar, observed=True, dropna=False).size()
+    conteo = conteo[conteo > 0].sort_values(ascending=False)
+    grupos = []
+    for claves, cantidad in conteo.items():
+        claves = claves if isinstance(claves, tuple) else (claves,)
+        grupo = {columna: (None if pd.isna(valor) else valor.item() if hasattr(valor, 'item') else valor)
+                 for columna, valor in zip(agrupar, claves)}
+        grupo['cantidad'] = int(cantidad)
+        grupos.append(grupo)
+    return grupos
+
+
+# ============================================================================
+# ICONOS REDUCIDOS COMPARTIDOS
+# ============================================================================
+
+# Lado (px) de los iconos reducidos: el doble del mayor tamaño mostrado (20px)
+# para que se vean nítidos en pantallas de alta densidad
+TAMANO_ICONO_REDUCIDO = 40
+
+# nombre del icono -> URL pública (se calcula una sola vez por proceso)
+_urls_iconos = {}
+
+def generar_icono_reducido(origen, destino):
+    """Genera la versión reducida de un icono (requiere Pillow, opcional)"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return False
+    try:
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        with Image.open(origen) as imagen:
+            imagen = imagen.convert('RGBA')
+            imagen.thumbnail((TAMANO_ICONO_REDUCIDO, TAMANO_ICONO_REDUCIDO), Image.LANCZOS)
+            imagen.save(destino, 'PNG', optimize=True)
+        print(f"✅ Icono reducido generado: {os.path.basename(destino)}")
+        return True
+    except Exception as e:
+        print(f"❌ Error generando icono reducido {origen}: {e}")
+        return False
+
+class IconoURL(folium.CustomIcon):
+    """CustomIcon que enlaza la imagen por URL relativa
+
+    folium.CustomIcon solo acepta rutas locales (que incrusta en base64) o
+    URLs absolutas; aquí se usa la ruta /static/... tal cual.
+    """
+
+    def __init__(self, url, icon_size=None, icon_anchor=None):
+        folium.MacroElement.__init__(self)
+        self._name = 'icon'
+        self.options = remove_empty(
+            icon_url=url,
+            icon_size=icon_size,
+            icon_anchor=icon_anchor
+        )
+
+def obtener_url_icono(nombre_icono):
+    """URL del icono reducido (static/images/iconos/) o None si el icono no existe"""
+    if nombre_icono in _urls_iconos:
+        return _urls_iconos[nombre_icono]
+    
+    origen = os.path.join(BASE_DIR, 'static', 'images', nombre_icono)
+    destino = os.path.join(BASE_DIR, 'static', 'images', 'iconos', nombre_icono)
+    if not os.path.exists(origen) and not os.path.exists(destino):
+        return None
+    
+    desactualizado = (
+        not os.path.exists(destino)
+        or (os.path.exists(origen) and os.path.getmtime(destino) < os.path.getmtime(origen))
+    )
+    if desactualizado:
+        generar_icono_reducido(origen, destino)
+    
+    if os.path.exists(destino):
+        url = url_estatica(f'images/iconos/{nombre_icono}')
+    else:
+        # Sin Pillow: se usa el original, igualmente compartido por URL
+        url = url_estatica(f'images/{nombre_icono}')
+    _urls_iconos[nombre_icono] = url
+    return url
+
+
 def obtener_icono_personalizado(estado, tipo):
     """Devuelve icono personalizado según estado y tipo"""
     # Mapeo de iconos personalizados
@@ -394,12 +2512,13 @@ def obtener_icono_personalizado(estado, tipo):
     # Obtener el nombre del archivo de icono
     nombre_icono = iconos_config.get(tipo, {}).get(estado_clave, 'logo-rojo-activo.png')
     
-    # RUTA FÍSICA del archivo de icono (corregido)
-    ruta_icono = os.path.join(BASE_DIR, 'static', 'images', nombre_icono)
+    # URL del icono reducido compartido por todos los marcadores: con una
+    # ruta local folium incrustaría la imagen en base64 en cada marcador
+    url_icono = obtener_url_icono(nombre_icono)
     
     # Verificar que el archivo existe
-    if not os.path.exists(ruta_icono):
-        print(f"⚠️  Icono no encontrado: {ruta_icono}")
+    if url_icono is None:
+        print(f"⚠️  Icono no encontrado: {nombre_icono}")
         # Usar un icono por defecto de Folium como fallback
         return folium.Icon(color='red', icon='info-sign')
     
@@ -421,8 +2540,8 @@ def obtener_icono_personalizado(estado, tipo):
         icon_size = (20, 20)
         icon_anchor = (15, 15)
     
-    icono_personalizado = folium.CustomIcon(
-        icon_image=ruta_icono,
+    icono_personalizado = IconoURL(
+        url_icono,
         icon_size=icon_size,
         icon_anchor=icon_anchor
     )
@@ -437,7 +2556,7 @@ def crear_mapa_base_mejorado():
         location=[9.7489, -83.7534],
         zoom_start=8,
         min_zoom=1,                   
-        max_zoom=18,      
+        max_zoom=ZOOM_MAXIMO,      
         
     )
     
@@ -473,93 +2592,862 @@ def crear_mapa_base_mejorado():
     
     # Establecer OpenStreetMap como capa por defecto
     
+    # Nombre JS fijo del mapa: los fragmentos de capas cacheados lo referencian
+    mapa._id = ID_MAPA
     
     return mapa
 
 
-def agregar_mapa_calor(mapa):
-    """Agrega un mapa de calor con todas las ubicaciones activas"""
+# ============================================================================
+# CAPAS DEL MAPA COMO GEOJSON (CARGA DIFERIDA EN EL NAVEGADOR)
+# ============================================================================
+
+# Peso de cada tipo de ubicación en el mapa de calor
+PESOS_CALOR = {
+    'centros_distribucion.json': 5.0,       # Peso alto
+    'distribuidores_autorizados.json': 15.0,  # Peso medio
+    'tiendas_oro.json': 5.5,                 # Peso medio-alto
+    'tiendas_satelite.json': 5.5             # Peso bajo
+}
+
+OPCIONES_CALOR = {
+    'minOpacity': 0.1,
+    'maxZoom': 50,
+    'radius': 30,
+    'blur': 30,
+    'gradient': {
+        0.1: 'blue',
+        0.6: 'cyan',
+        0.8: 'lime',
+        0.9: 'yellow',
+        1.0: 'red'
+    }
+}
+
+# Zoom máximo del mapa; los clusters se precalculan para 0..ZOOM_MAXIMO
+ZOOM_MAXIMO = 18
+
+# Capas con más puntos que esto se sirven agrupadas en clusters por zoom
+UMBRAL_CLUSTERS = 500
+
+# Radio (en píxeles de pantalla) dentro del cual se agrupan los puntos
+RADIO_CLUSTER_PX = 60
+
+def es_activo(item):
+    return item.get('estado') == 'activo'
+
+def es_apertura_2026(item):
+    return item.get('estado') == 'proxima_apertura' and str(item.get('fecha_apertura', '')).startswith('2026')
+
+# Grupos en que se reparte cada colección (un registro cae como mucho en uno).
+# El mapa de calor usa el grupo 'activos' de todas las colecciones.
+FILTROS_GRUPO = {
+    'activos': es_activo,
+    'apertura_2026': es_apertura_2026
+}
+
+def en_capa(spec, item):
+    """¿El registro aparece en la capa descrita por spec?"""
+    return FILTROS_GRUPO[spec['grupo']](item)
+
+# Campos (etiqueta, clave) que se muestran en el popup de cada tipo
+_CAMPOS_CENTRO = [
+    ['Ciudad', 'ciudad'], ['Dirección', 'direccion'], ['Teléfono', 'telefono'],
+    ['Capacidad Almacén', 'capacidad_almacen'], ['Tipo Centro', 'tipo_centro'],
+    ['Zona Cobertura', 'zona_cobertura'], ['Responsable', 'responsable'],
+    ['Fecha Apertura', 'fecha_apertura']
+]
+_CAMPOS_DISTRIBUIDOR = [
+    ['Ciudad', 'ciudad'], ['Dirección', 'direccion'], ['Teléfono', 'telefono'],
+    ['Fecha Apertura', 'fecha_apertura']
+]
+_CAMPOS_TIENDA_ORO = [
+    ['Ciudad', 'ciudad'], ['Dirección', 'direccion'],
+    ['Capacidad Congelador', 'capacidad_congelador'], ['Fecha Apertura', 'fecha_apertura']
+]
+_CAMPOS_TIENDA_SATELITE = [
+    ['Ciudad', 'ciudad'], ['Dirección', 'direccion'], ['Tipo', 'tipo_satelite'],
+    ['Fecha Apertura', 'fecha_apertura']
+]
+
+# capa -> colección y grupo que muestra, entrada en el control de capas,
+# icono y contenido del popup de sus marcadores.
+# El orden es el mismo en el que aparecen en el control de capas.
+CAPAS_GEOJSON = {
+    'centros': {
+        'archivo': 'centros_distribucion.json', 'grupo': 'activos',
+        'tipo': 'centros_distribucion', 'estado_icono': 'activo',
+        'icono_control': 'images/iconos/logo-verde-activo.png',
+        'control': '<img src="{icono}" width="16" height="16" style="vertical-align: middle; margin-right: 5px;"> Centros De Distribución ({total})', 'show': True,
+        'popup': {'emoji': '🏭', 'tooltip': '🏭 ', 'tipo': 'Centro de Distribución',
+                  'estado': 'Activo', 'color_estado': 'darkgreen', 'ancho_minimo': 350, 'ancho_maximo': 400,
+                  'campos': _CAMPOS_CENTRO, 'pie': 'Centro de Distribución - Carnes San Martín'}
+    },
+    'distribuidores': {
+        'archivo': 'distribuidores_autorizados.json', 'grupo': 'activos',
+        'tipo': 'distribuidores', 'estado_icono': 'activo',
+        'icono_control': 'images/iconos/logo-rojo-activo.png',
+        'control': '<img src="{icono}" width="16" height="16" style="vertical-align: middle; margin-right: 1px;"> Dist. Autorizados Activos ({total})', 'show': True,
+        'popup': {'emoji': '📦', 'tooltip': '📦 ', 'tipo': 'Distribuidor Autorizado',
+                  'estado': 'Activo', 'color_estado': 'green', 'ancho_minimo': 320, 'ancho_maximo': 350,
+                  'campos': _CAMPOS_DISTRIBUIDOR, 'pie': 'Carnes San Martín'}
+    },
+    'tiendas_oro': {
+        'archivo': 'tiendas_oro.json', 'grupo': 'activos',
+        'tipo': 'tiendas_oro', 'estado_icono': 'activo',
+        'icono_control': 'images/iconos/logo-dorado-activo.png',
+        'control': '<img src="{icono}" width="16" height="16" style="vertical-align: middle; margin-right: 1px;"> Tiendas Oro Activas ({total})', 'show': True,
+        'popup': {'emoji': '🥇', 'tooltip': '🥇 ', 'tipo': None,
+                  'estado': 'Activo', 'color_estado': 'blue', 'ancho_minimo': 300, 'ancho_maximo': 350,
+                  'campos': _CAMPOS_TIENDA_ORO, 'pie': 'Tienda Oro - Carnes San Martín'}
+    },
+    'tiendas_satelite': {
+        'archivo': 'tiendas_satelite.json', 'grupo': 'activos',
+        'tipo': 'tiendas_satelite', 'estado_icono': 'activo',
+        'icono_control': 'images/iconos/logo-azul-activo.png',
+        'control': '<img src="{icono}" width="16" height="16" style="vertical-align: middle; margin-right: 1px;"> Tiendas Satélite Activas ({total})', 'show': True,
+        'popup': {'emoji': '🛒', 'tooltip': '🛒 ', 'tipo': None,
+                  'estado': 'Activo', 'color_estado': 'green', 'ancho_minimo': 300, 'ancho_maximo': 350,
+                  'campos': _CAMPOS_TIENDA_SATELITE, 'pie': 'Tienda Satélite - Carnes San Martín'}
+    },
+    'distribuidores_2026': {
+        'archivo': 'distribuidores_autorizados.json', 'grupo': 'apertura_2026',
+        'tipo': 'distribuidores', 'estado_icono': 'proxima_apertura',
+        'icono_control': 'images/iconos/logo-rojo-activo-next.png',
+        'control': '<img src="{icono}" width="16" height="16" style="vertical-align: middle; margin-right: 1px;"> 2026 Dist. Autorizados ({total})', 'show': False,
+        'popup': {'emoji': '🎯', 'tooltip': '🎯 2026 - ', 'tipo': 'Distribuidor Autorizado',
+                  'estado': 'Próxima Apertura 2026', 'color_estado': 'purple', 'ancho_minimo': 320, 'ancho_maximo': 350,
+                  'campos': _CAMPOS_DISTRIBUIDOR, 'pie': '📍 Apertura Programada 2026 - Carnes San Martín'}
+    },
+    'tiendas_oro_2026': {
+        'archivo': 'tiendas_oro.json', 'grupo': 'apertura_2026',
+        'tipo': 'tiendas_oro', 'estado_icono': 'proxima_apertura',
+        'icono_control': 'images/iconos/logo-dorado-activo-next.png',
+        'control': '<img src="{icono}" width="16" height="16" style="vertical-align: middle; margin-right: 1px;"> 2026 Tiendas Oro ({total})', 'show': False,
+        'popup': {'emoji': '🎯', 'tooltip': '🎯 2026 - ', 'tipo': None,
+                  'estado': 'Próxima Apertura 2026', 'color_estado': 'purple', 'ancho_minimo': 300, 'ancho_maximo': 350,
+                  'campos': _CAMPOS_TIENDA_ORO, 'pie': '📍 Apertura Programada 2026 - Tienda Oro'}
+    },
+    'tiendas_satelite_2026': {
+        'archivo': 'tiendas_satelite.json', 'grupo': 'apertura_2026',
+        'tipo': 'tiendas_satelite', 'estado_icono': 'proxima_apertura',
+        'icono_control': 'images/iconos/logo-azul-activo-next.png',
+        'control': '<img src="{icono}" width="16" height="16" style="vertical-align: middle; margin-left: 1px;"> 2026 Tiendas Satélite ({total})', 'show': False,
+        'popup': {'emoji': '🎯', 'tooltip': '🎯 2026 - ', 'tipo': None,
+                  'estado': 'Próxima Apertura 2026', 'color_estado': 'purple', 'ancho_minimo': 300, 'ancho_maximo': 350,
+                  'campos': _CAMPOS_TIENDA_SATELITE, 'pie': '📍 Apertura Programada 2026 - Tienda Satélite'}
+    },
+}
+
+class CargadorCapa(JSCSSMixin, folium.MacroElement):
+    """Registra un FeatureGroup vacío para que el navegador pida sus teselas, clusters o calor al activarlo"""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            registrarCapaMapa(
+                {{ this._parent._parent.get_name() }},
+                {{ this._parent.get_name() }},
+                {{ this.opciones|tojson }}
+            );
+        {% endmacro %}
+    """)
+
+    def __init__(self, capa, total=0):
+        super().__init__()
+        # URL con huella: el navegador la guarda en caché hasta que cambie el archivo
+        self.default_js = [('mapa_capas.js', url_estatica('js/mapa_capas.js'))]
+        self._name = 'CargadorCapa'
+        self.opciones = {'capa': capa}
+        if total > UMBRAL_CLUSTERS:
+            # Con muchos puntos el navegador pide los clusters del zoom visible
+            self.opciones['url_clusters'] = f'/api/mapa/clusters/{capa}'
+        elif capa in CAPAS_GEOJSON:
+            # Si no, solo las teselas que quedan en pantalla
+            self.opciones['url_teselas'] = f'/tiles/{capa}'
+        if capa == 'calor':
+            # La densidad se calcula en el servidor y llega como teselas PNG
+            self.opciones['url_calor'] = '/tiles/calor/{z}/{x}/{y}.png'
+            self.opciones['zoom_maximo'] = ZOOM_MAXIMO
+        else:
+            spec = CAPAS_GEOJSON[capa]
+            icono = obtener_icono_personalizado(spec['estado_icono'], spec['tipo'])
+            # Opciones de L.icon en camelCase (iconUrl, iconSize, iconAnchor)
+            self.opciones['icono'] = {camelize(k): v for k, v in icono.options.items()} if icono else None
+            self.opciones['tooltip'] = spec['popup']['tooltip']
+            self.opciones['ancho_popup'] = spec['popup']['ancho_maximo']
+
+
+def particionar_coleccion(datos):
+    """Reparte los registros de una colección en sus grupos en una sola pasada"""
+    grupos = {grupo: [] for grupo in FILTROS_GRUPO}
+    for item in datos:
+        for grupo, filtro in FILTROS_GRUPO.items():
+            if filtro(item):
+                grupos[grupo].append(item)
+                break
+    return grupos
+
+def obtener_particion(particiones, archivo):
+    """Grupos de una colección, cargándola solo la primera vez en esta construcción del mapa"""
+    if archivo not in particiones:
+        particiones[archivo] = particionar_coleccion(cargar_datos_desde_json(archivo))
+    return particiones[archivo]
+
+def agregar_capa(mapa, capa, particiones):
+    """Agrega al mapa el FeatureGroup (vacío, con su cargador) de una capa"""
+    if capa == 'calor':
+        # El mapa de calor muestra los activos de todas las colecciones
+        total = sum(len(obtener_particion(particiones, archivo)['activos']) for archivo in PESOS_CALOR)
+        if not total:
+            print("⚠️ No hay puntos para el mapa de calor")
+            return
+        feature_group = folium.FeatureGroup(name='Mapa de Calor - Densidad Actual', show=False)
+    else:
+        spec = CAPAS_GEOJSON[capa]
+        total = len(obtener_particion(particiones, spec['archivo'])[spec['grupo']])
+        etiqueta = spec['control'].format(total=total, icono=url_estatica(spec['icono_control']))
+        feature_group = folium.FeatureGroup(name=etiqueta, show=spec['show'])
+
+    # Los marcadores se descargan al activar la capa
+    CargadorCapa(capa, total=total).add_to(feature_group)
+    feature_group.add_to(mapa)
+
+def _punto_geojson(item, propiedades):
+    """Feature GeoJSON de un registro, o None si sus coordenadas no son válidas"""
     try:
-        # Cargar todos los datos
-        distribuidores = cargar_datos_desde_json('distribuidores_autorizados.json')
-        tiendas_oro = cargar_datos_desde_json('tiendas_oro.json')
-        tiendas_satelite = cargar_datos_desde_json('tiendas_satelite.json')
-        centros = cargar_datos_desde_json('centros_distribucion.json')
-        
-        # Filtrar solo activos y obtener coordenadas
-        puntos_calor = []
-        
-        # Centros de distribución (peso alto)
-        for centro in [c for c in centros if c.get('estado') == 'activo']:
-            puntos_calor.append([centro['lat'], centro['lon'], 5.0])  # Peso 3
-        
-        # Distribuidores (peso medio)
-        for dist in [d for d in distribuidores if d.get('estado') == 'activo']:
-            puntos_calor.append([dist['lat'], dist['lon'], 15.0])  # Peso 2
-        
-        # Tiendas Oro (peso medio-alto)
-        for tienda in [t for t in tiendas_oro if t.get('estado') == 'activo']:
-            puntos_calor.append([tienda['lat'], tienda['lon'], 5.5])  # Peso 2.5
-        
-        # Tiendas Satélite (peso bajo)
-        for tienda in [t for t in tiendas_satelite if t.get('estado') == 'activo']:
-            puntos_calor.append([tienda['lat'], tienda['lon'], 5.5])  # Peso 1.5
-        
-        if puntos_calor:
-            # Crear capa de calor
-            from folium.plugins import HeatMap
-            
-            heat_map = HeatMap(
-                puntos_calor,
-                name='Mapa de Calor - Densidad Actual',
-                show=False,
-                min_opacity=0.1,
-                max_zoom=50,
-                radius=30,
-                blur=30,
-                 gradient={
-                    0.1: 'blue',
-                    0.6: 'cyan', 
-                    0.8: 'lime',
-                    0.9: 'yellow',
-                    1.0: 'red'
+        lat = round(float(item['lat']), 6)
+        lon = round(float(item['lon']), 6)
+    except (KeyError, TypeError, ValueError):
+        return None
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+        'properties': propiedades
+    }
+
+def feature_capa(spec, item):
+    """Feature de un marcador: id y tipo (el popup se pide al abrirlo) y nombre para el tooltip"""
+    return _punto_geojson(item, {'id': item.get('id'), 'tipo': spec['tipo'], 'nombre': item.get('nombre')})
+
+def generar_geojson_capa(capa):
+    """FeatureCollection de una capa del mapa"""
+    spec = CAPAS_GEOJSON[capa]
+    features = []
+    for item in cargar_datos_desde_json(spec['archivo']):
+        if en_capa(spec, item):
+            feature = feature_capa(spec, item)
+            if feature:
+                features.append(feature)
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+# ============================================================================
+# CLUSTERS DE MARCADORES POR NIVEL DE ZOOM
+# ============================================================================
+
+# capa -> {'version': ..., 'niveles': {zoom: [cluster, ...]}}
+_cache_clusters = {}
+_cache_clusters_lock = threading.Lock()
+
+
+def _proyectar(lon, lat):
+    """Lon/lat a coordenadas Web Mercator normalizadas en [0, 1]"""
+    seno = math.sin(math.radians(max(min(lat, 85.0511), -85.0511)))
+    x = lon / 360.0 + 0.5
+    y = 0.5 - 0.25 * math.log((1 + seno) / (1 - seno)) / math.pi
+    return x, y
+
+def _desproyectar(x, y):
+    """Inversa de _proyectar"""
+    lon = (x - 0.5) * 360.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+    return lon, lat
+
+def _agrupar_nivel(elementos, radio):
+    """Agrupa los elementos de un nivel cuyo centro queda a menos de `radio`
+
+    Cada elemento es un dict con x, y, cantidad y feature (solo si es un
+    punto suelto). Los que no se agrupan pasan al siguiente nivel tal cual,
+    conservando su zoom de expansión.
+    """
+    celdas = {}
+    for indice, elemento in enumerate(elementos):
+        clave = (int(elemento['x'] / radio), int(elemento['y'] / radio))
+        celdas.setdefault(clave, []).append(indice)
+
+    radio2 = radio * radio
+    usados = [False] * len(elementos)
+    resultado = []
+    for indice, elemento in enumerate(elementos):
+        if usados[indice]:
+            continue
+        usados[indice] = True
+        cx, cy = int(elemento['x'] / radio), int(elemento['y'] / radio)
+        vecinos = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for otro in celdas.get((cx + dx, cy + dy), ()):
+                    if usados[otro]:
+                        continue
+                    ox = elementos[otro]['x'] - elemento['x']
+                    oy = elementos[otro]['y'] - elemento['y']
+                    if ox * ox + oy * oy <= radio2:
+                        usados[otro] = True
+                        vecinos.append(elementos[otro])
+
+        if not vecinos:
+            resultado.append(elemento)
+            continue
+
+        grupo = [elemento] + vecinos
+        cantidad = sum(e['cantidad'] for e in grupo)
+        resultado.append({
+            'x': sum(e['x'] * e['cantidad'] for e in grupo) / cantidad,
+            'y': sum(e['y'] * e['cantidad'] for e in grupo) / cantidad,
+            'cantidad': cantidad,
+            'feature': None,
+            'expansion': None  # se fija en calcular_clusters_capa
+        })
+    return resultado
+
+def calcular_clusters_capa(capa):
+    """Clusters jerárquicos de una capa para cada zoom de 0 a ZOOM_MAXIMO
+
+    Se parte de los puntos sueltos en ZOOM_MAXIMO + 1 y cada nivel agrupa
+    los clusters del nivel siguiente, como hace supercluster en Leaflet.
+    """
+    elementos = []
+    for feature in generar_geojson_capa(capa)['features']:
+        x, y = _proyectar(*feature['geometry']['coordinates'])
+        elementos.append({'x': x, 'y': y, 'cantidad': 1, 'feature': feature, 'expansion': None})
+
+    niveles = {}
+    for zoom in range(ZOOM_MAXIMO, -1, -1):
+        elementos = _agrupar_nivel(elementos, RADIO_CLUSTER_PX / (256.0 * 2 ** zoom))
+        for elemento in elementos:
+            if elemento['feature'] is None and elemento['expansion'] is None:
+                # Al acercarse un nivel el cluster ya se ve separado
+                elemento['expansion'] = zoom + 1
+        niveles[zoom] = elementos
+    return niveles
+
+def obtener_clusters_capa(capa):
+    """Clusters de la capa, recalculados solo cuando cambian sus datos"""
+    version = almacen.version(CAPAS_GEOJSON[capa]['archivo'])
+    entrada = _cache_clusters.get(capa)
+    if entrada and entrada['version'] == version:
+        return entrada['niveles']
+
+    with _cache_clusters_lock:
+        entrada = _cache_clusters.get(capa)
+        if not entrada or entrada['version'] != version:
+            inicio = time.time()
+            entrada = {'version': version, 'niveles': calcular_clusters_capa(capa)}
+            _cache_clusters[capa] = entrada
+            print(f"🔵 Clusters de '{capa}' calculados en {time.time() - inicio:.2f}s")
+        return entrada['niveles']
+
+def geojson_clusters(elementos, bbox=None):
+    """FeatureCollection con los clusters (y puntos sueltos) de un nivel"""
+    features = []
+    for elemento in elementos:
+        if elemento['feature'] is not None:
+            lon, lat = elemento['feature']['geometry']['coordinates']
+        else:
+            lon, lat = _desproyectar(elemento['x'], elemento['y'])
+        if bbox and not (bbox[0] <= lon <= bbox[2] and bbox[1] <= lat <= bbox[3]):
+            continue
+        if elemento['feature'] is not None:
+            features.append(elemento['feature'])
+        else:
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [round(lon, 6), round(lat, 6)]},
+                'properties': {
+                    'cluster': True,
+                    'cantidad': elemento['cantidad'],
+                    'zoom_expansion': elemento['expansion']
                 }
-            )
-            heat_map.add_to(mapa)
-            
-            print(f"✅ Mapa de calor agregado con {len(puntos_calor)} puntos")
+            })
+    return {'type': 'FeatureCollection', 'features': features}
+
+def parsear_bbox(texto):
+    """'minLon,minLat,maxLon,maxLat' -> tupla de floats (ValueError si no es válido)"""
+    partes = [float(valor) for valor in texto.split(',')]
+    if len(partes) != 4 or partes[0] > partes[2] or partes[1] > partes[3]:
+        raise ValueError('bbox debe ser minLon,minLat,maxLon,maxLat')
+    return tuple(partes)
+
+
+# ============================================================================
+# ÍNDICE ESPACIAL DE UBICACIONES
+# ============================================================================
+
+# Tamaño (en grados) de cada celda de la rejilla del índice
+TAMANO_CELDA_INDICE = 0.1
+
+
+class IndiceEspacial:
+    """Rejilla uniforme en memoria con las ubicaciones de las cuatro colecciones
+
+    Las rutas CRUD la mantienen al día con registrar/quitar. Si otro proceso
+    modifica una colección (cambia su versión compartida en el almacén) esa
+    colección se vuelve a indexar completa en la siguiente búsqueda, y con el
+    registro de cambios se borran solo las teselas de los registros que
+    cambiaron: su posición indexada y cada posición que tuvieron después.
+    """
+
+    def __init__(self, tamano_celda=TAMANO_CELDA_INDICE):
+        self.tamano_celda = tamano_celda
+        self._celdas = {}      # (cx, cy) -> {(tipo, id): registro}
+        self._posiciones = {}  # (tipo, id) -> (cx, cy)
+        self._versiones = {}   # tipo -> versión compartida indexada (None = desactualizado)
+        self._secuencias = {}  # tipo -> secuencia del registro de cambios leída al indexar
+        self._lock = threading.RLock()
+
+    def _celda(self, lat, lon):
+        return (math.floor(lon / self.tamano_celda), math.floor(lat / self.tamano_celda))
+
+    def _quitar(self, tipo, item_id):
+        celda = self._posiciones.pop((tipo, item_id), None)
+        if celda is not None:
+            registros = self._celdas[celda]
+            registros.pop((tipo, item_id), None)
+            if not registros:
+                del self._celdas[celda]
+
+    def _agregar(self, tipo, item):
+        self._quitar(tipo, item.get('id'))
+        try:
+            lat, lon = float(item['lat']), float(item['lon'])
+        except (KeyError, TypeError, ValueError):
+            return
+        celda = self._celda(lat, lon)
+        self._celdas.setdefault(celda, {})[(tipo, item.get('id'))] = dict(item, tipo=tipo, lat=lat, lon=lon)
+        self._posiciones[(tipo, item.get('id'))] = celda
+
+    def _sincronizar(self, tipo):
+        """Reindexa la colección si cambió fuera de este proceso"""
+        archivo = ARCHIVOS_POR_TIPO[tipo]
+        version = almacen.version_compartida(archivo)
+        if self._versiones.get(tipo) == version:
+            return
+        # Los cambios se leen antes que los datos: los posteriores se vuelven a ver la próxima vez
+        desde = self._secuencias.get(tipo)
+        seq, entradas = almacen.cambios_desde(desde or 0)
+        anteriores = {str(clave[1]): self._posicion(*clave) for clave in self._posiciones if clave[0] == tipo}
+        for clave in [clave for clave in self._posiciones if clave[0] == tipo]:
+            self._quitar(*clave)
+        for item in cargar_datos_desde_json(archivo):
+            self._agregar(tipo, item)
+        # La versión leída antes de cargar: si algo cambió entre medias se reindexa otra vez
+        self._versiones[tipo] = version
+        self._secuencias[tipo] = seq
+
+        entradas = [entrada for entrada in entradas if entrada['archivo'] == archivo] \
+            if [entrada['seq'] for entrada in entradas] == list(range((desde or 0) + 1, seq + 1)) else None
+        if desde is None or entradas is None or any(entrada['op'] == 'reiniciar' for entrada in entradas):
+            # Primer índice del proceso, colección reemplazada o registro compactado
+            # (faltan posiciones intermedias): las teselas del tipo ya no sirven
+            cache_teselas.invalidar_tipo(tipo)
         else:
-            print("⚠️ No hay puntos para el mapa de calor")
-            
-    except Exception as e:
-        print(f"❌ Error creando mapa de calor: {e}")
+            coordenadas = set()
+            for entrada in entradas:
+                coordenadas.add(anteriores.get(str(entrada['id'])))
+                if 'lat' in entrada:
+                    coordenadas.add((entrada['lat'], entrada['lon']))
+            cache_teselas.invalidar(tipo, coordenadas)
+        print(f"🧭 Índice espacial reconstruido para {tipo}")
+
+    def sincronizar(self, tipos=None):
+        """Reindexa las colecciones que cambiaron fuera de las rutas CRUD"""
+        with self._lock:
+            for tipo in tipos or ARCHIVOS_POR_TIPO:
+                self._sincronizar(tipo)
+
+    def _posicion(self, tipo, item_id):
+        celda = self._posiciones.get((tipo, item_id))
+        if celda is None:
+            return None
+        anterior = self._celdas[celda][(tipo, item_id)]
+        return anterior['lat'], anterior['lon']
+
+    def registrar(self, tipo, item):
+        """Inserta o mueve un registro tras guardarlo en el almacén"""
+        with self._lock:
+            if tipo not in self._versiones:
+                # Sin posición anterior conocida: descartar todas las teselas del tipo
+                cache_teselas.invalidar_tipo(tipo)
+                return
+            anterior = self._posicion(tipo, item.get('id'))
+            self._agregar(tipo, item)
+            self._adoptar_escritura(tipo)
+            cache_teselas.invalidar(tipo, [anterior, self._posicion(tipo, item.get('id'))])
+
+    def quitar(self, tipo, item_id):
+        """Elimina un registro tras borrarlo del almacén"""
+        with self._lock:
+            if tipo not in self._versiones:
+                cache_teselas.invalidar_tipo(tipo)
+                return
+            anterior = self._posicion(tipo, item_id)
+            self._quitar(tipo, item_id)
+            self._adoptar_escritura(tipo)
+            cache_teselas.invalidar(tipo, [anterior])
+
+    def _adoptar_escritura(self, tipo):
+        """Tras aplicar una escritura propia, el índice solo queda al día si el
+        almacén no cambió por otra vía desde la versión indexada"""
+        escritura = almacen.ultima_escritura(ARCHIVOS_POR_TIPO[tipo])
+        # En un lote la misma escritura se registra una vez por registro
+        if escritura and self._versiones.get(tipo) in escritura:
+            self._versiones[tipo] = escritura[1]
+        else:
+            # Otro proceso escribió entre medias: reindexar en la próxima búsqueda
+            self._versiones[tipo] = None
+
+    def buscar(self, bbox, tipos=None, estados=None):
+        """Registros dentro de bbox (minLon, minLat, maxLon, maxLat)"""
+        min_lon, min_lat, max_lon, max_lat = bbox
+        tipos = list(tipos or ARCHIVOS_POR_TIPO)
+        with self._lock:
+            self.sincronizar(tipos)
+
+            x0, y0 = self._celda(min_lat, min_lon)
+            x1, y1 = self._celda(max_lat, max_lon)
+            if (x1 - x0 + 1) * (y1 - y0 + 1) <= len(self._celdas):
+                celdas = (
+                    self._celdas.get((cx, cy), {})
+                    for cx in range(x0, x1 + 1)
+                    for cy in range(y0, y1 + 1)
+                )
+            else:
+                # bbox muy grande: recorrer solo las celdas ocupadas
+                celdas = (
+                    registros for (cx, cy), registros in self._celdas.items()
+                    if x0 <= cx <= x1 and y0 <= cy <= y1
+                )
+
+            resultado = []
+            for registros in celdas:
+                for (tipo, _), item in registros.items():
+                    if tipo not in tipos:
+                        continue
+                    if estados and item.get('estado') not in estados:
+                        continue
+                    if min_lon <= item['lon'] <= max_lon and min_lat <= item['lat'] <= max_lat:
+                        resultado.append(item)
+            return resultado
+
+
+indice_ubicaciones = IndiceEspacial()
+
+
+# ============================================================================
+# TESELAS GEOJSON CON CACHÉ LRU EN DISCO
+# ============================================================================
+
+def tesela_de(lat, lon, zoom):
+    """(x, y) de la tesela XYZ que contiene el punto"""
+    x, y = _proyectar(lon, lat)
+    n = 2 ** zoom
+    return min(int(x * n), n - 1), min(int(y * n), n - 1)
+
+def limites_tesela(zoom, x, y):
+    """(minLon, minLat, maxLon, maxLat) de una tesela XYZ"""
+    n = 2.0 ** zoom
+    min_lon, max_lat = _desproyectar(x / n, y / n)
+    max_lon, min_lat = _desproyectar((x + 1) / n, (y + 1) / n)
+    return min_lon, min_lat, max_lon, max_lat
+
+def generar_tesela(capa, zoom, x, y):
+    """FeatureCollection con los marcadores de la capa dentro de la tesela"""
+    spec = CAPAS_GEOJSON[capa]
+    features = []
+    for item in indice_ubicaciones.buscar(limites_tesela(zoom, x, y), [spec['tipo']]):
+        # Los puntos sobre el borde se quedan solo en una tesela
+        if en_capa(spec, item) and tesela_de(item['lat'], item['lon'], zoom) == (x, y):
+            feature = feature_capa(spec, item)
+            if feature:
+                features.append(feature)
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+class CacheTeselas:
+    """Teselas ya generadas guardadas en disco, con límite de tamaño LRU
+
+    El orden de uso se lleva en memoria (al arrancar se toma la fecha de
+    modificación de cada archivo). Cada escritura en una colección borra
+    solo las teselas que contienen la coordenada anterior o la nueva. Una
+    tesela generada solo se guarda si la versión compartida de su colección
+    no cambió mientras tanto (comprobado con el mismo bloqueo entre procesos
+    con el que se borran), así ningún worker deja en disco una tesela vieja.
+    """
+
+    def __init__(self, ruta, max_bytes):
+        self.ruta = ruta
+        self.max_bytes = max_bytes
+        self._uso = None  # ruta de archivo -> tamaño, de menos a más reciente
+        self._total = 0
+        self._invalidaciones = 0
+        self._lock = threading.RLock()
+
+    def _ruta_tesela(self, capa, zoom, x, y):
+        return os.path.join(self.ruta, capa, str(zoom), str(x), f'{y}.geojson')
+
+    def _bloqueo(self):
+        # Fuera de la carpeta de teselas para que el LRU no lo borre
+        os.makedirs(os.path.dirname(self.ruta) or '.', exist_ok=True)
+        return _bloqueo_archivo(self.ruta + '.lock')
+
+    def _cargar_uso(self):
+        if self._uso is not None:
+            return
+        archivos = []
+        for carpeta, _, nombres in os.walk(self.ruta):
+            for nombre in nombres:
+                ruta = os.path.join(carpeta, nombre)
+                try:
+                    estado = os.stat(ruta)
+                except OSError:
+                    continue
+                archivos.append((estado.st_mtime, ruta, estado.st_size))
+        self._uso = OrderedDict((ruta, tamano) for _, ruta, tamano in sorted(archivos))
+        self._total = sum(self._uso.values())
+
+    def _borrar(self, ruta):
+        self._total -= self._uso.pop(ruta, 0)
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+    def obtener(self, capa, zoom, x, y):
+        """Contenido de la tesela, generándola y guardándola si no está en disco"""
+        ruta = self._ruta_tesela(capa, zoom, x, y)
+        with self._lock:
+            self._cargar_uso()
+            invalidaciones = self._invalidaciones
+            try:
+                with open(ruta, 'rb') as f:
+                    cuerpo = f.read()
+                if ruta in self._uso:
+                    self._uso.move_to_end(ruta)
+                else:
+                    # Generada por otro proceso
+                    self._uso[ruta] = len(cuerpo)
+                    self._total += len(cuerpo)
+                return cuerpo
+            except FileNotFoundError:
+                # Pudo borrarla otro proceso al invalidar
+                self._total -= self._uso.pop(ruta, 0)
+
+        # Se genera sin el bloqueo: el índice espacial también invalida teselas
+        archivo = CAPAS_GEOJSON[capa]['archivo']
+        version = almacen.version_compartida(archivo)
+        cuerpo = json.dumps(generar_tesela(capa, zoom, x, y), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+        with self._lock:
+            if invalidaciones != self._invalidaciones:
+                # Hubo escrituras mientras se generaba: no guardar una tesela quizá vieja
+                return cuerpo
+            with self._bloqueo():
+                # Escrituras de otros procesos: sus invalidaciones toman este mismo bloqueo
+                if almacen.version_compartida(archivo) != version:
+                    return cuerpo
+                os.makedirs(os.path.dirname(ruta), exist_ok=True)
+                temporal = f'{ruta}.{os.getpid()}.tmp'
+                with open(temporal, 'wb') as f:
+                    f.write(cuerpo)
+                os.replace(temporal, ruta)
+            self._total -= self._uso.pop(ruta, 0)
+            self._uso[ruta] = len(cuerpo)
+            self._total += len(cuerpo)
+
+            while self._total > self.max_bytes and len(self._uso) > 1:
+                self._borrar(next(iter(self._uso)))
+            return cuerpo
+
+    def invalidar(self, tipo, coordenadas):
+        """Borra en todas las capas del tipo las teselas que contienen alguna coordenada"""
+        capas = [capa for capa, spec in CAPAS_GEOJSON.items() if spec['tipo'] == tipo]
+        with self._lock, self._bloqueo():
+            self._cargar_uso()
+            self._invalidaciones += 1
+            for coordenada in coordenadas:
+                if coordenada is None:
+                    continue
+                lat, lon = coordenada
+                for zoom in range(ZOOM_MAXIMO + 1):
+                    x, y = tesela_de(lat, lon, zoom)
+                    for capa in capas:
+                        self._borrar(self._ruta_tesela(capa, zoom, x, y))
+
+    def invalidar_tipo(self, tipo):
+        """Borra todas las teselas de las capas del tipo"""
+        with self._lock, self._bloqueo():
+            self._cargar_uso()
+            self._invalidaciones += 1
+            for capa, spec in CAPAS_GEOJSON.items():
+                if spec['tipo'] != tipo:
+                    continue
+                prefijo = os.path.join(self.ruta, capa) + os.sep
+                for ruta in [ruta for ruta in self._uso if ruta.startswith(prefijo)]:
+                    self._borrar(ruta)
+                for carpeta, _, nombres in os.walk(prefijo):
+                    for nombre in nombres:
+                        self._borrar(os.path.join(carpeta, nombre))
+
+
+cache_teselas = CacheTeselas(TESELAS_PATH, TESELAS_MAX_BYTES)
+
+
+# ============================================================================
+# TESELAS PNG DEL MAPA DE CALOR
+# ============================================================================
+
+TAMANO_TESELA = 256
+
+# Teselas de calor guardadas en memoria (las más usadas) para la versión actual de los datos
+MAX_TESELAS_CALOR = 2048
+
+COLORES_RGB = {
+    'blue': (0, 0, 255),
+    'cyan': (0, 255, 255),
+    'lime': (0, 255, 0),
+    'yellow': (255, 255, 0),
+    'red': (255, 0, 0)
+}
+
+# {'version': ..., 'puntos': (x, y, peso), 'teselas': OrderedDict}
+_cache_calor = {'version': None}
+_cache_calor_lock = threading.Lock()
+
+
+def codificar_png(rgba):
+    """PNG RGBA de 8 bits a partir de un array (alto, ancho, 4) de uint8"""
+    alto, ancho, _ = rgba.shape
+
+    def bloque(tipo, datos):
+        return (len(datos).to_bytes(4, 'big') + tipo + datos
+                + zlib.crc32(tipo + datos).to_bytes(4, 'big'))
+
+    # Cada fila lleva delante el filtro 0 (ninguno)
+    filas = np.zeros((alto, ancho * 4 + 1), dtype=np.uint8)
+    filas[:, 1:] = rgba.reshape(alto, ancho * 4)
+    cabecera = ancho.to_bytes(4, 'big') + alto.to_bytes(4, 'big') + bytes([8, 6, 0, 0, 0])
+    return (b'\x89PNG\r\n\x1a\n' + bloque(b'IHDR', cabecera)
+            + bloque(b'IDAT', zlib.compress(filas.tobytes(), 6)) + bloque(b'IEND', b''))
+
+def _paleta_calor():
+    """256 colores RGB interpolando el gradiente de OPCIONES_CALOR, como leaflet-heat"""
+    paradas = sorted(OPCIONES_CALOR['gradient'].items())
+    posiciones = [posicion for posicion, _ in paradas]
+    niveles = np.linspace(0, 1, 256)
+    return np.stack([
+        np.interp(niveles, posiciones, [COLORES_RGB[color][canal] for _, color in paradas])
+        for canal in range(3)
+    ], axis=1).astype(np.uint8)
+
+def _nucleo_calor():
+    """Huella de un punto: círculo de `radius` px difuminado con `blur` px"""
+    radio, difuminado = OPCIONES_CALOR['radius'], OPCIONES_CALOR['blur']
+    alcance = radio + difuminado
+    eje = np.arange(-alcance, alcance + 1)
+    distancia = np.hypot(*np.meshgrid(eje, eje))
+    # Opaco dentro del círculo y borde suave de ancho `blur` (similar al shadowBlur del canvas)
+    t = np.clip((alcance - distancia) / difuminado, 0, 1)
+    return t * t * (3 - 2 * t)
+
+PALETA_CALOR = _paleta_calor()
+NUCLEO_CALOR = _nucleo_calor()
+
+def _puntos_calor():
+    """Arrays (x, y, peso) de los puntos activos en Web Mercator normalizado"""
+    xs, ys, pesos = [], [], []
+    peso_maximo = max(PESOS_CALOR.values())
+    for archivo, peso in PESOS_CALOR.items():
+        for item in cargar_datos_desde_json(archivo):
+            if not es_activo(item):
+                continue
+            try:
+                x, y = _proyectar(float(item['lon']), float(item['lat']))
+            except (KeyError, TypeError, ValueError):
+                continue
+            xs.append(x)
+            ys.append(y)
+            pesos.append(peso / peso_maximo)
+    return np.array(xs), np.array(ys), np.array(pesos)
 
+def renderizar_tesela_calor(puntos, zoom, x, y):
+    """Densidad de kernel de los puntos sobre una tesela, coloreada con el gradiente"""
+    xs, ys, pesos = puntos
+    margen = NUCLEO_CALOR.shape[0] // 2
+    lado = TAMANO_TESELA + 2 * margen
+    escala = TAMANO_TESELA * 2 ** zoom
 
+    # Píxeles de cada punto dentro de la tesela ampliada con el alcance del núcleo
+    px = np.floor(xs * escala - x * TAMANO_TESELA + margen).astype(np.int64)
+    py = np.floor(ys * escala - y * TAMANO_TESELA + margen).astype(np.int64)
+    dentro = (px >= 0) & (px < lado) & (py >= 0) & (py < lado)
+    if not dentro.any():
+        return None
 
+    rejilla = np.bincount(py[dentro] * lado + px[dentro], weights=pesos[dentro], minlength=lado * lado)
+    rejilla = rejilla.reshape(lado, lado)
 
+    # Convolución con el núcleo por FFT
+    forma = (lado + NUCLEO_CALOR.shape[0] - 1,) * 2
+    densidad = np.fft.irfft2(np.fft.rfft2(rejilla, forma) * np.fft.rfft2(NUCLEO_CALOR, forma), forma)
+    densidad = densidad[2 * margen:2 * margen + TAMANO_TESELA, 2 * margen:2 * margen + TAMANO_TESELA]
 
+    # Cada punto se pinta con opacidad minOpacity; superponer N puntos da 1 - (1 - a)^N
+    opacidad = 1 - (1 - OPCIONES_CALOR['minOpacity']) ** np.clip(densidad, 0, None)
+    if opacidad.max() < 1 / 255:
+        return None
+    indices = np.clip((opacidad * 255).astype(np.int64), 0, 255)
+
+    rgba = np.empty((TAMANO_TESELA, TAMANO_TESELA, 4), dtype=np.uint8)
+    rgba[..., :3] = PALETA_CALOR[indices]
+    rgba[..., 3] = indices
+    return codificar_png(rgba)
+
+TESELA_VACIA = codificar_png(np.zeros((TAMANO_TESELA, TAMANO_TESELA, 4), dtype=np.uint8))
+
+def obtener_tesela_calor(zoom, x, y):
+    """Devuelve el PNG de la tesela de calor, cacheado por versión de los datos"""
+    version = tuple(almacen.version(archivo) for archivo in PESOS_CALOR)
+    with _cache_calor_lock:
+        if _cache_calor['version'] != version:
+            _cache_calor.update(version=version, puntos=_puntos_calor(), teselas=OrderedDict())
+        teselas = _cache_calor['teselas']
+        clave = (zoom, x, y)
+        if clave in teselas:
+            teselas.move_to_end(clave)
+            return teselas[clave]
+        puntos = _cache_calor['puntos']
+
+    png = renderizar_tesela_calor(puntos, zoom, x, y) or TESELA_VACIA
+
+    with _cache_calor_lock:
+        if _cache_calor['version'] == version:
+            teselas[clave] = png
+            while len(teselas) > MAX_TESELAS_CALOR:
+                teselas.popitem(last=False)
+    return png
 
 
 def crear_mapa_completo():
-    """Crea el mapa completo y devuelve el HTML"""
+    """Crea el mapa completo y devuelve sus partes (cabecera, cuerpo y script) para la plantilla"""
     # ✅ Usar el mapa base mejorado con múltiples tipos de mapas
     mapa = crear_mapa_base_mejorado()
-    agregar_mapa_calor(mapa)
-    
-    # ============================================================================
-    # CAPAS PRINCIPALES (SOLO ACTIVAS)
-    # ============================================================================
-    agregar_capa_centros_distribucion(mapa)
-    agregar_capa_distribuidores(mapa)
-    agregar_capa_tiendas_oro(mapa)
-    agregar_capa_tiendas_satelite(mapa)
     
     # ============================================================================
-    # CAPAS FILTRADAS 2026
+    # MAPA DE CALOR, CAPAS PRINCIPALES (SOLO ACTIVAS) Y CAPAS FILTRADAS 2026
     # ============================================================================
-    agregar_capa_distribuidores_2026(mapa)
-    agregar_capa_tiendas_oro_2026(mapa)
-    agregar_capa_tiendas_satelite_2026(mapa)
+    # Cada capa sale de la caché de fragmentos y solo se vuelve a generar
+    # cuando cambia alguna de las colecciones de las que depende
+    agregar_capas_cacheadas(mapa)
  
     
     # ============================================================================
@@ -572,292 +3460,154 @@ def crear_mapa_completo():
     ).add_to(mapa)
     
     # ============================================================================
-    # PLUGINS ÚTILES
+    # RENDERIZAR LAS PARTES DEL MAPA
     # ============================================================================
-
+    # El CSS, la leyenda, el selector de capas y los ajustes para móviles están
+    # en templates/mapa.html, static/css/mapa.css y static/js/mapa.js
+    figura = mapa.get_root()
+    for hijo in figura._children.values():
+        hijo.render()
     
-    # ============================================================================
-    # CSS PERSONALIZADO COMPACTO
-    # ============================================================================
-    css_style = """
-<style>
-    /* SELECTOR DE CAPAS COMPACTO */
-    .leaflet-control-layers {
-        width: 100px !important;
-        max-width: 100px !important;
-        min-width: 100px !important;
-        font-size: 9px !important;
-        border: 1px solid #aaa !important;
-        border-radius: 5px !important;
-        background: white !important;
-        padding: 8px !important;
-        box-shadow: 0 2px 6px rgba(0,0,0,0.15) !important;
-        margin-top: 5px !important;
-        margin-left: 5px !important;
-    }
-
-    .leaflet-control-layers-expanded {
-        width: 100px !important;
-        max-width: 150px !important;
-        min-width: 150px !important;
-        padding: 1px !important;
-    }
-
-    .leaflet-control-layers-list {
-        font-size: 12px !important;
-        line-height: 1.3 !important;
+    return {
+        'cabecera': figura.header.render(),
+        'cuerpo': figura.html.render(),
+        'script': figura.script.render()
     }
 
-    .leaflet-control-layers label {
-        font-size: 10px !important;
-        margin-bottom: 4px !important;
-        padding: 4px 3px !important;
-        min-height: auto !important;
-        height: auto !important;
-        display: flex !important;
-        align-items: center !important;
-        cursor: pointer !important;
-        border-bottom: 1px solid #f0f0f0 !important;
-    }
 
-    .leaflet-control-layers label:last-child {
-        border-bottom: none !important;
-    }
+# ============================================================================
+# CONSULTAS DE COLECCIONES (PAGINACIÓN, FILTROS, ORDEN Y PROYECCIÓN)
+# ============================================================================
 
-    .leaflet-control-layers input[type="checkbox"] {
-        width: 8px !important;
-        height: 8px !important;
-        margin-right: 2px !important;
-        margin-top: 0 !important;
-        margin-bottom: 0 !important;
-        cursor: pointer !important;
-    }
+LIMITE_PAGINA_MAXIMO = 1000
+CAMPOS_ORDENABLES = ['id', 'nombre', 'ciudad', 'direccion', 'estado', 'fecha_apertura']
+CAMPOS_BUSQUEDA = ['id', 'nombre', 'ciudad', 'direccion']
+MAX_CONSULTAS_CACHEADAS = 64
 
-    .leaflet-control-layers span {
-        font-size: 8px !important;
-        line-height: 1.9 !important;
-        font-weight: normal !important;
-    }
+_cache_consultas = OrderedDict()  # (archivo, versión, filtros, orden) -> (claves, registros)
+_cache_consultas_lock = threading.Lock()
 
-    .leaflet-control-layers-toggle {
-        width: 30px !important;
-        height: 30px !important;
-    }
+def _texto_orden(valor):
+    return '' if valor is None else str(valor).casefold()
 
-    .leaflet-control-layers h4 {
-        font-size: 13px !important;
-        margin: 0 0 8px 0 !important;
-        padding: 0 !important;
-        font-weight: 600 !important;
+def leer_parametros_consulta(args):
+    """Filtros, orden, proyección y paginación de la query string (ValueError si no son válidos)"""
+    filtros = {
+        'ids': tuple(sorted(i for i in args.get('ids', '').split(',') if i)),
+        'estado': tuple(sorted(e for e in args.get('estado', '').split(',') if e)),
+        'ciudad': args.get('ciudad', '').strip().casefold(),
+        'desde': args.get('desde', ''),
+        'hasta': args.get('hasta', ''),
+        'q': args.get('q', '').strip().casefold()
     }
+    for campo in ('desde', 'hasta'):
+        if filtros[campo]:
+            date.fromisoformat(filtros[campo])
 
-    .leaflet-control-layers-base {
-        margin-bottom: 8px !important;
-    }
+    orden = args.get('sort', 'id')
+    if orden.lstrip('-') not in CAMPOS_ORDENABLES:
+        raise ValueError(f"sort debe ser uno de: {', '.join(CAMPOS_ORDENABLES)} (con '-' para descendente)")
+    campos = [campo for campo in args.get('fields', '').split(',') if campo]
 
-    .leaflet-control-layers-overlays {
-        margin-top: 10px !important;
-        border-top: 1px solid #e0e0e0 !important;
-        padding-top: 8px !important;
-    }
+    paginado = 'limit' in args or 'cursor' in args
+    limite = int(args.get('limit', 100))
+    if not 1 <= limite <= LIMITE_PAGINA_MAXIMO:
+        raise ValueError(f'limit debe estar entre 1 y {LIMITE_PAGINA_MAXIMO}')
+    cursor = None
+    if args.get('cursor'):
+        try:
+            cursor = tuple(json.loads(base64.urlsafe_b64decode(args['cursor'].encode('ascii'))))
+        except (ValueError, TypeError):
+            cursor = None
+        if cursor is None or len(cursor) != 2 or not all(isinstance(parte, str) for parte in cursor):
+            raise ValueError('cursor inválido')
+    return filtros, orden, campos, paginado, limite, cursor
 
-    .leaflet-control-layers label:hover {
-        background-color: #f8f9fa !important;
-        border-radius: 3px !important;
-    }
+def _cumple_filtros(registro, filtros):
+    if filtros['ids'] and str(registro.get('id')) not in filtros['ids']:
+        return False
+    if filtros['estado'] and registro.get('estado', 'activo') not in filtros['estado']:
+        return False
+    if filtros['ciudad'] and _texto_orden(registro.get('ciudad')).strip() != filtros['ciudad']:
+        return False
+    fecha = str(registro.get('fecha_apertura') or '')[:10]
+    if filtros['desde'] and not (fecha and fecha >= filtros['desde']):
+        return False
+    if filtros['hasta'] and not (fecha and fecha <= filtros['hasta']):
+        return False
+    if filtros['q'] and not any(filtros['q'] in _texto_orden(registro.get(campo)) for campo in CAMPOS_BUSQUEDA):
+        return False
+    return True
 
-    .leaflet-top.leaflet-left {
-        top: 100px !important;
-        left: 10px !important;
-    }
-</style>
-
-<script>
-// Sistema SIMPLE de mostrar/ocultar selector de capas
-document.addEventListener('DOMContentLoaded', function() {
-    setTimeout(function() {
-        const layerControl = document.querySelector('.leaflet-control-layers-expanded');
-        if (layerControl) {
-            // Agregar botón simple
-            const toggleBtn = document.createElement('button');
-            toggleBtn.innerHTML = '👁️';
-            toggleBtn.style.cssText = `
-                position: absolute;
-                top: 5px;
-                right: 5px;
-                background: #ffeb3b;
-                border: 1px solid #ccc;
-                border-radius: 3px;
-                cursor: pointer;
-                z-index: 1002;
-                padding: 2px 4px;
-                font-size: 12px;
-            `;
-            
-            let isVisible = true;
-            
-            toggleBtn.addEventListener('click', function(e) {
-                e.stopPropagation();
-                const list = layerControl.querySelector('.leaflet-control-layers-list');
-                if (list) {
-                    if (isVisible) {
-                        list.style.display = 'none';
-                        toggleBtn.innerHTML = '👁️‍🗨️';
-                        toggleBtn.title = 'Mostrar capas';
-                    } else {
-                        list.style.display = 'block';
-                        toggleBtn.innerHTML = '👁️';
-                        toggleBtn.title = 'Ocultar capas';
-                    }
-                    isVisible = !isVisible;
-                }
-            });
-            
-            layerControl.appendChild(toggleBtn);
-        }
-    }, 1000);
-});
-</script>
-"""
-    
-    # ============================================================================
-    # LEYENDA HORIZONTAL COMPACTA (CORREGIDA)
-    # ============================================================================
-    leyenda_html = """
-<div style="
-    position: fixed;
-    bottom: 20px;
-    left: 20px;
-    background: white;
-    padding: 10px 15px;
-    border-radius: 8px;
-    box-shadow: 0 2px 10px rgba(0,0,0,0.2);
-    border: 1px solid #ccc;
-    z-index: 1000;
-    font-family: 'Segoe UI', sans-serif;
-    font-size: 12px;
-    max-width: 90%;
-">
-    <div style="display: flex; flex-wrap: wrap; gap: 15px; justify-content: center;">
-        <div style="display: flex; align-items: center;">
-            <img src="/static/images/logo-verde-activo.png" width="16" height="16" style="margin-right: 5px;">
-            <span>Centro Distribución</span>
-        </div>
-        
-        <div style="display: flex; align-items: center;">
-            <img src="/static/images/logo-rojo-activo.png" width="16" height="16" style="margin-right: 5px;">
-            <span>Distribuidor</span>
-        </div>
-        
-        <div style="display: flex; align-items: center;">
-            <img src="/static/images/logo-dorado-activo.png" width="16" height="16" style="margin-right: 5px;">
-            <span>Tienda Oro</span>
-        </div>
-        
-        <div style="display: flex; align-items: center;">
-            <img src="/static/images/logo-azul-activo.png" width="16" height="16" style="margin-right: 5px;">
-            <span>Tienda Satélite</span>
-        </div>
-    </div>
-</div>
-"""
-    mapa.get_root().header.add_child(folium.Element(css_style))
-    
-    # ============================================================================
-    # RENDERIZAR Y CORREGIR EL HTML GENERADO
-    # ============================================================================
-    html = mapa.get_root().render()
-    
-    # 🔥 CORRECCIONES CRÍTICAS PARA MÓVILES
-    import re
-    
-    # 1. Corregir la estructura HTML base
-    html = html.replace('<html>', '<html style="height:100vh;width:100vw;overflow:hidden;">')
-    html = html.replace('<body>', '<body style="margin:0;padding:0;height:100vh;width:100vw;overflow:hidden;position:fixed;">')
-    
-    # 2. Reemplazar cualquier altura/anchura generada por Folium
-    html = re.sub(r'style="[^"]*height:\s*\d+px[^"]*"', 
-                 'style="height:100vh !important; width:100vw !important; position:absolute; top:0; left:0;"', 
-                 html)
-    
-    # 3. Asegurar que el div principal del mapa tenga las dimensiones correctas
-    html = re.sub(r'<div id="map"[^>]*>', 
-                 '<div id="map" style="height:100vh !important; width:100vw !important; position:absolute; top:0; left:0; z-index:0;">', 
-                 html)
-    
-    # 4. Corregir el iframe interno si existe
-    html = re.sub(r'<iframe[^>]*style="[^"]*"', 
-                 '<iframe style="height:100vh !important; width:100vw !important; border:none; position:absolute; top:0; left:0;"', 
-                 html)
-    
-    # 5. Agregar meta tags para móviles si no existen
-    if '<meta name="viewport"' not in html:
-        html = html.replace('<head>', 
-                           '<head>\n    <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no">\n    <meta name="apple-mobile-web-app-capable" content="yes">\n    <meta name="mobile-web-app-capable" content="yes">')
-    
-    # 6. Asegurar que el contenedor de Folium tenga clase para referencia
-    html = html.replace('class="folium-map"', 'class="folium-map" style="height:100vh !important; width:100vw !important; position:absolute; top:0; left:0;"')
-    
-    print("✅ Mapa renderizado con correcciones para móviles")
-    
-    return html
+def consultar_coleccion(archivo, version, filtros, orden):
+    """Registros filtrados y ordenados, con su clave de orden; cacheados por versión
 
+    Las páginas siguientes de una misma consulta solo buscan el cursor en la
+    lista de claves (bisect) y cortan `limit` registros.
+    """
+    clave = (archivo, version, tuple(sorted(filtros.items())), orden)
+    with _cache_consultas_lock:
+        if clave in _cache_consultas:
+            _cache_consultas.move_to_end(clave)
+            return _cache_consultas[clave]
 
+    # Siempre en orden ascendente: el descendente recorre la misma lista desde el final
+    campo = orden.lstrip('-')
+    filas = [((_texto_orden(registro.get(campo)), str(registro.get('id'))), registro)
+             for registro in almacen.iterar(archivo) if _cumple_filtros(registro, filtros)]
+    filas.sort(key=lambda fila: fila[0])
+    resultado = ([fila[0] for fila in filas], [fila[1] for fila in filas])
 
+    with _cache_consultas_lock:
+        _cache_consultas[clave] = resultado
+        while len(_cache_consultas) > MAX_CONSULTAS_CACHEADAS:
+            _cache_consultas.popitem(last=False)
+    return resultado
 
+def listar_coleccion(archivo):
+    """Respuesta de un GET de colección: lista completa o página (`limit`/`cursor`)
 
+    Sin `limit` ni `cursor` se devuelve la lista como siempre (con filtros,
+    orden y `fields` si se piden); con ellos, un objeto con `items`, `total`
+    y `siguiente_cursor`. La ETag es un hash del cuerpo (la versión de la
+    colección es propia de cada proceso y se reinicia con él), así las
+    revalidaciones sin cambios responden 304 en cualquier worker.
+    """
+    try:
+        filtros, orden, campos, paginado, limite, cursor = leer_parametros_consulta(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Parámetros inválidos: {e}'}), 400
 
+    claves, registros = consultar_coleccion(archivo, almacen.version(archivo), filtros, orden)
+    descendente = orden.startswith('-')
+    ultima = None  # clave del último registro de la página, si quedan más
+    if not paginado:
+        pagina = registros[::-1] if descendente else registros
+    elif descendente:
+        fin = bisect.bisect_left(claves, cursor) if cursor else len(claves)
+        inicio = max(0, fin - limite)
+        pagina = registros[inicio:fin][::-1]
+        if inicio > 0:
+            ultima = claves[inicio]
+    else:
+        inicio = bisect.bisect_right(claves, cursor) if cursor else 0
+        pagina = registros[inicio:inicio + limite]
+        if inicio + limite < len(claves):
+            ultima = claves[inicio + limite - 1]
 
-# ============================================================================
-# NUEVA CAPA PRINCIPAL: CENTROS DE DISTRIBUCIÓN
-# ============================================================================
+    if campos:
+        pagina = [{campo: registro[campo] for campo in ['id'] + campos if campo in registro} for registro in pagina]
 
-def agregar_capa_centros_distribucion(mapa):
-    """Capa 1: Centros de Distribución (SOLO ACTIVOS)"""
-    centros = cargar_datos_desde_json('centros_distribucion.json')
-    
-    # FILTRAR SOLO CENTROS ACTIVOS
-    centros_activos = [c for c in centros if c.get('estado') == 'activo']
-    
-    feature_group = folium.FeatureGroup(
-        name=f'<img src="/static/images/logo-verde-activo.png" width="16" height="16" style="vertical-align: middle; margin-right: 5px;"> Centros De Distribución ({len(centros_activos)})',
-        show=True
-    )
-    
-    for centro in centros_activos:
-        estado = centro.get('estado', 'activo')
-        icono_personalizado = obtener_icono_personalizado(estado, 'centros_distribucion')
-        
-        emoji_tooltip = "🏭"
-        color_estado = "darkgreen"
-        
-        html_popup = f"""
-        <div style='min-width: 350px;'>
-            <h4>{emoji_tooltip} {centro['nombre']}</h4>
-            <b>Tipo:</b> Centro de Distribución<br>
-            <b>Estado:</b> <span style="color: {color_estado}">{estado.replace('_', ' ').title()}</span><br>
-            <b>ID:</b> {centro['id']}<br>
-            <b>Ciudad:</b> {centro['ciudad']}<br>
-            <b>Dirección:</b> {centro['direccion']}<br>
-            <b>Teléfono:</b> {centro.get('telefono', 'N/A')}<br>
-            <b>Capacidad Almacén:</b> {centro.get('capacidad_almacen', 'N/A')}<br>
-            <b>Tipo Centro:</b> {centro.get('tipo_centro', 'N/A')}<br>
-            <b>Zona Cobertura:</b> {centro.get('zona_cobertura', 'N/A')}<br>
-            <b>Responsable:</b> {centro.get('responsable', 'N/A')}<br>
-            <b>Fecha Apertura:</b> {centro.get('fecha_apertura', 'N/A')}<br>
-            <hr>
-            <small><i>Centro de Distribución - Carnes San Martín</i></small>
-        </div>
-        """
-        
-        folium.Marker(
-            location=[centro['lat'], centro['lon']],
-            popup=folium.Popup(html_popup, max_width=400),
-            tooltip=f"{emoji_tooltip} {centro['nombre']}",
-            icon=icono_personalizado
-        ).add_to(feature_group)
-    
-    feature_group.add_to(mapa)
+    if paginado:
+        siguiente = None
+        if ultima is not None:
+            siguiente = base64.urlsafe_b64encode(json.dumps(list(ultima)).encode('utf-8')).decode('ascii')
+        respuesta = jsonify({'items': pagina, 'total': len(registros), 'limit': limite, 'siguiente_cursor': siguiente})
+    else:
+        respuesta = jsonify(pagina)
+    respuesta.set_etag(hashlib.sha256(respuesta.get_data()).hexdigest()[:32])
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta.make_conditional(request)
 
 
 @app.route('/api/distribuidores', methods=['GET'])
@@ -865,8 +3615,7 @@ def get_distribuidores():
     """Obtener todos los distribuidores"""
     if not session.get('mantenimiento_autorizado'):
         return jsonify({'error': 'No autorizado'}), 401
-    distribuidores = cargar_datos_desde_json('distribuidores_autorizados.json')
-    return jsonify(distribuidores)
+    return listar_coleccion('distribuidores_autorizados.json')
 
 @app.route('/api/distribuidores', methods=['POST'])
 def crear_distribuidor():
@@ -884,19 +3633,16 @@ def crear_distribuidor():
             if campo not in datos or not str(datos[campo]).strip():
                 return jsonify({'success': False, 'error': f'Campo requerido: {campo}'}), 400
         
-        distribuidores = cargar_datos_desde_json('distribuidores_autorizados.json')
-        
         # ✅ CORREGIDO: Generar ID único verificando existencia
-        nuevo_id = generar_id_unico('distribuidores', distribuidores)
+        nuevo_id = generar_id_unico('distribuidores')
         datos['id'] = nuevo_id
         
         # Establecer valores por defecto si no se proporcionan
         datos.setdefault('estado', 'activo')
         datos.setdefault('fecha_apertura', datetime.now().strftime('%Y-%m-%d'))
         
-        distribuidores.append(datos)
-        
-        if guardar_datos_en_json('distribuidores_autorizados.json', distribuidores):
+        if almacen.insertar('distribuidores_autorizados.json', datos):
+            indice_ubicaciones.registrar('distribuidores', datos)
             print(f"✅ Nuevo distribuidor creado: {nuevo_id} - {datos['nombre']}")
             return jsonify({'success': True, 'id': nuevo_id, 'distribuidor': datos})
         else:
@@ -919,26 +3665,25 @@ def actualizar_distribuidor(distribuidor_id):
         datos = request.get_json()
         print(f"📝 Datos recibidos para actualizar {distribuidor_id}: {datos}")  # Debug
         
-        distribuidores = cargar_datos_desde_json('distribuidores_autorizados.json')
+        distribuidor = almacen.obtener('distribuidores_autorizados.json', distribuidor_id)
+        if distribuidor is None:
+            return jsonify({'success': False, 'error': 'Distribuidor no encontrado'}), 404
         
-        for i, distribuidor in enumerate(distribuidores):
-            if distribuidor['id'] == distribuidor_id:
-                # ✅ CORRECTO: Actualizar solo los campos que vienen en la solicitud
-                # Mantener los campos existentes que no se están actualizando
-                for key, value in datos.items():
-                    distribuidor[key] = value
-                
-                # Asegurar que el ID no cambie
-                distribuidor['id'] = distribuidor_id
-                
-                print(f"✅ Distribuidor actualizado: {distribuidor}")  # Debug
-                
-                if guardar_datos_en_json('distribuidores_autorizados.json', distribuidores):
-                    return jsonify({'success': True, 'distribuidor': distribuidor})
-                else:
-                    return jsonify({'success': False, 'error': 'Error al guardar'}), 500
+        # ✅ CORRECTO: Actualizar solo los campos que vienen en la solicitud
+        # Mantener los campos existentes que no se están actualizando
+        for key, value in datos.items():
+            distribuidor[key] = value
         
-        return jsonify({'success': False, 'error': 'Distribuidor no encontrado'}), 404
+        # Asegurar que el ID no cambie
+        distribuidor['id'] = distribuidor_id
+        
+        print(f"✅ Distribuidor actualizado: {distribuidor}")  # Debug
+        
+        if almacen.actualizar('distribuidores_autorizados.json', distribuidor_id, distribuidor):
+            indice_ubicaciones.registrar('distribuidores', distribuidor)
+            return jsonify({'success': True, 'distribuidor': distribuidor})
+        else:
+            return jsonify({'success': False, 'error': 'Error al guardar'}), 500
         
     except Exception as e:
         print(f"❌ Error actualizando distribuidor: {e}")
@@ -949,17 +3694,15 @@ def eliminar_distribuidor(distribuidor_id):
     """Eliminar distribuidor"""
     if not session.get('mantenimiento_autorizado'):
         return jsonify({'error': 'No autorizado'}), 401
-    distribuidores = cargar_datos_desde_json('distribuidores_autorizados.json')
     
-    for i, distribuidor in enumerate(distribuidores):
-        if distribuidor['id'] == distribuidor_id:
-            distribuidores.pop(i)
-            if guardar_datos_en_json('distribuidores_autorizados.json', distribuidores):
-                return jsonify({'success': True})
-            else:
-                return jsonify({'success': False, 'error': 'Error al guardar'}), 500
+    if almacen.obtener('distribuidores_autorizados.json', distribuidor_id) is None:
+        return jsonify({'success': False, 'error': 'Distribuidor no encontrado'}), 404
     
-    return jsonify({'success': False, 'error': 'Distribuidor no encontrado'}), 404  
+    if almacen.eliminar('distribuidores_autorizados.json', distribuidor_id):
+        indice_ubicaciones.quitar('distribuidores', distribuidor_id)
+        return jsonify({'success': True})
+    else:
+        return jsonify({'success': False, 'error': 'Error al guardar'}), 500  
 
 
 
@@ -969,8 +3712,7 @@ def get_tiendas_oro():
     """Obtener todas las tiendas oro"""
     if not session.get('mantenimiento_autorizado'):
         return jsonify({'error': 'No autorizado'}), 401
-    tiendas = cargar_datos_desde_json('tiendas_oro.json')
-    return jsonify(tiendas)
+    return listar_coleccion('tiendas_oro.json')
 
 @app.route('/api/tiendas-oro', methods=['POST'])
 def crear_tienda_oro():
@@ -980,15 +3722,13 @@ def crear_tienda_oro():
     
     try:
         datos = request.get_json()
-        tiendas = cargar_datos_desde_json('tiendas_oro.json')
         
         # ✅ CORREGIDO: Generar ID único verificando existencia
-        nuevo_id = generar_id_unico('tiendas_oro', tiendas)
+        nuevo_id = generar_id_unico('tiendas_oro')
         datos['id'] = nuevo_id
         
-        tiendas.append(datos)
-        
-        if guardar_datos_en_json('tiendas_oro.json', tiendas):
+        if almacen.insertar('tiendas_oro.json', datos):
+            indice_ubicaciones.registrar('tiendas_oro', datos)
             return jsonify({'success': True, 'id': nuevo_id})
         else:
             return jsonify({'success': False, 'error': 'Error al guardar'}), 500
@@ -1007,36 +3747,32 @@ def actualizar_tienda_oro(tienda_id):
     if not session.get('mantenimiento_autorizado'):
         return jsonify({'error': 'No autorizado'}), 401
     datos = request.get_json()
-    tiendas = cargar_datos_desde_json('tiendas_oro.json')
-    
-    for i, tienda in enumerate(tiendas):
-        if tienda['id'] == tienda_id:
-            # Asegurarse de que el ID se mantenga
-            datos['id'] = tienda_id
-            tiendas[i] = datos
-            if guardar_datos_en_json('tiendas_oro.json', tiendas):
-                return jsonify({'success': True})
-            else:
-                return jsonify({'success': False, 'error': 'Error al guardar'}), 500
     
-    return jsonify({'success': False, 'error': 'Tienda no encontrada'}), 404
+    if almacen.obtener('tiendas_oro.json', tienda_id) is None:
+        return jsonify({'success': False, 'error': 'Tienda no encontrada'}), 404
+    
+    # Asegurarse de que el ID se mantenga
+    datos['id'] = tienda_id
+    if almacen.actualizar('tiendas_oro.json', tienda_id, datos):
+        indice_ubicaciones.registrar('tiendas_oro', datos)
+        return jsonify({'success': True})
+    else:
+        return jsonify({'success': False, 'error': 'Error al guardar'}), 500
 
 @app.route('/api/tiendas-oro/<tienda_id>', methods=['DELETE'])
 def eliminar_tienda_oro(tienda_id):
     """Eliminar tienda oro"""
     if not session.get('mantenimiento_autorizado'):
         return jsonify({'error': 'No autorizado'}), 401
-    tiendas = cargar_datos_desde_json('tiendas_oro.json')
     
-    for i, tienda in enumerate(tiendas):
-        if tienda['id'] == tienda_id:
-            tiendas.pop(i)
-            if guardar_datos_en_json('tiendas_oro.json', tiendas):
-                return jsonify({'success': True})
-            else:
-                return jsonify({'success': False, 'error': 'Error al guardar'}), 500
+    if almacen.obtener('tiendas_oro.json', tienda_id) is None:
+        return jsonify({'success': False, 'error': 'Tienda no encontrada'}), 404
     
-    return jsonify({'success': False, 'error': 'Tienda no encontrada'}), 404
+    if almacen.eliminar('tiendas_oro.json', tienda_id):
+        indice_ubicaciones.quitar('tiendas_oro', tienda_id)
+        return jsonify({'success': True})
+    else:
+        return jsonify({'success': False, 'error': 'Error al guardar'}), 500
 
 # RUTAS PARA TIENDAS SATÉLITE
 @app.route('/api/tiendas-satelite', methods=['GET'])
@@ -1044,8 +3780,7 @@ def get_tiendas_satelite():
     """Obtener todas las tiendas satélite"""
     if not session.get('mantenimiento_autorizado'):
         return jsonify({'error': 'No autorizado'}), 401
-    tiendas = cargar_datos_desde_json('tiendas_satelite.json')
-    return jsonify(tiendas)
+    return listar_coleccion('tiendas_satelite.json')
 
 @app.route('/api/tiendas-satelite', methods=['POST'])
 def crear_tienda_satelite():
@@ -1055,15 +3790,13 @@ def crear_tienda_satelite():
     
     try:
         datos = request.get_json()
-        tiendas = cargar_datos_desde_json('tiendas_satelite.json')
         
         # ✅ CORREGIDO: Generar ID único verificando existencia
-        nuevo_id = generar_id_unico('tiendas_satelite', tiendas)
+        nuevo_id = generar_id_unico('tiendas_satelite')
         datos['id'] = nuevo_id
         
-        tiendas.append(datos)
-        
-        if guardar_datos_en_json('tiendas_satelite.json', tiendas):
+        if almacen.insertar('tiendas_satelite.json', datos):
+            indice_ubicaciones.registrar('tiendas_satelite', datos)
             return jsonify({'success': True, 'id': nuevo_id})
         else:
             return jsonify({'success': False, 'error': 'Error al guardar'}), 500
@@ -1081,295 +3814,121 @@ def actualizar_tienda_satelite(tienda_id):
     if not session.get('mantenimiento_autorizado'):
         return jsonify({'error': 'No autorizado'}), 401
     datos = request.get_json()
-    tiendas = cargar_datos_desde_json('tiendas_satelite.json')
-    
-    for i, tienda in enumerate(tiendas):
-        if tienda['id'] == tienda_id:
-            # Asegurarse de que el ID se mantenga
-            datos['id'] = tienda_id
-            tiendas[i] = datos
-            if guardar_datos_en_json('tiendas_satelite.json', tiendas):
-                return jsonify({'success': True})
-            else:
-                return jsonify({'success': False, 'error': 'Error al guardar'}), 500
     
-    return jsonify({'success': False, 'error': 'Tienda no encontrada'}), 404
+    if almacen.obtener('tiendas_satelite.json', tienda_id) is None:
+        return jsonify({'success': False, 'error': 'Tienda no encontrada'}), 404
+    
+    # Asegurarse de que el ID se mantenga
+    datos['id'] = tienda_id
+    if almacen.actualizar('tiendas_satelite.json', tienda_id, datos):
+        indice_ubicaciones.registrar('tiendas_satelite', datos)
+        return jsonify({'success': True})
+    else:
+        return jsonify({'success': False, 'error': 'Error al guardar'}), 500
 
 @app.route('/api/tiendas-satelite/<tienda_id>', methods=['DELETE'])
 def eliminar_tienda_satelite(tienda_id):
     """Eliminar tienda satélite"""
     if not session.get('mantenimiento_autorizado'):
         return jsonify({'error': 'No autorizado'}), 401
-    tiendas = cargar_datos_desde_json('tiendas_satelite.json')
     
-    for i, tienda in enumerate(tiendas):
-        if tienda['id'] == tienda_id:
-            tiendas.pop(i)
-            if guardar_datos_en_json('tiendas_satelite.json', tiendas):
-                return jsonify({'success': True})
-            else:
-                return jsonify({'success': False, 'error': 'Error al guardar'}), 500
+    if almacen.obtener('tiendas_satelite.json', tienda_id) is None:
+        return jsonify({'success': False, 'error': 'Tienda no encontrada'}), 404
     
-    return jsonify({'success': False, 'error': 'Tienda no encontrada'}), 404
+    if almacen.eliminar('tiendas_satelite.json', tienda_id):
+        indice_ubicaciones.quitar('tiendas_satelite', tienda_id)
+        return jsonify({'success': True})
+    else:
+        return jsonify({'success': False, 'error': 'Error al guardar'}), 500
 
 
 # ============================================================================
-# CAPAS PRINCIPALES EXISTENTES (modificadas)
+# CACHÉ DE FRAGMENTOS POR CAPA
 # ============================================================================
 
-def agregar_capa_distribuidores(mapa):
-    """Capa 2: Distribuidores Autorizados (SOLO ACTIVOS)"""
-    distribuidores = cargar_datos_desde_json('distribuidores_autorizados.json')
-    
-    distribuidores_activos = [d for d in distribuidores if d.get('estado') == 'activo']
-    
-    feature_group = folium.FeatureGroup(
-        name=f'<img src="/static/images/logo-rojo-activo.png" width="16" height="16" style="vertical-align: middle; margin-right: 1px;"> Dist. Autorizados Activos ({len(distribuidores_activos)})',
-        show=True
-    )
-    
-    for distribuidor in distribuidores_activos:
-        estado = distribuidor.get('estado', 'activo')
-        icono_personalizado = obtener_icono_personalizado(estado, 'distribuidores')
-        
-        emoji_tooltip = "📦"
-        color_estado = "green"
-        
-        html_popup = f"""
-        <div style='min-width: 320px;'>
-            <h4>{emoji_tooltip} {distribuidor['nombre']}</h4>
-            <b>Tipo:</b> Distribuidor Autorizado<br>
-            <b>Estado:</b> <span style="color: {color_estado}">{estado.replace('_', ' ').title()}</span><br>
-            <b>ID:</b> {distribuidor['id']}<br>
-            <b>Ciudad:</b> {distribuidor['ciudad']}<br>
-            <b>Dirección:</b> {distribuidor['direccion']}<br>
-            <b>Teléfono:</b> {distribuidor.get('telefono', 'N/A')}<br>
-            <b>Fecha Apertura:</b> {distribuidor.get('fecha_apertura', 'N/A')}<br>
-            <hr>
-            <small><i>Carnes San Martín</i></small>
-        </div>
-        """
-        
-        folium.Marker(
-            location=[distribuidor['lat'], distribuidor['lon']],
-            popup=folium.Popup(html_popup, max_width=350),
-            tooltip=f"{emoji_tooltip} {distribuidor['nombre']}",
-            icon=icono_personalizado
-        ).add_to(feature_group)
-    
-    feature_group.add_to(mapa)
+# Nombre fijo del mapa en el JS generado (folium usa map_<id>)
+ID_MAPA = 'principal'
 
-def agregar_capa_tiendas_oro(mapa):
-    """Capa 3: Tiendas de Oro (SOLO ACTIVAS)"""
-    tiendas = cargar_datos_desde_json('tiendas_oro.json')
-    
-    tiendas_activas = [t for t in tiendas if t.get('estado') == 'activo']
-    
-    feature_group = folium.FeatureGroup(
-        name=f'<img src="/static/images/logo-dorado-activo.png" width="16" height="16" style="vertical-align: middle; margin-right: 1px;"> Tiendas Oro Activas ({len(tiendas_activas)})',
-        show=True
-    )
-    
-    for tienda in tiendas_activas:
-        estado = tienda.get('estado', 'activo')
-        icono_personalizado = obtener_icono_personalizado(estado, 'tiendas_oro')
-        
-        emoji_tooltip = "🥇"
-        color_estado = "blue"
-        
-        html_popup = f"""
-        <div style='min-width: 300px;'>
-            <h4>{emoji_tooltip} {tienda['nombre']}</h4>
-            <b>Estado:</b> <span style="color: {color_estado}">{estado.replace('_', ' ').title()}</span><br>
-            <b>ID:</b> {tienda['id']}<br>
-            <b>Ciudad:</b> {tienda['ciudad']}<br>
-            <b>Dirección:</b> {tienda['direccion']}<br>
-            <b>Capacidad Congelador:</b> {tienda.get('capacidad_congelador', 'N/A')}<br>
-            <b>Fecha Apertura:</b> {tienda.get('fecha_apertura', 'N/A')}<br>
-            <hr>
-            <small><i>Tienda Oro - Carnes San Martín</i></small>
-        </div>
-        """
-        
-        folium.Marker(
-            location=[tienda['lat'], tienda['lon']],
-            popup=folium.Popup(html_popup, max_width=350),
-            tooltip=f"{emoji_tooltip} {tienda['nombre']}",
-            icon=icono_personalizado
-        ).add_to(feature_group)
-    
-    feature_group.add_to(mapa)
+# Capa -> colecciones de las que depende, en el orden del control de capas
+CAPAS_MAPA = [('calor', list(PESOS_CALOR))] + [
+    (capa, [spec['archivo']]) for capa, spec in CAPAS_GEOJSON.items()
+]
 
-def agregar_capa_tiendas_satelite(mapa):
-    """Capa 4: Tiendas Satélite (SOLO ACTIVAS)"""
-    tiendas = cargar_datos_desde_json('tiendas_satelite.json')
-    
-    tiendas_activas = [t for t in tiendas if t.get('estado') == 'activo']
-    
-    feature_group = folium.FeatureGroup(
-        name=f'<img src="/static/images/logo-azul-activo.png" width="16" height="16" style="vertical-align: middle; margin-right: 1px;"> Tiendas Satélite Activas ({len(tiendas_activas)})',
-        show=True
-    )
-    
-    for tienda in tiendas_activas:
-        estado = tienda.get('estado', 'activo')
-        icono_personalizado = obtener_icono_personalizado(estado, 'tiendas_satelite')
-        
-        emoji_tooltip = "🛒"
-        color_estado = "green"
-        
-        html_popup = f"""
-        <div style='min-width: 300px;'>
-            <h4>{emoji_tooltip} {tienda['nombre']}</h4>
-            <b>Estado:</b> <span style="color: {color_estado}">{estado.replace('_', ' ').title()}</span><br>
-            <b>ID:</b> {tienda['id']}<br>
-            <b>Ciudad:</b> {tienda['ciudad']}<br>
-            <b>Dirección:</b> {tienda['direccion']}<br>
-            <b>Tipo:</b> {tienda.get('tipo_satelite', 'N/A')}<br>
-            <b>Fecha Apertura:</b> {tienda.get('fecha_apertura', 'N/A')}<br>
-            <hr>
-            <small><i>Tienda Satélite - Carnes San Martín</i></small>
-        </div>
-        """
-        
-        folium.Marker(
-            location=[tienda['lat'], tienda['lon']],
-            popup=folium.Popup(html_popup, max_width=350),
-            tooltip=f"{emoji_tooltip} {tienda['nombre']}",
-            icon=icono_personalizado
-        ).add_to(feature_group)
-    
-    feature_group.add_to(mapa)
+# capa -> {'version': versiones de sus colecciones, 'capas': [fragmentos]}
+_cache_fragmentos = {}
 
-# ============================================================================
-# CAPAS FILTRADAS 2026 (incluyendo nueva para Centros)
-# ============================================================================
 
+class CapaCacheada(folium.map.Layer):
+    """Capa cuyo HTML/JS ya fue renderizado y se reutiliza tal cual
 
+    Aparece en el control de capas con el mismo nombre JS que la capa
+    original, pero al renderizar solo inserta las piezas guardadas.
+    """
 
-def agregar_capa_distribuidores_2026(mapa):
-    """Capa 6: Distribuidores con Próxima Apertura en 2026"""
-    distribuidores = cargar_datos_desde_json('distribuidores_autorizados.json')
-    
-    distribuidores_filtrados = [
-        d for d in distribuidores 
-        if d.get('estado') == 'proxima_apertura' 
-        and d.get('fecha_apertura', '').startswith('2026')
-    ]
-    
-    feature_group = folium.FeatureGroup(
-        name=f'<img src="/static/images/logo-rojo-activo-next.png" width="16" height="16" style="vertical-align: middle; margin-right: 1px;"> 2026 Dist. Autorizados ({len(distribuidores_filtrados)})',
-        show=False
-    )
-    
-    for distribuidor in distribuidores_filtrados:
-        icono_personalizado = obtener_icono_personalizado('proxima_apertura', 'distribuidores')
-        
-        html_popup = f"""
-        <div style='min-width: 320px;'>
-            <h4>🎯 {distribuidor['nombre']}</h4>
-            <b>Tipo:</b> Distribuidor Autorizado<br>
-            <b>Estado:</b> <span style="color: purple">Próxima Apertura 2026</span><br>
-            <b>ID:</b> {distribuidor['id']}<br>
-            <b>Ciudad:</b> {distribuidor['ciudad']}<br>
-            <b>Dirección:</b> {distribuidor['direccion']}<br>
-            <b>Teléfono:</b> {distribuidor.get('telefono', 'N/A')}<br>
-            <b>Fecha Apertura:</b> {distribuidor.get('fecha_apertura', 'N/A')}<br>
-            <hr>
-            <small><i>📍 Apertura Programada 2026 - Carnes San Martín</i></small>
-        </div>
-        """
-        
-        folium.Marker(
-            location=[distribuidor['lat'], distribuidor['lon']],
-            popup=folium.Popup(html_popup, max_width=350),
-            tooltip=f"🎯 2026 - {distribuidor['nombre']}",
-            icon=icono_personalizado
-        ).add_to(feature_group)
-    
-    feature_group.add_to(mapa)
+    def __init__(self, fragmento):
+        super().__init__(name=fragmento['nombre'], overlay=True, control=fragmento['control'], show=fragmento['show'])
+        self.fragmento = fragmento
 
-def agregar_capa_tiendas_oro_2026(mapa):
-    """Capa 7: Tiendas Oro con Próxima Apertura en 2026"""
-    tiendas = cargar_datos_desde_json('tiendas_oro.json')
-    
-    tiendas_filtradas = [
-        t for t in tiendas 
-        if t.get('estado') == 'proxima_apertura' 
-        and t.get('fecha_apertura', '').startswith('2026')
-    ]
-    
-    feature_group = folium.FeatureGroup(
-        name=f'<img src="/static/images/logo-dorado-activo-next.png" width="16" height="16" style="vertical-align: middle; margin-right: 1px;"> 2026 Tiendas Oro ({len(tiendas_filtradas)})',
-        show=False
-    )
-    
-    for tienda in tiendas_filtradas:
-        icono_personalizado = obtener_icono_personalizado('proxima_apertura', 'tiendas_oro')
-        
-        html_popup = f"""
-        <div style='min-width: 300px;'>
-            <h4>🎯 {tienda['nombre']}</h4>
-            <b>Estado:</b> <span style="color: purple">Próxima Apertura 2026</span><br>
-            <b>ID:</b> {tienda['id']}<br>
-            <b>Ciudad:</b> {tienda['ciudad']}<br>
-            <b>Dirección:</b> {tienda['direccion']}<br>
-            <b>Capacidad Congelador:</b> {tienda.get('capacidad_congelador', 'N/A')}<br>
-            <b>Fecha Apertura:</b> {tienda.get('fecha_apertura', 'N/A')}<br>
-            <hr>
-            <small><i>📍 Apertura Programada 2026 - Tienda Oro</i></small>
-        </div>
-        """
-        
-        folium.Marker(
-            location=[tienda['lat'], tienda['lon']],
-            popup=folium.Popup(html_popup, max_width=350),
-            tooltip=f"🎯 2026 - {tienda['nombre']}",
-            icon=icono_personalizado
-        ).add_to(feature_group)
-    
-    feature_group.add_to(mapa)
+    def get_name(self):
+        return self.fragmento['nombre_js']
+
+    def render(self, **kwargs):
+        figura = self.get_root()
+        for nombre, html in self.fragmento['header']:
+            figura.header.add_child(folium.Element(html), name=nombre)
+        figura.script.add_child(folium.Element(self.fragmento['script']), name=self.get_name())
+
+
+def renderizar_fragmentos_capa(capa, particiones):
+    """Construye una capa aislada y devuelve el HTML/JS de cada elemento creado"""
+    figura = folium.Figure()
+    # Contenedor con el mismo nombre JS que el mapa real (map_principal)
+    contenedor = folium.MacroElement()
+    contenedor._name = 'Map'
+    contenedor._id = ID_MAPA
+    figura.add_child(contenedor)
+    agregar_capa(contenedor, capa, particiones)
+
+    fragmentos = []
+    for capa in list(contenedor._children.values()):
+        header_previo = set(figura.header._children)
+        script_previo = set(figura.script._children)
+        capa.render()
+        fragmentos.append({
+            'nombre_js': capa.get_name(),
+            'nombre': getattr(capa, 'layer_name', capa.get_name()),
+            'control': getattr(capa, 'control', True),
+            'show': getattr(capa, 'show', True),
+            'header': [
+                (nombre, elemento.render())
+                for nombre, elemento in figura.header._children.items()
+                if nombre not in header_previo
+            ],
+            'script': '\n'.join(
+                elemento.render()
+                for nombre, elemento in figura.script._children.items()
+                if nombre not in script_previo
+            )
+        })
+    return fragmentos
+
+
+def agregar_capas_cacheadas(mapa):
+    """Agrega todas las capas al mapa reutilizando los fragmentos cuyos datos no cambiaron"""
+    regeneradas = []
+    particiones = {}  # cada colección se carga y reparte una sola vez
+    for clave, archivos in CAPAS_MAPA:
+        version = tuple(almacen.version(archivo) for archivo in archivos)
+        entrada = _cache_fragmentos.get(clave)
+        if entrada is None or entrada['version'] != version:
+            entrada = {'version': version, 'capas': renderizar_fragmentos_capa(clave, particiones)}
+            _cache_fragmentos[clave] = entrada
+            regeneradas.append(clave)
+        for fragmento in entrada['capas']:
+            CapaCacheada(fragmento).add_to(mapa)
+    if regeneradas:
+        print(f"🧩 Capas regeneradas: {', '.join(regeneradas)}")
 
-def agregar_capa_tiendas_satelite_2026(mapa):
-    """Capa 8: Tiendas Satélite con Próxima Apertura en 2026"""
-    tiendas = cargar_datos_desde_json('tiendas_satelite.json')
-    
-    tiendas_filtradas = [
-        t for t in tiendas 
-        if t.get('estado') == 'proxima_apertura' 
-        and t.get('fecha_apertura', '').startswith('2026')
-    ]
-    
-    feature_group = folium.FeatureGroup(
-        name=f'<img src="/static/images/logo-azul-activo-next.png" width="16" height="16" style="vertical-align: middle; margin-left: 1px;"> 2026 Tiendas Satélite ({len(tiendas_filtradas)})',
-        show=False
-    )
-    
-    for tienda in tiendas_filtradas:
-        icono_personalizado = obtener_icono_personalizado('proxima_apertura', 'tiendas_satelite')
-        
-        html_popup = f"""
-        <div style='min-width: 300px;'>
-            <h4>🎯 {tienda['nombre']}</h4>
-            <b>Estado:</b> <span style="color: purple">Próxima Apertura 2026</span><br>
-            <b>ID:</b> {tienda['id']}<br>
-            <b>Ciudad:</b> {tienda['ciudad']}<br>
-            <b>Dirección:</b> {tienda['direccion']}<br>
-            <b>Tipo:</b> {tienda.get('tipo_satelite', 'N/A')}<br>
-            <b>Fecha Apertura:</b> {tienda.get('fecha_apertura', 'N/A')}<br>
-            <hr>
-            <small><i>📍 Apertura Programada 2026 - Tienda Satélite</i></small>
-        </div>
-        """
-        
-        folium.Marker(
-            location=[tienda['lat'], tienda['lon']],
-            popup=folium.Popup(html_popup, max_width=350),
-            tooltip=f"🎯 2026 - {tienda['nombre']}",
-            icon=icono_personalizado
-        ).add_to(feature_group)
-    
-    feature_group.add_to(mapa)
 
 # ============================================================================
 # NUEVAS RUTAS API PARA CENTROS DE DISTRIBUCIÓN
@@ -1380,8 +3939,7 @@ def get_centros_distribucion():
     """Obtener todos los centros de distribución"""
     if not session.get('mantenimiento_autorizado'):
         return jsonify({'error': 'No autorizado'}), 401
-    centros = cargar_datos_desde_json('centros_distribucion.json')
-    return jsonify(centros)
+    return listar_coleccion('centros_distribucion.json')
 
 @app.route('/api/centros-distribucion', methods=['POST'])
 def crear_centro_distribucion():
@@ -1391,15 +3949,13 @@ def crear_centro_distribucion():
     
     try:
         datos = request.get_json()
-        centros = cargar_datos_desde_json('centros_distribucion.json')
         
         # ✅ CORREGIDO: Generar ID único verificando existencia
-        nuevo_id = generar_id_unico('centros_distribucion', centros)
+        nuevo_id = generar_id_unico('centros_distribucion')
         datos['id'] = nuevo_id
         
-        centros.append(datos)
-        
-        if guardar_datos_en_json('centros_distribucion.json', centros):
+        if almacen.insertar('centros_distribucion.json', datos):
+            indice_ubicaciones.registrar('centros_distribucion', datos)
             return jsonify({'success': True, 'id': nuevo_id})
         else:
             return jsonify({'success': False, 'error': 'Error al guardar'}), 500
@@ -1416,65 +3972,256 @@ def actualizar_centro_distribucion(centro_id):
     if not session.get('mantenimiento_autorizado'):
         return jsonify({'error': 'No autorizado'}), 401
     datos = request.get_json()
-    centros = cargar_datos_desde_json('centros_distribucion.json')
-    
-    for i, centro in enumerate(centros):
-        if centro['id'] == centro_id:
-            datos['id'] = centro_id
-            centros[i] = datos
-            if guardar_datos_en_json('centros_distribucion.json', centros):
-                return jsonify({'success': True})
-            else:
-                return jsonify({'success': False, 'error': 'Error al guardar'}), 500
     
-    return jsonify({'success': False, 'error': 'Centro no encontrado'}), 404
+    if almacen.obtener('centros_distribucion.json', centro_id) is None:
+        return jsonify({'success': False, 'error': 'Centro no encontrado'}), 404
+    
+    datos['id'] = centro_id
+    if almacen.actualizar('centros_distribucion.json', centro_id, datos):
+        indice_ubicaciones.registrar('centros_distribucion', datos)
+        return jsonify({'success': True})
+    else:
+        return jsonify({'success': False, 'error': 'Error al guardar'}), 500
 
 @app.route('/api/centros-distribucion/<centro_id>', methods=['DELETE'])
 def eliminar_centro_distribucion(centro_id):
     """Eliminar centro de distribución"""
     if not session.get('mantenimiento_autorizado'):
         return jsonify({'error': 'No autorizado'}), 401
-    centros = cargar_datos_desde_json('centros_distribucion.json')
     
-    for i, centro in enumerate(centros):
-        if centro['id'] == centro_id:
-            centros.pop(i)
-            if guardar_datos_en_json('centros_distribucion.json', centros):
-                return jsonify({'success': True})
-            else:
-                return jsonify({'success': False, 'error': 'Error al guardar'}), 500
+    if almacen.obtener('centros_distribucion.json', centro_id) is None:
+        return jsonify({'success': False, 'error': 'Centro no encontrado'}), 404
     
-    return jsonify({'success': False, 'error': 'Centro no encontrado'}), 404
+    if almacen.eliminar('centros_distribucion.json', centro_id):
+        indice_ubicaciones.quitar('centros_distribucion', centro_id)
+        return jsonify({'success': True})
+    else:
+        return jsonify({'success': False, 'error': 'Error al guardar'}), 500
 
 # [Mantener todas las otras rutas API existentes...]
 
 
 
 
-def generar_id_unico(tipo, datos_existentes):
-    """Genera un ID único verificando que no exista"""
-    prefix = {
-        'distribuidores': 'D',
-        'tiendas_oro': 'TO', 
-        'tiendas_satelite': 'TS',
-        'centros_distribucion': 'CD'
-    }.get(tipo, 'ID')
-    
-    # Obtener todos los IDs existentes
-    ids_existentes = {item['id'] for item in datos_existentes}
+def generar_id_unico(tipo):
+    """Genera un ID único con la secuencia persistente del prefijo (D001, D002, ... D1000)"""
+    prefix = PREFIJOS_ID.get(tipo, 'ID')
+    return almacen.siguiente_id(ARCHIVOS_POR_TIPO[tipo], prefix)
+
+
+
+# ============================================================================
+# OPERACIONES POR LOTES
+# ============================================================================
+
+MAX_OPERACIONES_LOTE = 1000
+INTENTOS_LOTE = 3
+
+def preparar_lote(operaciones):
+    """Valida las operaciones en memoria, en orden, sobre el estado actual
+
+    Devuelve (resultados, cambios, versiones, nuevos): un resultado por
+    operación, las operaciones de diario por archivo, la versión de cada
+    colección leída antes de validarla y los registros creados (sin id aún).
+    Las actualizaciones combinan los campos recibidos con el registro actual.
+    """
+    vista = {}  # (archivo, id) -> registro tras las operaciones anteriores (None = eliminado)
+    versiones = {}
+    cambios = {}
+    nuevos = []
+    resultados = []
+
+    def actual(archivo, registro_id):
+        if (archivo, registro_id) not in vista:
+            vista[(archivo, registro_id)] = almacen.obtener(archivo, registro_id)
+        return vista[(archivo, registro_id)]
+
+    for indice, operacion in enumerate(operaciones):
+        resultado = {'indice': indice, 'success': False}
+        resultados.append(resultado)
+        if not isinstance(operacion, dict):
+            resultado['error'] = 'La operación no es un objeto JSON'
+            continue
+        op, tipo, registro_id = operacion.get('op'), operacion.get('tipo'), operacion.get('id')
+        resultado.update({'op': op, 'tipo': tipo, 'id': registro_id})
+        if not isinstance(tipo, str) or tipo not in ARCHIVOS_POR_TIPO:
+            resultado['error'] = f'Tipo desconocido: {tipo}'
+            continue
+        # Los ids se usan como claves: solo texto o enteros (los IDs se guardan como texto)
+        if registro_id is not None:
+            if isinstance(registro_id, bool) or not isinstance(registro_id, (str, int)):
+                resultado['error'] = 'El id debe ser texto o un número entero'
+                continue
+            registro_id = str(registro_id)
+        archivo = ARCHIVOS_POR_TIPO[tipo]
+        if archivo not in versiones:
+            versiones[archivo] = almacen.version(archivo)
+        datos = operacion.get('datos') or {}
+
+        if op == 'crear':
+            error = validar_ubicacion(datos)
+            if error is None and 'id' in datos:
+                error = 'El id de un registro nuevo lo asigna el servidor'
+            if error:
+                resultado['error'] = error
+                continue
+            registro = dict(datos)
+            registro.setdefault('estado', 'activo')
+            registro.setdefault('fecha_apertura', datetime.now().strftime('%Y-%m-%d'))
+            cambio = {'op': 'insertar', 'id': None, 'registro': registro}
+            nuevos.append((tipo, cambio, resultado))
+        elif op in ('actualizar', 'eliminar'):
+            if registro_id is None or actual(archivo, registro_id) is None:
+                resultado['error'] = 'Registro no encontrado'
+                continue
+            if op == 'eliminar':
+                vista[(archivo, registro_id)] = None
+                cambio = {'op': 'eliminar', 'id': registro_id}
+            else:
+                error = validar_ubicacion(datos, parcial=True)
+                if error:
+                    resultado['error'] = error
+                    continue
+                registro = dict(actual(archivo, registro_id), **datos)
+                registro['id'] = registro_id
+                vista[(archivo, registro_id)] = registro
+                cambio = {'op': 'actualizar', 'id': registro_id, 'registro': registro}
+        else:
+            resultado['error'] = f'Operación desconocida: {op}'
+            continue
+
+        resultado['success'] = True
+        cambios.setdefault(archivo, []).append(cambio)
+
+    return resultados, cambios, versiones, nuevos
+
+@app.route('/api/batch', methods=['POST'])
+def aplicar_lote():
+    """Aplica una lista ordenada de operaciones crear/actualizar/eliminar en las cuatro colecciones
+
+    Todo o nada: si alguna operación no es válida no se guarda ninguna; si
+    todas lo son, cada colección tocada se escribe una sola vez.
+    """
+    if not session.get('mantenimiento_autorizado'):
+        return jsonify({'error': 'No autorizado'}), 401
     
-    # Buscar el próximo ID disponible
-    contador = 1
-    while True:
-        nuevo_id = f"{prefix}{contador:03d}"
-        if nuevo_id not in ids_existentes:
-            return nuevo_id
-        contador += 1
+    try:
+        operaciones = (request.get_json(silent=True) or {}).get('operaciones')
+        if not isinstance(operaciones, list) or not operaciones:
+            return jsonify({'success': False, 'error': 'Se esperaba una lista "operaciones"'}), 400
+        if len(operaciones) > MAX_OPERACIONES_LOTE:
+            return jsonify({'success': False, 'error': f'Máximo {MAX_OPERACIONES_LOTE} operaciones por lote'}), 400
+        
+        ids_reservados = []
+        for _ in range(INTENTOS_LOTE):
+            resultados, cambios, versiones, nuevos = preparar_lote(operaciones)
+            if not all(resultado['success'] for resultado in resultados):
+                fallidas = sum(1 for resultado in resultados if not resultado['success'])
+                for resultado in resultados:
+                    resultado['success'] = False
+                return jsonify({
+                    'success': False,
+                    'error': f'{fallidas} operaciones no válidas; no se aplicó ningún cambio',
+                    'resultados': resultados
+                }), 400
+            
+            # Los IDs se reservan solo una vez, y solo si el lote es válido
+            for posicion, (tipo, cambio, resultado) in enumerate(nuevos):
+                if posicion == len(ids_reservados):
+                    ids_reservados.append(generar_id_unico(tipo))
+                cambio['id'] = cambio['registro']['id'] = resultado['id'] = ids_reservados[posicion]
+            
+            try:
+                almacen.aplicar_cambios(cambios, versiones)
+                break
+            except ConflictoLote as e:
+                print(f"⚠️  Conflicto en lote ({e}); se vuelve a validar")
+        else:
+            return jsonify({'success': False, 'error': 'Los datos cambiaron durante el lote; inténtalo de nuevo'}), 409
+        
+        tipos = {archivo: tipo for tipo, archivo in ARCHIVOS_POR_TIPO.items()}
+        for archivo, cambios_archivo in cambios.items():
+            for cambio in cambios_archivo:
+                if cambio['op'] == 'eliminar':
+                    indice_ubicaciones.quitar(tipos[archivo], cambio['id'])
+                else:
+                    indice_ubicaciones.registrar(tipos[archivo], cambio['registro'])
         
-        # Prevención de bucle infinito
-        if contador > 1000:
-            raise ValueError("No se pudo generar un ID único después de 1000 intentos")
+        resumen = {tipos[archivo]: len(cambios_archivo) for archivo, cambios_archivo in cambios.items()}
+        print(f"📦 Lote aplicado: {len(operaciones)} operaciones en {len(cambios)} colecciones")
+        return jsonify({'success': True, 'resultados': resultados, 'resumen': resumen})
+    
+    except Exception as e:
+        print(f"❌ Error aplicando lote: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+# ============================================================================
+# SINCRONIZACIÓN INCREMENTAL
+# ============================================================================
+
+# Con más registros cambiados en una colección, mejor recargarla entera
+MAX_CAMBIOS_RESPUESTA = 1000
+
+@app.route('/api/cambios', methods=['GET'])
+def obtener_cambios():
+    """Registros creados, actualizados o eliminados desde la secuencia `desde`
+
+    Devuelve la secuencia actual (`seq`, para la próxima consulta), el estado
+    actual de cada registro cambiado por tipo (`actualizados`, `eliminados`)
+    y los tipos que hay que recargar completos (`reiniciar`): sin `desde`,
+    tras una importación o restauración, o con demasiados cambios.
+    """
+    if not session.get('mantenimiento_autorizado'):
+        return jsonify({'error': 'No autorizado'}), 401
+
+    try:
+        desde = int(request.args.get('desde', 0))
+        if desde < 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({'success': False, 'error': 'desde debe ser un número de secuencia'}), 400
+
+    tipos = {archivo: tipo for tipo, archivo in ARCHIVOS_POR_TIPO.items()}
+    seq, entradas = almacen.cambios_desde(desde)
+    # Sin secuencia previa, o una posterior a la actual (registro borrado): todo de nuevo
+    if 'desde' not in request.args or desde > seq:
+        return jsonify({'success': True, 'seq': seq, 'cambios': {}, 'reiniciar': sorted(tipos.values())})
 
+    reiniciar = set()
+    cambiados = {}  # archivo -> ids en orden de su último cambio
+    for entrada in entradas:
+        archivo = entrada['archivo']
+        if archivo not in tipos or archivo in reiniciar:
+            continue
+        if entrada['op'] == 'reiniciar':
+            reiniciar.add(archivo)
+            cambiados.pop(archivo, None)
+            continue
+        ids = cambiados.setdefault(archivo, {})
+        ids.pop(entrada['id'], None)
+        ids[entrada['id']] = True
+        if len(ids) > MAX_CAMBIOS_RESPUESTA:
+            reiniciar.add(archivo)
+            del cambiados[archivo]
+
+    cambios = {}
+    for archivo, ids in cambiados.items():
+        actualizados, eliminados = [], []
+        for registro_id in ids:
+            registro = almacen.obtener(archivo, registro_id)
+            if registro is None:
+                eliminados.append(registro_id)
+            else:
+                actualizados.append(registro)
+        cambios[tipos[archivo]] = {'actualizados': actualizados, 'eliminados': eliminados}
+
+    return jsonify({
+        'success': True,
+        'seq': seq,
+        'cambios': cambios,
+        'reiniciar': sorted(tipos[archivo] for archivo in reiniciar)
+    })
 
 
 # ============================================================================
@@ -1497,11 +4244,166 @@ def index():
 
 
 
+# ============================================================================
+# CACHÉ DE LA PÁGINA DEL MAPA
+# ============================================================================
+
+# HTML final de /mapa para la versión de datos con la que se generó
+_cache_mapa = {'version': None, 'html': None, 'etag': None}
+_cache_mapa_lock = threading.Lock()
+
+def obtener_version_datos():
+    """Versión del conjunto de datos: cambia con cualquier escritura en una colección"""
+    return tuple(almacen.version(archivo) for archivo in ARCHIVOS_COLECCIONES)
+
+def obtener_pagina_mapa():
+    """Devuelve (html, etag) de /mapa, regenerándolo solo si cambiaron los datos"""
+    version = obtener_version_datos()
+    if _cache_mapa['version'] == version:
+        return _cache_mapa['html'], _cache_mapa['etag']
+
+    # Un solo hilo reconstruye; los demás esperan y reutilizan el resultado
+    with _cache_mapa_lock:
+        if _cache_mapa['version'] != version:
+            html = render_template('mapa.html', mapa=crear_mapa_completo())
+            _cache_mapa.update({
+                'version': version,
+                'html': html,
+                'etag': hashlib.sha256(html.encode('utf-8')).hexdigest()[:32]
+            })
+            print(f"🗺️  Mapa regenerado para la versión de datos {version}")
+        return _cache_mapa['html'], _cache_mapa['etag']
+
+@app.route('/api/mapa/clusters/<capa>')
+def clusters_capa(capa):
+    """Clusters de una capa para un zoom (?z=), opcionalmente limitados a ?bbox="""
+    if capa not in CAPAS_GEOJSON:
+        return jsonify({'error': 'Capa no encontrada'}), 404
+    try:
+        zoom = min(max(int(request.args.get('z', 0)), 0), ZOOM_MAXIMO)
+        bbox = parsear_bbox(request.args['bbox']) if request.args.get('bbox') else None
+    except ValueError as e:
+        return jsonify({'error': f'Parámetros inválidos: {e}'}), 400
+
+    niveles = obtener_clusters_capa(capa)
+    respuesta = jsonify(geojson_clusters(niveles[zoom], bbox))
+    respuesta.mimetype = 'application/geo+json'
+    # ETag del contenido, como /mapa y las capas GeoJSON (la versión es propia de cada proceso)
+    respuesta.set_etag(hashlib.sha256(respuesta.get_data()).hexdigest()[:32])
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta.make_conditional(request)
+
+@app.route('/api/ubicaciones')
+def buscar_ubicaciones():
+    """Ubicaciones dentro del viewport: ?bbox=minLon,minLat,maxLon,maxLat&tipos=...&estado=...
+
+    Devuelve los registros completos (todos los estados), igual que los GET
+    de colecciones: solo con la sesión de mantenimiento.
+    """
+    if not session.get('mantenimiento_autorizado'):
+        return jsonify({'error': 'No autorizado'}), 401
+    if not request.args.get('bbox'):
+        return jsonify({'success': False, 'error': 'Parámetro requerido: bbox'}), 400
+    try:
+        bbox = parsear_bbox(request.args['bbox'])
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'bbox inválido: {e}'}), 400
+
+    tipos = [tipo for tipo in request.args.get('tipos', '').split(',') if tipo]
+    desconocidos = [tipo for tipo in tipos if tipo not in ARCHIVOS_POR_TIPO]
+    if desconocidos:
+        return jsonify({'success': False, 'error': f"Tipos no válidos: {', '.join(desconocidos)}"}), 400
+    estados = [estado for estado in request.args.get('estado', '').split(',') if estado]
+
+    ubicaciones = indice_ubicaciones.buscar(bbox, tipos, estados)
+    return jsonify({'success': True, 'total': len(ubicaciones), 'ubicaciones': ubicaciones})
+
+@app.route('/tiles/<capa>/<int:z>/<int:x>/<int:y>')
+def tesela_capa(capa, z, x, y):
+    """Tesela GeoJSON con los marcadores de una capa"""
+    if capa not in CAPAS_GEOJSON:
+        return jsonify({'error': 'Capa no encontrada'}), 404
+    if not (0 <= z <= ZOOM_MAXIMO and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({'error': 'Tesela fuera de rango'}), 404
+
+    # Antes de leer del disco: descarta teselas de colecciones que cambiaron por otra vía
+    indice_ubicaciones.sincronizar([CAPAS_GEOJSON[capa]['tipo']])
+    cuerpo = cache_teselas.obtener(capa, z, x, y)
+    respuesta = make_response(cuerpo)
+    respuesta.mimetype = 'application/geo+json'
+    respuesta.set_etag(hashlib.sha256(cuerpo).hexdigest()[:32])
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta.make_conditional(request)
+
+@app.route('/tiles/calor/<int:z>/<int:x>/<int:y>.png')
+def tesela_calor(z, x, y):
+    """Tesela PNG del mapa de calor"""
+    if not (0 <= z <= ZOOM_MAXIMO and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({'error': 'Tesela fuera de rango'}), 404
+
+    png = obtener_tesela_calor(z, x, y)
+    respuesta = make_response(png)
+    respuesta.mimetype = 'image/png'
+    respuesta.set_etag(hashlib.sha256(png).hexdigest()[:32])
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta.make_conditional(request)
+
+@app.route('/api/ubicacion/<tipo>/<item_id>/popup')
+def popup_ubicacion(tipo, item_id):
+    """HTML del popup de una ubicación, pedido por el mapa al hacer clic en el marcador"""
+    if tipo not in ARCHIVOS_POR_TIPO:
+        return jsonify({'error': 'Tipo no válido'}), 404
+    archivo = ARCHIVOS_POR_TIPO[tipo]
+    item = almacen.obtener(archivo, item_id)
+    # Mismo popup que la capa en la que aparece el marcador; los registros que
+    # el mapa no muestra (por ejemplo 'planeado') no se exponen
+    spec = item and next(
+        (spec for spec in CAPAS_GEOJSON.values() if spec['tipo'] == tipo and en_capa(spec, item)),
+        None
+    )
+    if not spec:
+        return jsonify({'error': 'Ubicación no encontrada'}), 404
+    popup, estado = spec['popup'], spec['popup']['estado']
+
+    # Jinja compila la plantilla una vez y la reutiliza en cada petición
+    respuesta = make_response(render_template('popup_ubicacion.html', popup=popup, estado=estado, item=item))
+    # ETag del HTML generado: cambia con el registro en cualquier worker
+    respuesta.set_etag(hashlib.sha256(respuesta.get_data()).hexdigest()[:32])
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta.make_conditional(request)
+
+@app.route('/api/estadisticas')
+def estadisticas_agrupadas():
+    """Conteos agrupados: ?agrupar=tipo,ciudad,estado,zona_cobertura,anio,mes&desde=AAAA-MM-DD&hasta=AAAA-MM-DD"""
+    agrupar = [columna for columna in request.args.get('agrupar', '').split(',') if columna]
+    no_validas = [columna for columna in agrupar if columna not in COLUMNAS_AGRUPABLES]
+    if no_validas:
+        return jsonify({'success': False, 'error': f"No se puede agrupar por: {', '.join(no_validas)}"}), 400
+    try:
+        desde = leer_fecha_estadisticas(request.args['desde']) if request.args.get('desde') else None
+        hasta = leer_fecha_estadisticas(request.args['hasta']) if request.args.get('hasta') else None
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Fecha inválida: {e}'}), 400
+
+    grupos = obtener_estadisticas_agrupadas(agrupar, desde, hasta)
+    return jsonify({
+        'success': True,
+        'agrupar': agrupar,
+        'desde': request.args.get('desde'),
+        'hasta': request.args.get('hasta'),
+        'total': sum(grupo['cantidad'] for grupo in grupos),
+        'grupos': grupos
+    })
+
 @app.route('/mapa')
 def mostrar_mapa():
-    """Renderiza el mapa directamente sin guardar archivos"""
-    mapa_html = crear_mapa_completo()
-    return render_template('mapa.html', mapa_html=mapa_html)
+    """Renderiza el mapa (desde la caché si los datos no cambiaron)"""
+    html, etag = obtener_pagina_mapa()
+    respuesta = make_response(html)
+    # ETag fuerte derivado del contenido; el navegador revalida en cada visita
+    respuesta.set_etag(etag)
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta.make_conditional(request)
 
 # Ruta para verificar archivos de iconos
 @app.route('/verificar-iconos')
@@ -1536,6 +4438,12 @@ def verificar_iconos():
 if __name__ == '__main__':
     # Crear directorios si no existen
     os.makedirs(DATABASE_PATH, exist_ok=True)
+    
+    # Migración única: python app.py migrar-sqlite
+    if len(sys.argv) > 1 and sys.argv[1] == 'migrar-sqlite':
+        migrar_json_a_sqlite()
+        sys.exit(0)
+    
     os.makedirs('static/images', exist_ok=True)
     inicializar_datos_si_no_existen()
     
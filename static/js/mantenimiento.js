@@ -1,8 +1,5 @@
 // Navegación entre secciones
 document.addEventListener('DOMContentLoaded', function() {
-    // Cargar solo los datos de la sección activa inicial (Centros de Distribución)
-    cargarCentrosDistribucion();
-
     // Configurar navegación
     const navLinks = document.querySelectorAll('.nav-link[data-target]');
     navLinks.forEach(link => {
@@ -20,34 +17,283 @@ document.addEventListener('DOMContentLoaded', function() {
             const target = this.getAttribute('data-target');
             document.getElementById(target).classList.add('active');
             
-            // Cargar datos de la sección activa
-            cargarSeccionActiva();
+            // Las tablas ya están cargadas: solo traer lo que cambió
+            sincronizarCambios();
         });
     });
 });
 
-function cargarSeccionActiva() {
-    const seccionActiva = document.querySelector('.content-section.active');
-    if (!seccionActiva) return;
-    
-    const seccionId = seccionActiva.id;
-    console.log('Cargando sección:', seccionId);
-    
-    switch(seccionId) {
-        case 'centros-distribucion':
-            cargarCentrosDistribucion();
-            break;
-        case 'distribuidores':
-            cargarDistribuidores();
-            break;
-        case 'tiendas-oro':
-            cargarTiendasOro();
-            break;
-        case 'tiendas-satelite':
-            cargarTiendasSatelite();
-            break;
+// ============================================================================
+// SINCRONIZACIÓN INCREMENTAL
+// ============================================================================
+// Tras cada guardado (y cada INTERVALO_SINCRONIZACION) se piden a /api/cambios
+// solo los registros que cambiaron desde la última secuencia vista y se
+// aplican sobre las filas ya descargadas de cada tabla.
+
+const INTERVALO_SINCRONIZACION = 30000;
+let secuenciaCambios = null;
+let sincronizando = null;
+let sincronizarDeNuevo = false;
+
+function sincronizarCambios() {
+    // Una consulta a la vez; las que lleguen mientras tanto se agrupan en una
+    if (sincronizando) {
+        sincronizarDeNuevo = true;
+        return sincronizando;
+    }
+    // Sin secuencia (al arrancar) el servidor solo devuelve la actual
+    const url = secuenciaCambios === null ? '/api/cambios' : `/api/cambios?desde=${secuenciaCambios}`;
+    sincronizando = fetch(url)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(response.status === 401 ? 'No autorizado - Sesión expirada' : `Error HTTP: ${response.status}`);
+            }
+            return response.json();
+        })
+        .then(data => {
+            secuenciaCambios = data.seq;
+            data.reiniciar.forEach(tipo => {
+                if (tablasPaginadas[tipo]) tablasPaginadas[tipo].recargar();
+            });
+            for (const [tipo, cambios] of Object.entries(data.cambios)) {
+                if (tablasPaginadas[tipo]) tablasPaginadas[tipo].aplicarCambios(cambios.actualizados, cambios.eliminados);
+            }
+        })
+        .catch(error => console.error('Error sincronizando cambios:', error))
+        .finally(() => {
+            sincronizando = null;
+            if (sincronizarDeNuevo) {
+                sincronizarDeNuevo = false;
+                sincronizarCambios();
+            }
+        });
+    return sincronizando;
+}
+// ============================================================================
+// TABLAS PAGINADAS Y VIRTUALIZADAS
+// ============================================================================
+// Cada tabla pide al servidor páginas de FILAS_POR_PAGINA registros (solo las
+// columnas que muestra) y solo tiene en el DOM las filas visibles; el resto
+// del alto se reserva con dos filas espaciadoras.
+
+const ALTO_FILA_TABLA = 49;
+const FILAS_POR_PAGINA = 200;
+const MAX_FILAS_POR_PAGINA = 1000;
+const FILAS_EXTRA_TABLA = 15;
+const tablasPaginadas = {};
+
+function obtenerTablaPaginada(clave, opciones) {
+    if (!tablasPaginadas[clave]) {
+        tablasPaginadas[clave] = crearTablaPaginada(opciones);
+    }
+    return tablasPaginadas[clave];
+}
+
+function crearTablaPaginada(opciones) {
+    const tbody = document.getElementById(opciones.tbodyId);
+    const contenedor = tbody.closest('.tabla-virtual');
+    const tabla = {
+        filas: [],
+        total: 0,
+        cursor: null,
+        cargando: false,
+        generacion: 0,
+        filtros: { q: '', estado: '', sort: 'id' }
+    };
+
+    // Barra de búsqueda, filtro por estado y orden
+    const barra = document.createElement('div');
+    barra.className = 'row g-2 mb-2 align-items-center';
+    barra.innerHTML = `
+        <div class="col-md-5">
+            <input type="search" class="form-control form-control-sm" placeholder="Buscar por ID, nombre, ciudad o dirección">
+        </div>
+        <div class="col-md-3">
+            <select class="form-select form-select-sm" data-filtro="estado">
+                <option value="">Todos los estados</option>
+                <option value="activo">Activo</option>
+                <option value="planeado">Planeado</option>
+                <option value="proxima_apertura">Próxima Apertura</option>
+                <option value="en_construccion">En Construcción</option>
+            </select>
+        </div>
+        <div class="col-md-2">
+            <select class="form-select form-select-sm" data-filtro="sort">
+                <option value="id">Orden: ID</option>
+                <option value="nombre">Orden: Nombre</option>
+                <option value="ciudad">Orden: Ciudad</option>
+                <option value="estado">Orden: Estado</option>
+                <option value="-fecha_apertura">Apertura más reciente</option>
+                <option value="fecha_apertura">Apertura más antigua</option>
+            </select>
+        </div>
+        <div class="col-md-2 text-end small text-muted" data-total></div>`;
+    contenedor.parentNode.insertBefore(barra, contenedor);
+
+    let espera = null;
+    barra.querySelector('input').addEventListener('input', evento => {
+        clearTimeout(espera);
+        espera = setTimeout(() => {
+            tabla.filtros.q = evento.target.value.trim();
+            tabla.recargar();
+        }, 300);
+    });
+    barra.querySelectorAll('select').forEach(select => {
+        select.addEventListener('change', () => {
+            tabla.filtros[select.dataset.filtro] = select.value;
+            tabla.recargar();
+        });
+    });
+
+    let pintura = null;
+    contenedor.addEventListener('scroll', () => {
+        if (pintura === null) {
+            pintura = requestAnimationFrame(() => {
+                pintura = null;
+                pintar();
+            });
+        }
+    });
+
+    function parametros(limite) {
+        const params = new URLSearchParams({ limit: limite, fields: opciones.campos, sort: tabla.filtros.sort });
+        if (tabla.filtros.q) params.set('q', tabla.filtros.q);
+        if (tabla.filtros.estado) params.set('estado', tabla.filtros.estado);
+        if (tabla.cursor) params.set('cursor', tabla.cursor);
+        return params;
+    }
+
+    // `hasta`: cuántas filas hacen falta; si se saltó lejos se piden más de una vez
+    function cargarPagina(hasta = 0) {
+        if (tabla.cargando || (tabla.filas.length > 0 && !tabla.cursor)) return;
+        tabla.cargando = true;
+        const generacion = tabla.generacion;
+        const limite = Math.min(Math.max(hasta - tabla.filas.length, FILAS_POR_PAGINA), MAX_FILAS_POR_PAGINA);
+
+        fetch(`${opciones.url}?${parametros(limite)}`)
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(response.status === 401 ? 'No autorizado - Sesión expirada' : `Error HTTP: ${response.status}`);
+                }
+                return response.json();
+            })
+            .then(pagina => {
+                // Respuesta de una búsqueda anterior: se descarta
+                if (generacion !== tabla.generacion) return;
+                tabla.filas.push(...pagina.items);
+                tabla.total = pagina.total;
+                tabla.cursor = pagina.siguiente_cursor;
+                tabla.cargando = false;
+                barra.querySelector('[data-total]').textContent = `${tabla.total} registros`;
+                pintar();
+            })
+            .catch(error => {
+                if (generacion !== tabla.generacion) return;
+                tabla.cargando = false;
+                console.error('Error cargando', opciones.url, error);
+                tbody.innerHTML = `<tr><td colspan="${opciones.columnas}" class="text-center text-danger">
+                    <strong>Error al cargar los datos</strong><br><small>${escaparHTML(error.message)}</small></td></tr>`;
+            });
+    }
+
+    function pintar() {
+        if (tabla.total === 0) {
+            tbody.innerHTML = tabla.cargando ? '' : `<tr><td colspan="${opciones.columnas}" class="text-center">${opciones.vacio}</td></tr>`;
+            return;
+        }
+        const visibles = Math.ceil(contenedor.clientHeight / ALTO_FILA_TABLA);
+        // Primera fila siempre par para que el rayado de la tabla no salte al desplazarse
+        let primera = Math.max(0, Math.floor(contenedor.scrollTop / ALTO_FILA_TABLA) - FILAS_EXTRA_TABLA);
+        primera -= primera % 2;
+        const ultima = Math.min(tabla.filas.length, primera + visibles + 2 * FILAS_EXTRA_TABLA);
+
+        let html = `<tr class="espaciador" style="height: ${primera * ALTO_FILA_TABLA}px"></tr>`;
+        for (let i = primera; i < ultima; i++) {
+            html += `<tr>${opciones.fila(tabla.filas[i])}</tr>`;
+        }
+        html += `<tr class="espaciador" style="height: ${(tabla.total - ultima) * ALTO_FILA_TABLA}px"></tr>`;
+        tbody.innerHTML = html;
+
+        // Cerca del final de lo descargado: pedir la página siguiente
+        const necesarias = primera + visibles + 2 * FILAS_EXTRA_TABLA;
+        if (tabla.cursor && necesarias >= tabla.filas.length - FILAS_EXTRA_TABLA) {
+            cargarPagina(necesarias);
+        }
+    }
+
+    tabla.recargar = function() {
+        tabla.generacion++;
+        tabla.filas = [];
+        tabla.total = 0;
+        tabla.cursor = null;
+        tabla.cargando = false;
+        contenedor.scrollTop = 0;
+        cargarPagina();
+    };
+
+    // Aplica registros cambiados sobre las filas descargadas, sin volver a pedirlas.
+    // Solo se insertan los que caen dentro de lo ya descargado: los que queden
+    // más allá llegarán con las páginas siguientes.
+    tabla.aplicarCambios = function(actualizados, eliminados) {
+        if (tabla.cargando) {
+            // La página en camino puede ser anterior al cambio: se descarta y se pide después
+            tabla.generacion++;
+            tabla.cargando = false;
+            if (tabla.filas.length === 0) {
+                cargarPagina();
+                return;
+            }
+        }
+        const campo = tabla.filtros.sort.replace(/^-/, '');
+        const signo = tabla.filtros.sort.startsWith('-') ? -1 : 1;
+        const clave = registro => [textoOrden(registro[campo]), String(registro.id)];
+        const comparar = (a, b) => signo * (a[0] < b[0] ? -1 : a[0] > b[0] ? 1 : a[1] < b[1] ? -1 : a[1] > b[1] ? 1 : 0);
+        const limite = tabla.cursor && tabla.filas.length ? clave(tabla.filas[tabla.filas.length - 1]) : null;
+
+        const quitar = new Set(eliminados.concat(actualizados.map(registro => registro.id)).map(String));
+        const antes = tabla.filas.length;
+        tabla.filas = tabla.filas.filter(fila => !quitar.has(String(fila.id)));
+        tabla.total -= antes - tabla.filas.length;
+
+        const columnas = ['id'].concat(opciones.campos.split(','));
+        actualizados.filter(cumpleFiltros).forEach(registro => {
+            const k = clave(registro);
+            if (limite && comparar(k, limite) > 0) return;
+            let bajo = 0;
+            let alto = tabla.filas.length;
+            while (bajo < alto) {
+                const medio = (bajo + alto) >> 1;
+                if (comparar(clave(tabla.filas[medio]), k) < 0) {
+                    bajo = medio + 1;
+                } else {
+                    alto = medio;
+                }
+            }
+            const fila = {};
+            columnas.forEach(columna => {
+                if (columna in registro) fila[columna] = registro[columna];
+            });
+            tabla.filas.splice(bajo, 0, fila);
+            tabla.total++;
+        });
+        barra.querySelector('[data-total]').textContent = `${tabla.total} registros`;
+        pintar();
+    };
+
+    function cumpleFiltros(registro) {
+        if (tabla.filtros.estado && (registro.estado || 'activo') !== tabla.filtros.estado) return false;
+        const q = tabla.filtros.q.toLowerCase();
+        return !q || ['id', 'nombre', 'ciudad', 'direccion'].some(campo => textoOrden(registro[campo]).includes(q));
     }
+
+    return tabla;
 }
+
+// Mismo criterio que el orden del servidor (texto sin distinguir mayúsculas)
+function textoOrden(valor) {
+    return valor === null || valor === undefined ? '' : String(valor).toLowerCase();
+}
+
 // ============================================================================
 // FUNCIONES PARA CENTROS DE DISTRIBUCIÓN
 // ============================================================================
@@ -55,39 +301,34 @@ function cargarSeccionActiva() {
 function exportarDatos() {
     mostrarLoadingGestion('Exportando datos...');
     
+    // El servidor envía el documento en streaming; el resumen viene en una cabecera
     fetch('/api/exportar-datos')
         .then(response => {
             if (!response.ok) {
                 throw new Error('Error en la respuesta del servidor');
             }
-            return response.json();
+            const resumen = JSON.parse(response.headers.get('X-Resumen-Exportacion') || '{}');
+            return response.blob().then(blob => ({ blob, resumen }));
         })
-        .then(data => {
-            if (data.success) {
-                // Crear y descargar archivo JSON
-                const blob = new Blob([JSON.stringify(data.datos, null, 2)], { 
-                    type: 'application/json;charset=utf-8' 
-                });
-                const url = URL.createObjectURL(blob);
-                const a = document.createElement('a');
-                a.href = url;
-                a.download = `backup_datos_carnes_san_martin_${new Date().toISOString().split('T')[0]}.json`;
-                document.body.appendChild(a);
-                a.click();
-                document.body.removeChild(a);
-                URL.revokeObjectURL(url);
-                
-                mostrarResultadoGestion('success', 
-                    `✅ <strong>Datos exportados correctamente</strong><br>
-                     📊 <strong>Resumen:</strong><br>
-                     • ${data.resumen.centros} centros de distribución<br>
-                     • ${data.resumen.distribuidores} distribuidores autorizados<br>
-                     • ${data.resumen.tiendas_oro} tiendas oro<br>
-                     • ${data.resumen.tiendas_satelite} tiendas satélite<br>
-                     • <strong>Total: ${data.resumen.total} ubicaciones</strong>`);
-            } else {
-                mostrarResultadoGestion('error', `❌ <strong>Error al exportar:</strong> ${data.error || 'Error desconocido'}`);
-            }
+        .then(({ blob, resumen }) => {
+            // Descargar el archivo JSON tal cual llegó
+            const url = URL.createObjectURL(blob);
+            const a = document.createElement('a');
+            a.href = url;
+            a.download = `backup_datos_carnes_san_martin_${new Date().toISOString().split('T')[0]}.json`;
+            document.body.appendChild(a);
+            a.click();
+            document.body.removeChild(a);
+            URL.revokeObjectURL(url);
+            
+            mostrarResultadoGestion('success', 
+                `✅ <strong>Datos exportados correctamente</strong><br>
+                 📊 <strong>Resumen:</strong><br>
+                 • ${resumen.centros} centros de distribución<br>
+                 • ${resumen.distribuidores} distribuidores autorizados<br>
+                 • ${resumen.tiendas_oro} tiendas oro<br>
+                 • ${resumen.tiendas_satelite} tiendas satélite<br>
+                 • <strong>Total: ${resumen.total} ubicaciones</strong>`);
         })
         .catch(error => {
             console.error('Error exportando datos:', error);
@@ -104,6 +345,12 @@ function importarDatos() {
         return;
     }
     
+    // Actualizar por id: el archivo se envía tal cual y el servidor lo lee en streaming
+    if (document.getElementById('importUpsert').checked) {
+        importarDatosIncremental(file, fileInput);
+        return;
+    }
+    
     // Validar tipo de archivo
     if (!file.name.toLowerCase().endsWith('.json')) {
         mostrarResultadoGestion('error', '❌ <strong>El archivo debe ser un JSON</strong>');
@@ -183,6 +430,137 @@ function importarDatos() {
     reader.readAsText(file);
 }
 
+function importarDatosIncremental(file, fileInput) {
+    const nombreArchivo = file.name.toLowerCase();
+    if (!nombreArchivo.endsWith('.json') && !nombreArchivo.endsWith('.json.gz')) {
+        mostrarResultadoGestion('error', '❌ <strong>El archivo debe ser un JSON (o JSON comprimido .json.gz)</strong>');
+        return;
+    }
+    
+    if (!confirm('¿Importar este archivo?\n\nLos registros con un ID existente se actualizarán y los demás se agregarán. Los registros inválidos se omitirán.')) {
+        return;
+    }
+    
+    mostrarLoadingGestion('Importando datos...');
+    
+    fetch('/api/importar-datos?modo=upsert', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/octet-stream',
+        },
+        body: file
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (!data.resumen) {
+            mostrarResultadoGestion('error', `❌ <strong>Error al importar:</strong> ${escaparHTML(data.error || 'Error desconocido')}`);
+            return;
+        }
+        
+        let mensaje = data.success
+            ? '✅ <strong>Datos importados correctamente</strong><br>'
+            : `⚠️ <strong>Importación interrumpida:</strong> ${escaparHTML(data.error)}<br>
+               Los lotes anteriores al error sí se guardaron.<br>`;
+        mensaje += '📥 <strong>Resumen de importación:</strong><br>';
+        
+        for (const [categoria, cuenta] of Object.entries(data.resumen)) {
+            const nombre = categoria.replace('_', ' ');
+            mensaje += `• ${nombre}: ${cuenta.insertados} nuevos, ${cuenta.actualizados} actualizados`;
+            mensaje += cuenta.errores ? `, ${cuenta.errores} con errores<br>` : '<br>';
+        }
+        mensaje += `• <strong>Total: ${data.total} registros</strong><br>`;
+        
+        if (data.total_errores) {
+            mensaje += `<br>❌ <strong>${data.total_errores} registros omitidos:</strong>
+                       <ul class="small mb-0" style="max-height: 200px; overflow-y: auto;">`;
+            data.errores.forEach(error => {
+                mensaje += `<li>${escaparHTML(error.categoria)} #${error.indice + 1}` +
+                           `${error.id ? ' (' + escaparHTML(error.id) + ')' : ''}: ${escaparHTML(error.error)}</li>`;
+            });
+            if (data.total_errores > data.errores.length) {
+                mensaje += `<li>... y ${data.total_errores - data.errores.length} más</li>`;
+            }
+            mensaje += '</ul>';
+        }
+        
+        mensaje += `<button class="btn btn-sm btn-success mt-2" onclick="location.reload()">
+                        <i class="fas fa-sync me-1"></i>Recargar página para ver cambios
+                    </button>`;
+        
+        mostrarResultadoGestion(data.success && !data.total_errores ? 'success' : 'warning', mensaje);
+        fileInput.value = '';
+    })
+    .catch(error => {
+        console.error('Error importando datos:', error);
+        mostrarResultadoGestion('error', `❌ <strong>Error de conexión:</strong> ${error.message}`);
+    });
+}
+
+// Edición masiva: todas las operaciones viajan en un solo POST a /api/batch
+function aplicarEdicionMasiva() {
+    const tipo = document.getElementById('loteTipo').value;
+    const accion = document.getElementById('loteAccion').value;
+    const estado = document.getElementById('loteEstado').value;
+    const ids = [...new Set(document.getElementById('loteIds').value.split(/[\s,;]+/).filter(id => id))];
+    
+    if (ids.length === 0) {
+        mostrarResultadoGestion('error', '❌ <strong>Indica al menos un ID</strong>');
+        return;
+    }
+    
+    const descripcion = accion === 'eliminar' ? 'eliminar' : `cambiar a "${formatearEstado(estado)}"`;
+    if (!confirm(`¿Seguro que deseas ${descripcion} ${ids.length} registros?`)) {
+        return;
+    }
+    
+    const operaciones = ids.map(id => accion === 'eliminar'
+        ? { op: 'eliminar', tipo: tipo, id: id }
+        : { op: 'actualizar', tipo: tipo, id: id, datos: { estado: estado } });
+    
+    mostrarLoadingGestion(`Aplicando ${operaciones.length} cambios...`);
+    
+    fetch('/api/batch', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ operaciones: operaciones })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            mostrarResultadoGestion('success', `✅ <strong>${data.resultados.length} registros actualizados</strong>`);
+            document.getElementById('loteIds').value = '';
+            sincronizarCambios();
+            return;
+        }
+        
+        let mensaje = `❌ <strong>No se aplicó ningún cambio:</strong> ${escaparHTML(data.error || 'Error desconocido')}`;
+        const errores = (data.resultados || []).filter(resultado => resultado.error);
+        if (errores.length) {
+            mensaje += '<ul class="small mb-0" style="max-height: 200px; overflow-y: auto;">';
+            errores.forEach(resultado => {
+                mensaje += `<li>${escaparHTML(resultado.id || '#' + (resultado.indice + 1))}: ${escaparHTML(resultado.error)}</li>`;
+            });
+            mensaje += '</ul>';
+        }
+        mostrarResultadoGestion('error', mensaje);
+    })
+    .catch(error => {
+        console.error('Error aplicando edición masiva:', error);
+        mostrarResultadoGestion('error', `❌ <strong>Error de conexión:</strong> ${error.message}`);
+    });
+}
+
+function escaparHTML(valor) {
+    return String(valor ?? '')
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;')
+        .replace(/'/g, '&#39;');
+}
+
 function crearBackup() {
     if (!confirm('💾 ¿Crear una copia de seguridad de todos los datos?')) {
         return;
@@ -211,7 +589,12 @@ function crearBackup() {
                  • ${data.resumen.centros} centros de distribución<br>
                  • ${data.resumen.distribuidores} distribuidores autorizados<br>
                  • ${data.resumen.tiendas_oro} tiendas oro<br>
-                 • ${data.resumen.tiendas_satelite} tiendas satélite`);
+                 • ${data.resumen.tiendas_satelite} tiendas satélite<br>
+                 🗜️ <strong>Espacio nuevo:</strong> ${(data.bytes_escritos / 1024).toFixed(1)} KB
+                 (colecciones sin cambios reutilizadas)`);
+            if (document.getElementById('listaBackups').innerHTML) {
+                cargarBackups();
+            }
         } else {
             mostrarResultadoGestion('error', `❌ <strong>Error al crear backup:</strong> ${data.error || 'Error desconocido'}`);
         }
@@ -222,6 +605,62 @@ function crearBackup() {
     });
 }
 
+function cargarBackups() {
+    fetch('/api/backups')
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Error en la respuesta del servidor');
+            }
+            return response.json();
+        })
+        .then(backups => {
+            const lista = document.getElementById('listaBackups');
+            if (backups.length === 0) {
+                lista.innerHTML = '<p class="text-muted small mb-0">No hay backups</p>';
+                return;
+            }
+            lista.innerHTML = '<ul class="list-group list-group-flush small">' + backups.map(backup => {
+                const total = Object.values(backup.registros).reduce((suma, n) => suma + n, 0);
+                return `<li class="list-group-item d-flex justify-content-between align-items-center px-0">
+                            <span>${new Date(backup.creado).toLocaleString('es-ES')} · ${total} ubicaciones</span>
+                            <button class="btn btn-outline-danger btn-sm" onclick="restaurarBackup('${escaparHTML(backup.id)}')">
+                                <i class="fas fa-undo me-1"></i>Restaurar
+                            </button>
+                        </li>`;
+            }).join('') + '</ul>';
+        })
+        .catch(error => {
+            console.error('Error cargando backups:', error);
+            mostrarResultadoGestion('error', `❌ <strong>Error de conexión:</strong> ${error.message}`);
+        });
+}
+
+function restaurarBackup(backupId) {
+    if (!confirm('⚠️ ¿Restaurar este backup?\n\nEsto reemplazará TODOS los datos actuales por los del backup.')) {
+        return;
+    }
+    
+    mostrarLoadingGestion('Restaurando backup...');
+    
+    fetch(`/api/backups/${encodeURIComponent(backupId)}/restaurar`, { method: 'POST' })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                mostrarResultadoGestion('success',
+                    `♻️ <strong>Backup restaurado:</strong> ${data.total} ubicaciones<br>
+                     <button class="btn btn-sm btn-success mt-2" onclick="location.reload()">
+                         <i class="fas fa-sync me-1"></i>Recargar página para ver cambios
+                     </button>`);
+            } else {
+                mostrarResultadoGestion('error', `❌ <strong>Error al restaurar:</strong> ${escaparHTML(data.error || 'Error desconocido')}`);
+            }
+        })
+        .catch(error => {
+            console.error('Error restaurando backup:', error);
+            mostrarResultadoGestion('error', `❌ <strong>Error de conexión:</strong> ${error.message}`);
+        });
+}
+
 // Funciones auxiliares para la gestión de datos
 function mostrarLoadingGestion(mensaje) {
     document.getElementById('resultadoGestion').innerHTML = 
@@ -232,7 +671,7 @@ function mostrarLoadingGestion(mensaje) {
 }
 
 function mostrarResultadoGestion(tipo, mensaje) {
-    const clase = tipo === 'success' ? 'alert-success' : 'alert-danger';
+    const clase = tipo === 'success' ? 'alert-success' : (tipo === 'warning' ? 'alert-warning' : 'alert-danger');
     document.getElementById('resultadoGestion').innerHTML = 
         `<div class="alert ${clase}">
             <div class="d-flex align-items-center">
@@ -248,11 +687,17 @@ function mostrarResultadoGestion(tipo, mensaje) {
 
 // Navegación del sidebar
 document.addEventListener('DOMContentLoaded', function() {
-    // Cargar datos iniciales
-    cargarCentrosDistribucion();
-    cargarDistribuidores();
-    cargarTiendasOro();
-    cargarTiendasSatelite();
+    // Cargar datos iniciales: la secuencia se pide antes que las listas, así
+    // lo que cambie entre medias llega después como delta
+    sincronizarCambios().then(() => {
+        cargarCentrosDistribucion();
+        cargarDistribuidores();
+        cargarTiendasOro();
+        cargarTiendasSatelite();
+    });
+    setInterval(() => {
+        if (!document.hidden) sincronizarCambios();
+    }, INTERVALO_SINCRONIZACION);
     
     // Navegación del sidebar
     document.querySelectorAll('.nav-link[data-target]').forEach(link => {
@@ -278,60 +723,31 @@ document.addEventListener('DOMContentLoaded', function() {
 
 
 function cargarCentrosDistribucion() {
-    console.log('Cargando centros de distribución...');
-    fetch('/api/centros-distribucion')
-        .then(response => {
-            if (!response.ok) {
-                throw new Error('Error en la respuesta de la API');
-            }
-            return response.json();
-        })
-        .then(data => {
-            console.log('Datos de centros recibidos:', data);
-            const tbody = document.getElementById('tbodyCentrosDistribucion');
-            if (!tbody) {
-                console.error('No se encontró tbodyCentrosDistribucion');
-                return;
-            }
-            
-            tbody.innerHTML = '';
-            
-            if (data.length === 0) {
-                tbody.innerHTML = '<tr><td colspan="10" class="text-center">No hay centros de distribución registrados</td></tr>';
-                return;
-            }
-            
-            data.forEach(centro => {
-                const tr = document.createElement('tr');
-                tr.innerHTML = `
-                    <td>${centro.id}</td>
-                    <td>${centro.nombre}</td>
-                    <td>${centro.ciudad}</td>
-                    <td>${centro.direccion}</td>
-                    <td><span class="estado-${centro.estado}">${formatearEstado(centro.estado)}</span></td>
-                    <td>${centro.telefono || 'N/A'}</td>
-                    <td>${centro.capacidad_almacen || 'N/A'}</td>
-                    <td>${centro.tipo_centro || 'N/A'}</td>
+    obtenerTablaPaginada('centros_distribucion', {
+        url: '/api/centros-distribucion',
+        tbodyId: 'tbodyCentrosDistribucion',
+        columnas: 10,
+        campos: 'nombre,ciudad,direccion,estado,telefono,capacidad_almacen,tipo_centro,fecha_apertura',
+        vacio: 'No hay centros de distribución registrados',
+        fila: centro => `
+                    <td>${escaparHTML(centro.id)}</td>
+                    <td>${escaparHTML(centro.nombre)}</td>
+                    <td>${escaparHTML(centro.ciudad)}</td>
+                    <td>${escaparHTML(centro.direccion)}</td>
+                    <td><span class="estado-${escaparHTML(centro.estado)}">${formatearEstado(centro.estado)}</span></td>
+                    <td>${escaparHTML(centro.telefono || 'N/A')}</td>
+                    <td>${escaparHTML(centro.capacidad_almacen || 'N/A')}</td>
+                    <td>${escaparHTML(centro.tipo_centro || 'N/A')}</td>
                     <td>${formatearFecha(centro.fecha_apertura)}</td>
                     <td class="table-actions">
-                        <button class="btn btn-sm btn-warning me-1" onclick="editarCentroDistribucion('${centro.id}')">
+                        <button class="btn btn-sm btn-warning me-1" onclick="editarCentroDistribucion('${escaparHTML(centro.id)}')">
                             <i class="fas fa-edit"></i>
                         </button>
-                        <button class="btn btn-sm btn-danger" onclick="eliminarCentroDistribucion('${centro.id}')">
+                        <button class="btn btn-sm btn-danger" onclick="eliminarCentroDistribucion('${escaparHTML(centro.id)}')">
                             <i class="fas fa-trash"></i>
                         </button>
-                    </td>
-                `;
-                tbody.appendChild(tr);
-            });
-        })
-        .catch(error => {
-            console.error('Error cargando centros de distribución:', error);
-            const tbody = document.getElementById('tbodyCentrosDistribucion');
-            if (tbody) {
-                tbody.innerHTML = '<tr><td colspan="10" class="text-center text-danger">Error al cargar los datos</td></tr>';
-            }
-        });
+                    </td>`
+    }).recargar();
 }
 
 function abrirModalCentroDistribucion(centro = null) {
@@ -415,7 +831,7 @@ function guardarCentroDistribucion() {
     .then(data => {
         if (data.success) {
             bootstrap.Modal.getInstance(document.getElementById('modalCentroDistribucion')).hide();
-            cargarCentrosDistribucion();
+            sincronizarCambios();
             mostrarAlerta('Centro de Distribución guardado exitosamente', 'success');
         } else {
             throw new Error(data.error || 'Error al guardar');
@@ -428,7 +844,7 @@ function guardarCentroDistribucion() {
 }
 
 function editarCentroDistribucion(id) {
-    fetch(`/api/centros-distribucion`)
+    fetch(`/api/centros-distribucion?ids=${encodeURIComponent(id)}`)
         .then(response => response.json())
         .then(centros => {
             const centro = centros.find(c => c.id === id);
@@ -447,7 +863,7 @@ function eliminarCentroDistribucion(id) {
         .then(response => response.json())
         .then(data => {
             if (data.success) {
-                cargarCentrosDistribucion();
+                sincronizarCambios();
                 mostrarAlerta('Centro de Distribución eliminado exitosamente', 'success');
             } else {
                 throw new Error(data.error || 'Error al eliminar');
@@ -465,73 +881,29 @@ function eliminarCentroDistribucion(id) {
 // ============================================================================
 
 function cargarDistribuidores() {
-    console.log('📦 Cargando distribuidores...');
-    fetch('/api/distribuidores')
-        .then(response => {
-            console.log('📡 Respuesta de API distribuidores:', response.status, response.statusText);
-            
-            if (!response.ok) {
-                if (response.status === 401) {
-                    throw new Error('No autorizado - Sesión expirada');
-                } else if (response.status === 404) {
-                    throw new Error('API no encontrada');
-                } else {
-                    throw new Error(`Error HTTP: ${response.status} ${response.statusText}`);
-                }
-            }
-            return response.json();
-        })
-        .then(data => {
-            console.log('✅ Datos de distribuidores recibidos:', data);
-            const tbody = document.getElementById('tbodyDistribuidores');
-            if (!tbody) {
-                console.error('❌ No se encontró tbodyDistribuidores');
-                return;
-            }
-            
-            tbody.innerHTML = '';
-            
-            if (data.length === 0) {
-                tbody.innerHTML = '<tr><td colspan="8" class="text-center">No hay distribuidores registrados</td></tr>';
-                return;
-            }
-            
-            data.forEach(distribuidor => {
-                const tr = document.createElement('tr');
-                tr.innerHTML = `
-                    <td>${distribuidor.id}</td>
-                    <td>${distribuidor.nombre}</td>
-                    <td>${distribuidor.ciudad}</td>
-                    <td>${distribuidor.direccion}</td>
-                    <td><span class="estado-${distribuidor.estado}">${formatearEstado(distribuidor.estado)}</span></td>
-                    <td>${distribuidor.telefono || 'N/A'}</td>
+    obtenerTablaPaginada('distribuidores', {
+        url: '/api/distribuidores',
+        tbodyId: 'tbodyDistribuidores',
+        columnas: 8,
+        campos: 'nombre,ciudad,direccion,estado,telefono,fecha_apertura',
+        vacio: 'No hay distribuidores registrados',
+        fila: distribuidor => `
+                    <td>${escaparHTML(distribuidor.id)}</td>
+                    <td>${escaparHTML(distribuidor.nombre)}</td>
+                    <td>${escaparHTML(distribuidor.ciudad)}</td>
+                    <td>${escaparHTML(distribuidor.direccion)}</td>
+                    <td><span class="estado-${escaparHTML(distribuidor.estado)}">${formatearEstado(distribuidor.estado)}</span></td>
+                    <td>${escaparHTML(distribuidor.telefono || 'N/A')}</td>
                     <td>${formatearFecha(distribuidor.fecha_apertura)}</td>
                     <td class="table-actions">
-                        <button class="btn btn-sm btn-warning me-1" onclick="editarDistribuidor('${distribuidor.id}')">
+                        <button class="btn btn-sm btn-warning me-1" onclick="editarDistribuidor('${escaparHTML(distribuidor.id)}')">
                             <i class="fas fa-edit"></i>
                         </button>
-                        <button class="btn btn-sm btn-danger" onclick="eliminarDistribuidor('${distribuidor.id}')">
+                        <button class="btn btn-sm btn-danger" onclick="eliminarDistribuidor('${escaparHTML(distribuidor.id)}')">
                             <i class="fas fa-trash"></i>
                         </button>
-                    </td>
-                `;
-                tbody.appendChild(tr);
-            });
-        })
-        .catch(error => {
-            console.error('💥 Error cargando distribuidores:', error);
-            const tbody = document.getElementById('tbodyDistribuidores');
-            if (tbody) {
-                tbody.innerHTML = `
-                    <tr>
-                        <td colspan="8" class="text-center text-danger">
-                            <strong>Error al cargar los datos</strong><br>
-                            <small>${error.message}</small>
-                        </td>
-                    </tr>
-                `;
-            }
-        });
+                    </td>`
+    }).recargar();
 }
 
 function abrirModalDistribuidor(distribuidor = null) {
@@ -607,7 +979,7 @@ function guardarDistribuidor() {
     .then(data => {
         if (data.success) {
             bootstrap.Modal.getInstance(document.getElementById('modalDistribuidor')).hide();
-            cargarDistribuidores();
+            sincronizarCambios();
             mostrarAlerta('Distribuidor guardado exitosamente', 'success');
         } else {
             throw new Error(data.error || 'Error al guardar');
@@ -624,35 +996,29 @@ function guardarDistribuidor() {
 // ============================================================================
 
 function cargarTiendasOro() {
-    fetch('/api/tiendas-oro')
-        .then(response => response.json())
-        .then(data => {
-            const tbody = document.getElementById('tbodyTiendasOro');
-            tbody.innerHTML = '';
-            
-            data.forEach(tienda => {
-                const tr = document.createElement('tr');
-                tr.innerHTML = `
-                    <td>${tienda.id}</td>
-                    <td>${tienda.nombre}</td>
-                    <td>${tienda.ciudad}</td>
-                    <td>${tienda.direccion}</td>
-                    <td><span class="estado-${tienda.estado}">${formatearEstado(tienda.estado)}</span></td>
-                    <td>${tienda.capacidad_congelador || 'N/A'}</td>
+    obtenerTablaPaginada('tiendas_oro', {
+        url: '/api/tiendas-oro',
+        tbodyId: 'tbodyTiendasOro',
+        columnas: 8,
+        campos: 'nombre,ciudad,direccion,estado,capacidad_congelador,fecha_apertura',
+        vacio: 'No hay tiendas oro registradas',
+        fila: tienda => `
+                    <td>${escaparHTML(tienda.id)}</td>
+                    <td>${escaparHTML(tienda.nombre)}</td>
+                    <td>${escaparHTML(tienda.ciudad)}</td>
+                    <td>${escaparHTML(tienda.direccion)}</td>
+                    <td><span class="estado-${escaparHTML(tienda.estado)}">${formatearEstado(tienda.estado)}</span></td>
+                    <td>${escaparHTML(tienda.capacidad_congelador || 'N/A')}</td>
                     <td>${formatearFecha(tienda.fecha_apertura)}</td>
                     <td class="table-actions">
-                        <button class="btn btn-sm btn-warning me-1" onclick="editarTiendaOro('${tienda.id}')">
+                        <button class="btn btn-sm btn-warning me-1" onclick="editarTiendaOro('${escaparHTML(tienda.id)}')">
                             <i class="fas fa-edit"></i>
                         </button>
-                        <button class="btn btn-sm btn-danger" onclick="eliminarTiendaOro('${tienda.id}')">
+                        <button class="btn btn-sm btn-danger" onclick="eliminarTiendaOro('${escaparHTML(tienda.id)}')">
                             <i class="fas fa-trash"></i>
                         </button>
-                    </td>
-                `;
-                tbody.appendChild(tr);
-            });
-        })
-        .catch(error => console.error('Error cargando tiendas oro:', error));
+                    </td>`
+    }).recargar();
 }
 
 function abrirModalTiendaOro(tienda = null) {
@@ -728,7 +1094,7 @@ function guardarTiendaOro() {
     .then(data => {
         if (data.success) {
             bootstrap.Modal.getInstance(document.getElementById('modalTiendaOro')).hide();
-            cargarTiendasOro();
+            sincronizarCambios();
             mostrarAlerta('Tienda Oro guardada exitosamente', 'success');
         } else {
             throw new Error(data.error || 'Error al guardar');
@@ -745,35 +1111,29 @@ function guardarTiendaOro() {
 // ============================================================================
 
 function cargarTiendasSatelite() {
-    fetch('/api/tiendas-satelite')
-        .then(response => response.json())
-        .then(data => {
-            const tbody = document.getElementById('tbodyTiendasSatelite');
-            tbody.innerHTML = '';
-            
-            data.forEach(tienda => {
-                const tr = document.createElement('tr');
-                tr.innerHTML = `
-                    <td>${tienda.id}</td>
-                    <td>${tienda.nombre}</td>
-                    <td>${tienda.ciudad}</td>
-                    <td>${tienda.direccion}</td>
-                    <td><span class="estado-${tienda.estado}">${formatearEstado(tienda.estado)}</span></td>
-                    <td>${tienda.tipo_satelite || 'N/A'}</td>
+    obtenerTablaPaginada('tiendas_satelite', {
+        url: '/api/tiendas-satelite',
+        tbodyId: 'tbodyTiendasSatelite',
+        columnas: 8,
+        campos: 'nombre,ciudad,direccion,estado,tipo_satelite,fecha_apertura',
+        vacio: 'No hay tiendas satélite registradas',
+        fila: tienda => `
+                    <td>${escaparHTML(tienda.id)}</td>
+                    <td>${escaparHTML(tienda.nombre)}</td>
+                    <td>${escaparHTML(tienda.ciudad)}</td>
+                    <td>${escaparHTML(tienda.direccion)}</td>
+                    <td><span class="estado-${escaparHTML(tienda.estado)}">${formatearEstado(tienda.estado)}</span></td>
+                    <td>${escaparHTML(tienda.tipo_satelite || 'N/A')}</td>
                     <td>${formatearFecha(tienda.fecha_apertura)}</td>
                     <td class="table-actions">
-                        <button class="btn btn-sm btn-warning me-1" onclick="editarTiendaSatelite('${tienda.id}')">
+                        <button class="btn btn-sm btn-warning me-1" onclick="editarTiendaSatelite('${escaparHTML(tienda.id)}')">
                             <i class="fas fa-edit"></i>
                         </button>
-                        <button class="btn btn-sm btn-danger" onclick="eliminarTiendaSatelite('${tienda.id}')">
+                        <button class="btn btn-sm btn-danger" onclick="eliminarTiendaSatelite('${escaparHTML(tienda.id)}')">
                             <i class="fas fa-trash"></i>
                         </button>
-                    </td>
-                `;
-                tbody.appendChild(tr);
-            });
-        })
-        .catch(error => console.error('Error cargando tiendas satélite:', error));
+                    </td>`
+    }).recargar();
 }
 
 function abrirModalTiendaSatelite(tienda = null) {
@@ -849,7 +1209,7 @@ function guardarTiendaSatelite() {
     .then(data => {
         if (data.success) {
             bootstrap.Modal.getInstance(document.getElementById('modalTiendaSatelite')).hide();
-            cargarTiendasSatelite();
+            sincronizarCambios();
             mostrarAlerta('Tienda Satélite guardada exitosamente', 'success');
         } else {
             throw new Error(data.error || 'Error al guardar');
@@ -904,7 +1264,7 @@ function mostrarAlerta(mensaje, tipo) {
 // ============================================================================
 
 function editarCentroDistribucion(id) {
-    fetch(`/api/centros-distribucion`)
+    fetch(`/api/centros-distribucion?ids=${encodeURIComponent(id)}`)
         .then(response => response.json())
         .then(centros => {
             const centro = centros.find(c => c.id === id);
@@ -923,7 +1283,7 @@ function eliminarCentroDistribucion(id) {
         .then(response => response.json())
         .then(data => {
             if (data.success) {
-                cargarCentrosDistribucion();
+                sincronizarCambios();
                 mostrarAlerta('Centro de Distribución eliminado exitosamente', 'success');
             } else {
                 throw new Error(data.error || 'Error al eliminar');
@@ -937,7 +1297,7 @@ function eliminarCentroDistribucion(id) {
 }
 
 function editarDistribuidor(id) {
-    fetch(`/api/distribuidores`)
+    fetch(`/api/distribuidores?ids=${encodeURIComponent(id)}`)
         .then(response => response.json())
         .then(distribuidores => {
             const distribuidor = distribuidores.find(d => d.id === id);
@@ -956,7 +1316,7 @@ function eliminarDistribuidor(id) {
         .then(response => response.json())
         .then(data => {
             if (data.success) {
-                cargarDistribuidores();
+                sincronizarCambios();
                 mostrarAlerta('Distribuidor eliminado exitosamente', 'success');
             } else {
                 throw new Error(data.error || 'Error al eliminar');
@@ -970,7 +1330,7 @@ function eliminarDistribuidor(id) {
 }
 
 function editarTiendaOro(id) {
-    fetch(`/api/tiendas-oro`)
+    fetch(`/api/tiendas-oro?ids=${encodeURIComponent(id)}`)
         .then(response => response.json())
         .then(tiendas => {
             const tienda = tiendas.find(t => t.id === id);
@@ -989,7 +1349,7 @@ function eliminarTiendaOro(id) {
         .then(response => response.json())
         .then(data => {
             if (data.success) {
-                cargarTiendasOro();
+                sincronizarCambios();
                 mostrarAlerta('Tienda Oro eliminada exitosamente', 'success');
             } else {
                 throw new Error(data.error || 'Error al eliminar');
@@ -1003,7 +1363,7 @@ function eliminarTiendaOro(id) {
 }
 
 function editarTiendaSatelite(id) {
-    fetch(`/api/tiendas-satelite`)
+    fetch(`/api/tiendas-satelite?ids=${encodeURIComponent(id)}`)
         .then(response => response.json())
         .then(tiendas => {
             const tienda = tiendas.find(t => t.id === id);
@@ -1022,7 +1382,7 @@ function eliminarTiendaSatelite(id) {
         .then(response => response.json())
         .then(data => {
             if (data.success) {
-                cargarTiendasSatelite();
+                sincronizarCambios();
                 mostrarAlerta('Tienda Satélite eliminada exitosamente', 'success');
             } else {
                 throw new Error(data.error || 'Error al eliminar');
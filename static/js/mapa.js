@@ -0,0 +1,58 @@
+// Página del mapa (/mapa): selector de capas plegable y altura correcta en móviles
+
+// Sistema SIMPLE de mostrar/ocultar selector de capas
+document.addEventListener('DOMContentLoaded', function() {
+    setTimeout(function() {
+        const layerControl = document.querySelector('.leaflet-control-layers-expanded');
+        if (layerControl) {
+            // Agregar botón simple
+            const toggleBtn = document.createElement('button');
+            toggleBtn.innerHTML = '👁️';
+            toggleBtn.style.cssText = `
+                position: absolute;
+                top: 5px;
+                right: 5px;
+                background: #ffeb3b;
+                border: 1px solid #ccc;
+                border-radius: 3px;
+                cursor: pointer;
+                z-index: 1002;
+                padding: 2px 4px;
+                font-size: 12px;
+            `;
+            
+            let isVisible = true;
+            
+            toggleBtn.addEventListener('click', function(e) {
+                e.stopPropagation();
+                const list = layerControl.querySelector('.leaflet-control-layers-list');
+                if (list) {
+                    if (isVisible) {
+                        list.style.display = 'none';
+                        toggleBtn.innerHTML = '👁️‍🗨️';
+                        toggleBtn.title = 'Mostrar capas';
+                    } else {
+                        list.style.display = 'block';
+                        toggleBtn.innerHTML = '👁️';
+                        toggleBtn.title = 'Ocultar capas';
+                    }
+                    isVisible = !isVisible;
+                }
+            });
+            
+            layerControl.appendChild(toggleBtn);
+        }
+    }, 1000);
+});
+
+// Asegurar altura correcta en móviles
+document.addEventListener('DOMContentLoaded', function() {
+    const fMap = document.querySelector('.folium-map');
+    if (fMap) {
+        function ajustar() {
+            fMap.style.setProperty('height', window.innerHeight + 'px', 'important');
+        }
+        ajustar();
+        window.addEventListener('resize', ajustar);
+    }
+});
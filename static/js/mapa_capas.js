@@ -0,0 +1,198 @@
+// Carga diferida de las capas del mapa
+// Cada capa llega vacía en el HTML y pide sus teselas, clusters o calor mientras está visible.
+
+const capasMapa = {};
+
+function escaparHTML(valor) {
+    return String(valor)
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;')
+        .replace(/'/g, '&#39;');
+}
+
+function registrarCapaMapa(mapa, grupo, opciones) {
+    const capa = {
+        mapa: mapa,
+        grupo: grupo,
+        opciones: opciones
+    };
+    capasMapa[opciones.capa] = capa;
+
+    if (opciones.url_calor) {
+        // Las teselas del mapa de calor solo se piden mientras la capa está visible
+        L.tileLayer(opciones.url_calor, { maxZoom: opciones.zoom_maximo }).addTo(grupo);
+        return;
+    }
+    if (opciones.url_clusters) {
+        registrarCapaClusters(capa);
+        return;
+    }
+    registrarCapaTeselas(capa);
+}
+
+// Capas grandes: se piden los clusters del zoom y la zona visibles cada vez que se mueve el mapa
+function registrarCapaClusters(capa) {
+    capa.peticion = 0;
+
+    function actualizar() {
+        if (capa.mapa.hasLayer(capa.grupo)) {
+            cargarClusters(capa);
+        }
+    }
+
+    capa.grupo.on('add', actualizar);
+    capa.mapa.on('moveend', actualizar);
+    actualizar();
+}
+
+function cargarClusters(capa) {
+    const limites = capa.mapa.getBounds().pad(0.25);
+    const parametros = new URLSearchParams({
+        z: capa.mapa.getZoom(),
+        bbox: [limites.getWest(), limites.getSouth(), limites.getEast(), limites.getNorth()]
+            .map(valor => valor.toFixed(5)).join(',')
+    });
+    // Descartar respuestas de movimientos anteriores
+    const peticion = ++capa.peticion;
+
+    fetch(capa.opciones.url_clusters + '?' + parametros)
+        .then(response => {
+            if (!response.ok) throw new Error('HTTP ' + response.status);
+            return response.json();
+        })
+        .then(geojson => {
+            if (peticion !== capa.peticion) return;
+            capa.grupo.clearLayers();
+            const puntos = geojson.features.filter(feature => !feature.properties.cluster);
+            geojson.features
+                .filter(feature => feature.properties.cluster)
+                .forEach(feature => agregarCluster(capa, feature));
+            agregarMarcadores(capa, puntos);
+        })
+        .catch(error => {
+            console.error('Error cargando clusters', capa.opciones.capa, error);
+        });
+}
+
+function agregarCluster(capa, feature) {
+    const cantidad = feature.properties.cantidad;
+    const diametro = cantidad < 100 ? 30 : (cantidad < 1000 ? 36 : 44);
+    const latlng = [feature.geometry.coordinates[1], feature.geometry.coordinates[0]];
+
+    const icono = L.divIcon({
+        html: `<div style="width: ${diametro}px; height: ${diametro}px; line-height: ${diametro}px; ` +
+              `border-radius: 50%; background: rgba(200, 30, 30, 0.75); color: white; ` +
+              `text-align: center; font-weight: bold; font-size: 12px; border: 2px solid white;">${cantidad}</div>`,
+        className: '',
+        iconSize: [diametro, diametro],
+        iconAnchor: [diametro / 2, diametro / 2]
+    });
+
+    L.marker(latlng, { icon: icono })
+        .bindTooltip(`${cantidad} ubicaciones`)
+        .on('click', () => capa.mapa.setView(latlng, feature.properties.zoom_expansion))
+        .addTo(capa.grupo);
+}
+
+// Capas por teselas: solo se descargan las teselas en pantalla que aún no se tienen
+const ZOOM_MAXIMO_TESELAS = 14;
+
+function registrarCapaTeselas(capa) {
+    capa.teselas = new Set();
+    capa.marcadores = new Set();
+
+    function actualizar() {
+        if (capa.mapa.hasLayer(capa.grupo)) {
+            cargarTeselas(capa);
+        }
+    }
+
+    capa.grupo.on('add', actualizar);
+    capa.mapa.on('moveend', actualizar);
+    actualizar();
+}
+
+function cargarTeselas(capa) {
+    // Una tesela de un zoom menor ya incluye todos los puntos de sus hijas
+    const zoom = Math.max(0, Math.min(capa.mapa.getZoom(), ZOOM_MAXIMO_TESELAS));
+    const limites = capa.mapa.getPixelBounds();
+    const escala = capa.mapa.getZoomScale(zoom, capa.mapa.getZoom());
+    const n = Math.pow(2, zoom);
+    const x0 = Math.max(0, Math.floor(limites.min.x * escala / 256));
+    const x1 = Math.min(n - 1, Math.floor(limites.max.x * escala / 256));
+    const y0 = Math.max(0, Math.floor(limites.min.y * escala / 256));
+    const y1 = Math.min(n - 1, Math.floor(limites.max.y * escala / 256));
+
+    for (let x = x0; x <= x1; x++) {
+        for (let y = y0; y <= y1; y++) {
+            const clave = `${zoom}/${x}/${y}`;
+            if (capa.teselas.has(clave) || teselaCubierta(capa, zoom, x, y)) continue;
+            capa.teselas.add(clave);
+
+            fetch(`${capa.opciones.url_teselas}/${clave}`)
+                .then(response => {
+                    if (!response.ok) throw new Error('HTTP ' + response.status);
+                    return response.json();
+                })
+                .then(geojson => {
+                    // Un mismo punto puede llegar en teselas de distinto zoom
+                    const nuevos = geojson.features.filter(feature => !capa.marcadores.has(feature.properties.id));
+                    nuevos.forEach(feature => capa.marcadores.add(feature.properties.id));
+                    agregarMarcadores(capa, nuevos);
+                })
+                .catch(error => {
+                    console.error('Error cargando tesela', capa.opciones.capa, clave, error);
+                    capa.teselas.delete(clave);
+                });
+        }
+    }
+}
+
+function teselaCubierta(capa, zoom, x, y) {
+    // ¿Ya se descargó alguna tesela de menor zoom que la contiene?
+    for (let z = zoom - 1; z >= 0; z--) {
+        const factor = Math.pow(2, zoom - z);
+        if (capa.teselas.has(`${z}/${Math.floor(x / factor)}/${Math.floor(y / factor)}`)) {
+            return true;
+        }
+    }
+    return false;
+}
+
+function agregarMarcadores(capa, features) {
+    // Un solo icono compartido por todos los marcadores de la capa
+    const icono = capa.opciones.icono ? L.icon(capa.opciones.icono) : new L.Icon.Default();
+
+    features.forEach(feature => {
+        const props = feature.properties;
+        const marcador = L.marker(
+            [feature.geometry.coordinates[1], feature.geometry.coordinates[0]],
+            { icon: icono }
+        );
+        marcador.bindTooltip(capa.opciones.tooltip + escaparHTML(props.nombre), { sticky: true });
+        marcador.bindPopup('Cargando...', { maxWidth: capa.opciones.ancho_popup });
+        marcador.on('popupopen', evento => cargarPopup(props, evento.popup));
+        marcador.addTo(capa.grupo);
+    });
+}
+
+// El contenido del popup se descarga la primera vez que se abre
+function cargarPopup(props, popup) {
+    if (popup.cargado) return;
+
+    fetch(`/api/ubicacion/${encodeURIComponent(props.tipo)}/${encodeURIComponent(props.id)}/popup`)
+        .then(response => {
+            if (!response.ok) throw new Error('HTTP ' + response.status);
+            return response.text();
+        })
+        .then(html => {
+            popup.cargado = true;
+            popup.setContent(html);
+        })
+        .catch(error => {
+            console.error('Error cargando popup', props.id, error);
+            popup.setContent('No se pudo cargar la información');
+        });
+}
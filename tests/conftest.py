@@ -0,0 +1,68 @@
+"""Fixtures comunes: un directorio de datos temporal por prueba y ambos motores"""
+import os
+import sys
+from collections import OrderedDict
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as aplicacion  # noqa: E402
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def almacen(request, tmp_path, monkeypatch):
+    """Motor de almacenamiento nuevo sobre un directorio vacío
+
+    Todas las rutas de datos son relativas a DATABASE_PATH, así que se trabaja
+    en un directorio temporal. Las cachés del proceso se reemplazan porque
+    están indexadas por versión, y las versiones de SQLite vuelven a empezar
+    en cada base nueva.
+    """
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(aplicacion.DATABASE_PATH)
+    nuevo = aplicacion.crear_almacen(request.param)
+    monkeypatch.setattr(aplicacion, 'almacen', nuevo)
+    monkeypatch.setattr(aplicacion, 'almacen_backups', aplicacion.AlmacenBackups(
+        aplicacion.BACKUPS_PATH, aplicacion.BACKUPS_RECIENTES, aplicacion.BACKUPS_DIARIOS,
+        aplicacion.BACKUPS_SEMANALES, aplicacion.BACKUPS_MAX_DELTAS))
+    monkeypatch.setattr(aplicacion, 'indice_ubicaciones', aplicacion.IndiceEspacial())
+    monkeypatch.setattr(aplicacion, 'cache_teselas', aplicacion.CacheTeselas(aplicacion.TESELAS_PATH, aplicacion.TESELAS_MAX_BYTES))
+    for nombre in ('_cache_colecciones', '_cache_clusters', '_cache_fragmentos'):
+        monkeypatch.setattr(aplicacion, nombre, {})
+    monkeypatch.setattr(aplicacion, '_cache_consultas', OrderedDict())
+    monkeypatch.setattr(aplicacion, '_cache_mapa', {'version': None, 'html': None, 'etag': None})
+    monkeypatch.setattr(aplicacion, '_cache_calor', {'version': None})
+    monkeypatch.setattr(aplicacion, '_cache_analitica', {'version': None, 'tabla': None, 'resultados': OrderedDict()})
+    nuevo.inicializar(aplicacion.ARCHIVOS_COLECCIONES)
+    return nuevo
+
+
+@pytest.fixture
+def cliente(almacen):
+    return aplicacion.app.test_client()
+
+
+@pytest.fixture
+def autorizado(cliente):
+    """Cliente con la sesión de mantenimiento iniciada"""
+    with cliente.session_transaction() as sesion:
+        sesion['mantenimiento_autorizado'] = True
+    return cliente
+
+
+def generar_ubicaciones(prefijo, cantidad, inicio=1):
+    return [
+        {
+            'id': f'{prefijo}{numero:03d}',
+            'nombre': f'Ubicación {numero}',
+            'ciudad': 'Lima',
+            'direccion': f'Av. Prueba {numero}',
+            'lat': -12.0 + numero * 0.001,
+            'lon': -77.0 - numero * 0.001,
+            # Mitad activas y mitad con apertura en 2026: se llenan todas las capas
+            'estado': 'activo' if numero % 2 else 'proxima_apertura',
+            'fecha_apertura': '2026-03-01'
+        }
+        for numero in range(inicio, inicio + cantidad)
+    ]
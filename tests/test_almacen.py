@@ -0,0 +1,96 @@
+"""Motores de almacenamiento: diario, lotes interrumpidos y secuencias de IDs"""
+import json
+import multiprocessing
+import os
+
+import pytest
+
+import app as aplicacion
+from conftest import generar_ubicaciones
+
+ARCHIVO = 'distribuidores_autorizados.json'
+solo_json = pytest.mark.parametrize('almacen', ['json'], indirect=True)
+
+
+def reiniciar_proceso():
+    """Otro arranque del motor JSON: sin caché en memoria ni diarios abiertos"""
+    aplicacion._cache_colecciones.clear()
+    nuevo = aplicacion.AlmacenJSON()
+    nuevo.inicializar(aplicacion.ARCHIVOS_COLECCIONES)
+    return nuevo
+
+
+def leer_instantanea(archivo):
+    with open(os.path.join(aplicacion.DATABASE_PATH, archivo), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def ids(registros):
+    return [registro['id'] for registro in registros]
+
+
+@solo_json
+def test_diario_se_reproduce_y_compacta_al_inicializar(almacen):
+    almacen.guardar(ARCHIVO, generar_ubicaciones('D', 3))
+    almacen.insertar(ARCHIVO, generar_ubicaciones('D', 1, inicio=4)[0])
+    actualizado = dict(almacen.obtener(ARCHIVO, 'D001'), nombre='Renombrado')
+    almacen.actualizar(ARCHIVO, 'D001', actualizado)
+    almacen.eliminar(ARCHIVO, 'D002')
+
+    # Las ediciones solo se anexaron al diario
+    ruta_diario = os.path.join(aplicacion.DATABASE_PATH, ARCHIVO + '.journal')
+    assert ids(leer_instantanea(ARCHIVO)) == ['D001', 'D002', 'D003']
+    # Línea a medio escribir por una caída: se descarta
+    with open(ruta_diario, 'ab') as f:
+        f.write(b'{"op": "eliminar", "id": "D0')
+
+    nuevo = reiniciar_proceso()
+    instantanea = leer_instantanea(ARCHIVO)
+    assert ids(instantanea) == ['D001', 'D003', 'D004']
+    assert instantanea[0]['nombre'] == 'Renombrado'
+    assert os.path.getsize(ruta_diario) == 0
+    assert ids(nuevo.cargar(ARCHIVO)) == ['D001', 'D003', 'D004']
+
+
+@solo_json
+def test_lote_interrumpido_se_aplica_completo(almacen):
+    almacen.guardar('tiendas_oro.json', generar_ubicaciones('TO', 1))
+    nuevo_distribuidor = generar_ubicaciones('D', 1)[0]
+    cambios = {
+        ARCHIVO: [{'op': 'insertar', 'id': 'D001', 'registro': nuevo_distribuidor}],
+        'tiendas_oro.json': [{'op': 'eliminar', 'id': 'TO001'}]
+    }
+    # Caída después de escribir la primera colección y antes de la segunda
+    ruta_lote = os.path.join(aplicacion.DATABASE_PATH, '123_456.lote')
+    with open(ruta_lote, 'w', encoding='utf-8') as f:
+        json.dump(cambios, f)
+    almacen.insertar(ARCHIVO, nuevo_distribuidor)
+
+    nuevo = reiniciar_proceso()
+    assert not os.path.exists(ruta_lote)
+    # Reaplicar es idempotente por id: el registro ya escrito no se duplica
+    assert ids(nuevo.cargar(ARCHIVO)) == ['D001']
+    assert nuevo.cargar('tiendas_oro.json') == []
+
+
+def reservar_ids(motor, cantidad, cola):
+    aplicacion.almacen = aplicacion.crear_almacen(motor)
+    cola.put([aplicacion.generar_id_unico('distribuidores') for _ in range(cantidad)])
+
+
+def test_ids_unicos_entre_procesos(almacen):
+    almacen.guardar(ARCHIVO, generar_ubicaciones('D', 2))
+    contexto = multiprocessing.get_context('fork')
+    cola = contexto.Queue()
+    procesos = [contexto.Process(target=reservar_ids, args=(almacen.nombre, 25, cola)) for _ in range(4)]
+    for proceso in procesos:
+        proceso.start()
+    reservados = [registro_id for _ in procesos for registro_id in cola.get(timeout=60)]
+    for proceso in procesos:
+        proceso.join(timeout=60)
+        assert proceso.exitcode == 0
+
+    assert len(set(reservados)) == 100
+    # La secuencia parte del mayor ID existente y no se salta ninguno
+    assert sorted(reservados) == [f'D{numero:03d}' for numero in range(3, 103)]
+    assert aplicacion.generar_id_unico('distribuidores') == 'D103'
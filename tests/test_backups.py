@@ -0,0 +1,44 @@
+"""Backups: todo id devuelto por /api/backup-datos debe poder restaurarse"""
+import app as aplicacion
+from conftest import generar_ubicaciones
+
+ARCHIVO = 'distribuidores_autorizados.json'
+
+
+def crear_backup(cliente):
+    respuesta = cliente.post('/api/backup-datos')
+    assert respuesta.status_code == 200
+    datos = respuesta.get_json()
+    assert datos['eliminados'] == []
+    return datos['backup_file']
+
+
+def test_dos_backups_seguidos_se_restauran(autorizado):
+    aplicacion.almacen.guardar(ARCHIVO, generar_ubicaciones('D', 3))
+    primero = crear_backup(autorizado)
+    aplicacion.almacen.guardar(ARCHIVO, generar_ubicaciones('D', 5))
+    segundo = crear_backup(autorizado)
+    assert primero != segundo
+
+    ids = {backup['id'] for backup in autorizado.get('/api/backups').get_json()}
+    assert {primero, segundo} <= ids
+
+    respuesta = autorizado.post(f'/api/backups/{primero}/restaurar')
+    assert respuesta.status_code == 200
+    assert [registro['id'] for registro in aplicacion.almacen.cargar(ARCHIVO)] == ['D001', 'D002', 'D003']
+
+    respuesta = autorizado.post(f'/api/backups/{segundo}/restaurar')
+    assert respuesta.status_code == 200
+    assert len(aplicacion.almacen.cargar(ARCHIVO)) == 5
+
+
+def test_retencion_conserva_todos_los_de_hoy(autorizado, monkeypatch):
+    monkeypatch.setattr(aplicacion.almacen_backups, 'recientes', 2)
+    creados = []
+    for cantidad in range(1, 5):
+        aplicacion.almacen.guardar(ARCHIVO, generar_ubicaciones('D', cantidad))
+        creados.append(crear_backup(autorizado))
+
+    # Todos son de hoy: ninguno se elimina aunque superen los N más recientes
+    for backup_id in creados:
+        assert autorizado.post(f'/api/backups/{backup_id}/restaurar').status_code == 200
@@ -0,0 +1,106 @@
+"""/api/cambios: deltas desde una secuencia, eliminaciones y reinicios"""
+import pytest
+
+import app as aplicacion
+from conftest import generar_ubicaciones
+
+ARCHIVO = 'distribuidores_autorizados.json'
+TODOS = sorted(aplicacion.ARCHIVOS_POR_TIPO)
+
+
+@pytest.fixture
+def con_datos(almacen, autorizado):
+    almacen.guardar(ARCHIVO, generar_ubicaciones('D', 3))
+    return autorizado
+
+
+def cambios(cliente, desde=None):
+    respuesta = cliente.get('/api/cambios' if desde is None else f'/api/cambios?desde={desde}')
+    assert respuesta.status_code == 200
+    return respuesta.get_json()
+
+
+def test_desde_devuelve_solo_los_cambios_posteriores(almacen, con_datos):
+    almacen.actualizar(ARCHIVO, 'D001', dict(almacen.obtener(ARCHIVO, 'D001'), nombre='Antes'))
+    seq = cambios(con_datos, 0)['seq']
+    almacen.actualizar(ARCHIVO, 'D002', dict(almacen.obtener(ARCHIVO, 'D002'), nombre='Después'))
+    almacen.insertar(ARCHIVO, generar_ubicaciones('D', 1, inicio=4)[0])
+
+    resultado = cambios(con_datos, seq)
+    assert resultado['seq'] == seq + 2
+    assert resultado['reiniciar'] == []
+    assert resultado['cambios'] == {'distribuidores': {
+        'actualizados': [almacen.obtener(ARCHIVO, 'D002'), almacen.obtener(ARCHIVO, 'D004')],
+        'eliminados': []
+    }}
+    # Sin cambios nuevos: respuesta vacía con la misma secuencia
+    assert cambios(con_datos, resultado['seq']) == {'success': True, 'seq': seq + 2, 'cambios': {}, 'reiniciar': []}
+
+
+def test_eliminados_aparecen_como_lapidas(almacen, con_datos):
+    seq = cambios(con_datos, 0)['seq']
+    almacen.actualizar(ARCHIVO, 'D001', dict(almacen.obtener(ARCHIVO, 'D001'), nombre='Renombrado'))
+    almacen.eliminar(ARCHIVO, 'D001')
+    almacen.eliminar(ARCHIVO, 'D003')
+
+    resultado = cambios(con_datos, seq)
+    assert resultado['cambios'] == {'distribuidores': {'actualizados': [], 'eliminados': ['D001', 'D003']}}
+
+
+def test_lapidas_sobreviven_a_la_compactacion(almacen, con_datos, monkeypatch):
+    seq = cambios(con_datos, 0)['seq']
+    almacen.eliminar(ARCHIVO, 'D002')
+    # Forzar la compactación del registro de cambios en los dos motores
+    monkeypatch.setattr(aplicacion, 'CAMBIOS_MAX_BYTES', 1)
+    monkeypatch.setattr(aplicacion, 'CAMBIOS_COMPACTAR_CADA', 2)
+    for _ in range(4):
+        almacen.actualizar(ARCHIVO, 'D001', dict(almacen.obtener(ARCHIVO, 'D001'), nombre='Otra vez'))
+    ultima, entradas = almacen.cambios_desde(0)
+    assert len(entradas) < ultima
+
+    resultado = cambios(con_datos, seq)
+    assert resultado['reiniciar'] == []
+    assert resultado['cambios']['distribuidores']['eliminados'] == ['D002']
+    assert [registro['id'] for registro in resultado['cambios']['distribuidores']['actualizados']] == ['D001']
+
+
+def test_sin_desde_se_reinicia_todo(con_datos):
+    resultado = cambios(con_datos)
+    assert resultado['reiniciar'] == TODOS
+    assert resultado['cambios'] == {}
+
+
+def test_desde_posterior_a_la_secuencia_se_reinicia_todo(con_datos):
+    # Por ejemplo, el registro de cambios se borró junto con la base
+    seq = cambios(con_datos, 0)['seq']
+    assert cambios(con_datos, seq + 100)['reiniciar'] == TODOS
+
+
+def test_coleccion_reemplazada_se_reinicia(almacen, con_datos):
+    seq = cambios(con_datos, 0)['seq']
+    almacen.insertar('tiendas_oro.json', generar_ubicaciones('TO', 1)[0])
+    almacen.guardar(ARCHIVO, generar_ubicaciones('D', 2))
+
+    resultado = cambios(con_datos, seq)
+    assert resultado['reiniciar'] == ['distribuidores']
+    assert list(resultado['cambios']) == ['tiendas_oro']
+
+
+def test_demasiados_cambios_se_reinicia(almacen, con_datos, monkeypatch):
+    monkeypatch.setattr(aplicacion, 'MAX_CAMBIOS_RESPUESTA', 2)
+    seq = cambios(con_datos, 0)['seq']
+    for registro_id in ('D001', 'D002', 'D003'):
+        almacen.eliminar(ARCHIVO, registro_id)
+
+    resultado = cambios(con_datos, seq)
+    assert resultado['reiniciar'] == ['distribuidores']
+    assert resultado['cambios'] == {}
+
+
+def test_desde_invalido(con_datos):
+    assert con_datos.get('/api/cambios?desde=-1').status_code == 400
+    assert con_datos.get('/api/cambios?desde=abc').status_code == 400
+
+
+def test_requiere_sesion(cliente):
+    assert cliente.get('/api/cambios?desde=0').status_code == 401
@@ -0,0 +1,116 @@
+"""Importación incremental: lector por trozos y upsert con errores por registro"""
+import gzip
+import io
+import json
+
+import pytest
+
+import app as aplicacion
+from conftest import generar_ubicaciones
+
+DOCUMENTO = {
+    'version': '2.0',
+    'metadatos': {'nota': 'llaves } y corchetes ] dentro de un texto', 'total': 12345},
+    'distribuidores_autorizados': [
+        {'id': 'D001', 'nombre': 'Comillas \\"escapadas\\" y \\\\ barras', 'lat': -12.046374, 'lon': -77.042793},
+        {'id': 'D002', 'nombre': 'Año con ñ, é y 🚚', 'lat': 1e-3, 'lon': -0.5},
+        {'id': 'D003', 'nombre': ',:[]{}', 'lat': 12, 'lon': 123456789012345}
+    ],
+    'tiendas_oro': [],
+    'tiendas_satelite': [{'id': 'TS001', 'nombre': 'Línea\nnueva\ttab', 'lat': 0, 'lon': 0}]
+}
+
+
+def leer(datos, tamano_trozo):
+    lector = aplicacion.LectorJSONIncremental(io.BytesIO(datos), tamano_trozo)
+    return list(lector.registros(aplicacion.CATEGORIAS_EXPORTACION))
+
+
+def esperados():
+    return [
+        (categoria, indice, registro)
+        for categoria in DOCUMENTO if categoria in aplicacion.CATEGORIAS_EXPORTACION
+        for indice, registro in enumerate(DOCUMENTO[categoria])
+    ]
+
+
+@pytest.mark.parametrize('tamano_trozo', [1, 2, 3, 5, 7, 64, 65536])
+def test_trozos_cortados_en_textos_y_escapes(tamano_trozo):
+    # Sin ensure_ascii: los caracteres de varios bytes también quedan partidos
+    datos = json.dumps(DOCUMENTO, ensure_ascii=False, indent=2).encode('utf-8')
+    assert leer(datos, tamano_trozo) == esperados()
+    # Con escapes \uXXXX partidos entre trozos
+    assert leer(json.dumps(DOCUMENTO).encode('utf-8'), tamano_trozo) == esperados()
+
+
+@pytest.mark.parametrize('tamano_trozo', [1, 16, 65536])
+def test_documento_gzip(tamano_trozo):
+    datos = gzip.compress(json.dumps(DOCUMENTO, ensure_ascii=False).encode('utf-8'))
+    assert leer(datos, tamano_trozo) == esperados()
+
+
+def test_documento_cortado_es_un_error():
+    datos = json.dumps(DOCUMENTO).encode('utf-8')
+    with pytest.raises(ValueError, match='Fin inesperado|JSON inválido'):
+        leer(datos[:len(datos) // 2], 7)
+
+
+def importar(cliente, documento, comprimir=False):
+    cuerpo = json.dumps(documento, ensure_ascii=False).encode('utf-8')
+    if comprimir:
+        cuerpo = gzip.compress(cuerpo)
+    return cliente.post('/api/importar-datos?modo=upsert', data=cuerpo, content_type='application/json')
+
+
+@pytest.mark.parametrize('comprimir', [False, True])
+def test_upsert_aplica_los_validos_y_reporta_los_invalidos(almacen, autorizado, comprimir):
+    almacen.guardar('distribuidores_autorizados.json', generar_ubicaciones('D', 2))
+    actualizado, nuevo = generar_ubicaciones('D', 2, inicio=2)
+    actualizado['nombre'] = 'Actualizado'
+    sin_lat = dict(generar_ubicaciones('D', 1, inicio=9)[0], lat='norte')
+    sin_nombre = {key: valor for key, valor in generar_ubicaciones('TO', 1)[0].items() if key != 'nombre'}
+
+    respuesta = importar(autorizado, {
+        'distribuidores_autorizados': [actualizado, sin_lat, nuevo],
+        'tiendas_oro': [sin_nombre]
+    }, comprimir)
+
+    assert respuesta.status_code == 200
+    resultado = respuesta.get_json()
+    assert resultado['resumen']['distribuidores_autorizados'] == {'insertados': 1, 'actualizados': 1, 'errores': 1}
+    assert resultado['errores'] == [
+        {'categoria': 'distribuidores_autorizados', 'indice': 1, 'id': 'D009', 'error': 'lat debe ser numérico'},
+        {'categoria': 'tiendas_oro', 'indice': 0, 'id': 'TO001', 'error': 'Campo requerido: nombre'}
+    ]
+    registros = almacen.cargar('distribuidores_autorizados.json')
+    assert [registro['id'] for registro in registros] == ['D001', 'D002', 'D003']
+    assert registros[1]['nombre'] == 'Actualizado'
+    assert almacen.cargar('tiendas_oro.json') == []
+
+
+def test_upsert_con_archivo_invalido_conserva_lo_escrito(almacen, autorizado, monkeypatch):
+    monkeypatch.setattr(aplicacion, 'TAMANO_LOTE_IMPORTACION', 2)
+    cuerpo = json.dumps({'distribuidores_autorizados': generar_ubicaciones('D', 3)}).encode('utf-8')
+    respuesta = autorizado.post('/api/importar-datos?modo=upsert', data=cuerpo[:-10], content_type='application/json')
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()['error_lectura']
+    # El primer lote completo ya se había escrito
+    assert [registro['id'] for registro in almacen.cargar('distribuidores_autorizados.json')] == ['D001', 'D002']
+
+
+@pytest.mark.parametrize('registros, error', [
+    (generar_ubicaciones('D', 2) + generar_ubicaciones('D', 1), 'distribuidores_autorizados: IDs duplicados: D001'),
+    ([dict(generar_ubicaciones('D', 1)[0], id=1), dict(generar_ubicaciones('D', 1)[0], id='1')],
+     'distribuidores_autorizados: IDs duplicados: 1'),
+    ([{'nombre': 'Sin id'}], 'distribuidores_autorizados: Registro 0 sin id'),
+])
+def test_reemplazo_con_ids_invalidos_devuelve_400(almacen, autorizado, registros, error):
+    almacen.guardar('tiendas_oro.json', generar_ubicaciones('TO', 2))
+    respuesta = autorizado.post('/api/importar-datos', json={
+        'tiendas_oro': [],
+        'distribuidores_autorizados': registros
+    })
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()['error'] == error
+    # Ninguna colección se reemplazó, ni siquiera las válidas
+    assert len(almacen.cargar('tiendas_oro.json')) == 2
@@ -0,0 +1,71 @@
+"""/api/batch: todo o nada, en los dos motores"""
+import pytest
+
+import app as aplicacion
+from conftest import generar_ubicaciones
+
+ARCHIVOS = ['distribuidores_autorizados.json', 'tiendas_oro.json']
+
+
+def estado(almacen):
+    """Todo lo que una escritura podría cambiar: registros, versiones y registro de cambios"""
+    return (
+        {archivo: almacen.cargar(archivo) for archivo in ARCHIVOS},
+        {archivo: almacen.version_compartida(archivo) for archivo in ARCHIVOS},
+        almacen.cambios_desde(0)[0]
+    )
+
+
+@pytest.fixture
+def con_datos(almacen, autorizado):
+    almacen.guardar('distribuidores_autorizados.json', generar_ubicaciones('D', 2))
+    almacen.guardar('tiendas_oro.json', generar_ubicaciones('TO', 2))
+    return autorizado
+
+
+def test_lote_valido_se_aplica(almacen, con_datos):
+    nuevo = dict(generar_ubicaciones('X', 1)[0])
+    del nuevo['id']
+    respuesta = con_datos.post('/api/batch', json={'operaciones': [
+        {'op': 'crear', 'tipo': 'tiendas_oro', 'datos': nuevo},
+        {'op': 'actualizar', 'tipo': 'distribuidores', 'id': 'D001', 'datos': {'nombre': 'Renombrado'}},
+        {'op': 'eliminar', 'tipo': 'distribuidores', 'id': 'D002'}
+    ]})
+    assert respuesta.status_code == 200
+    assert respuesta.get_json()['resultados'][0]['id'] == 'TO003'
+    assert [registro['nombre'] for registro in almacen.cargar('distribuidores_autorizados.json')] == ['Renombrado']
+    assert [registro['id'] for registro in almacen.cargar('tiendas_oro.json')] == ['TO001', 'TO002', 'TO003']
+
+
+def test_lote_con_una_operacion_invalida_no_escribe_nada(almacen, con_datos):
+    antes = estado(almacen)
+    nuevo = dict(generar_ubicaciones('X', 1)[0])
+    del nuevo['id']
+    respuesta = con_datos.post('/api/batch', json={'operaciones': [
+        {'op': 'crear', 'tipo': 'tiendas_oro', 'datos': nuevo},
+        {'op': 'actualizar', 'tipo': 'distribuidores', 'id': 'D001', 'datos': {'nombre': 'Renombrado'}},
+        {'op': 'eliminar', 'tipo': 'tiendas_oro', 'id': 'TO001'},
+        {'op': 'actualizar', 'tipo': 'distribuidores', 'id': 'D002', 'datos': {'lat': 'norte'}}
+    ]})
+    assert respuesta.status_code == 400
+    resultados = respuesta.get_json()['resultados']
+    assert not any(resultado['success'] for resultado in resultados)
+    assert resultados[3]['error'] == 'lat debe ser numérico'
+    assert estado(almacen) == antes
+    # Tampoco se consumió ningún ID de la secuencia
+    assert aplicacion.generar_id_unico('tiendas_oro') == 'TO003'
+
+
+@pytest.mark.parametrize('operacion, error', [
+    ({'op': 'eliminar', 'tipo': 'distribuidores', 'id': ['D001']}, 'El id debe ser texto o un número entero'),
+    ({'op': 'eliminar', 'tipo': 'distribuidores', 'id': {'id': 'D001'}}, 'El id debe ser texto o un número entero'),
+    ({'op': 'eliminar', 'tipo': 'distribuidores', 'id': True}, 'El id debe ser texto o un número entero'),
+    ({'op': 'eliminar', 'tipo': ['distribuidores'], 'id': 'D001'}, "Tipo desconocido: ['distribuidores']"),
+    ({'op': 'eliminar', 'tipo': {'a': 1}, 'id': 'D001'}, "Tipo desconocido: {'a': 1}"),
+])
+def test_ids_y_tipos_no_escalares_devuelven_400(almacen, con_datos, operacion, error):
+    antes = estado(almacen)
+    respuesta = con_datos.post('/api/batch', json={'operaciones': [operacion]})
+    assert respuesta.status_code == 400
+    assert respuesta.get_json()['resultados'][0]['error'] == error
+    assert estado(almacen) == antes
@@ -0,0 +1,42 @@
+"""Regresión de tamaño de /mapa: los marcadores no deben inflar el HTML"""
+import app as aplicacion
+from conftest import generar_ubicaciones
+
+# Con iconos embebidos en base64 /mapa crecía megabytes por ubicación
+PRESUPUESTO_BYTES = 32 * 1024
+CRECIMIENTO_MAXIMO_POR_UBICACION = 8
+
+
+def guardar_colecciones(por_coleccion):
+    for tipo, archivo in aplicacion.ARCHIVOS_POR_TIPO.items():
+        aplicacion.almacen.guardar(archivo, generar_ubicaciones(aplicacion.PREFIJOS_ID[tipo], por_coleccion))
+
+
+def test_mapa_dentro_del_presupuesto(cliente):
+    guardar_colecciones(10)
+    pequeno = cliente.get('/mapa')
+    assert pequeno.status_code == 200
+
+    guardar_colecciones(250)
+    respuesta = cliente.get('/mapa')
+    assert respuesta.status_code == 200
+    html = respuesta.get_data(as_text=True)
+
+    assert len(respuesta.data) < PRESUPUESTO_BYTES
+    assert 'data:image/png;base64' not in html
+    crecimiento = len(respuesta.data) - len(pequeno.data)
+    assert crecimiento < CRECIMIENTO_MAXIMO_POR_UBICACION * 4 * (250 - 10)
+
+    # El mapa sigue completo: contenedor y script que carga las capas
+    assert 'class="folium-map" id="map_principal"' in html
+    assert '/static/js/mapa_capas.' in html
+
+
+def test_capas_se_piden_por_teselas_clusters_o_calor(cliente):
+    guardar_colecciones(10)
+    html = cliente.get('/mapa').get_data(as_text=True)
+    assert '"url_teselas": "/tiles/distribuidores"' in html
+    assert '"url_calor": "/tiles/calor/{z}/{x}/{y}.png"' in html
+    # Ya no hay ruta que serialice capas enteras
+    assert '/api/mapa/capas/' not in html
+    assert cliente.get('/api/mapa/capas/distribuidores').status_code == 404
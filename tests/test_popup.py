@@ -0,0 +1,20 @@
+"""Popups públicos: solo de ubicaciones que el mapa muestra"""
+import app as aplicacion
+from conftest import generar_ubicaciones
+
+ARCHIVO = 'distribuidores_autorizados.json'
+
+
+def test_popup_de_ubicacion_visible(cliente):
+    aplicacion.almacen.guardar(ARCHIVO, generar_ubicaciones('D', 2))
+    respuesta = cliente.get('/api/ubicacion/distribuidores/D001/popup')
+    assert respuesta.status_code == 200
+    assert 'Ubicación 1' in respuesta.get_data(as_text=True)
+
+
+def test_popup_de_ubicacion_oculta_no_existe(cliente):
+    registros = generar_ubicaciones('D', 2)
+    registros[1]['estado'] = 'planeado'
+    aplicacion.almacen.guardar(ARCHIVO, registros)
+    assert cliente.get('/api/ubicacion/distribuidores/D002/popup').status_code == 404
+    assert cliente.get('/api/ubicacion/distribuidores/D999/popup').status_code == 404
@@ -0,0 +1,70 @@
+"""Caché de teselas en disco: escrituras de otros workers solo borran las teselas afectadas"""
+import json
+import os
+
+import app as aplicacion
+
+ARCHIVO = 'distribuidores_autorizados.json'
+ZOOM = 10
+LIMA, CUSCO, AREQUIPA = (-12.05, -77.04), (-13.53, -71.97), (-16.40, -71.54)
+
+
+def ubicacion(registro_id, posicion):
+    return {'id': registro_id, 'nombre': registro_id, 'ciudad': 'Perú', 'direccion': 'Av. Prueba',
+            'lat': posicion[0], 'lon': posicion[1], 'estado': 'activo', 'fecha_apertura': '2025-01-01'}
+
+
+def ruta(posicion):
+    x, y = aplicacion.tesela_de(*posicion, ZOOM)
+    return aplicacion.cache_teselas._ruta_tesela('distribuidores', ZOOM, x, y)
+
+
+def ids_tesela(cliente, posicion):
+    x, y = aplicacion.tesela_de(*posicion, ZOOM)
+    respuesta = cliente.get(f'/tiles/distribuidores/{ZOOM}/{x}/{y}')
+    assert respuesta.status_code == 200
+    return [feature['properties']['id'] for feature in json.loads(respuesta.data)['features']]
+
+
+def preparar(almacen, cliente):
+    almacen.guardar(ARCHIVO, [ubicacion('D001', LIMA), ubicacion('D002', CUSCO)])
+    assert ids_tesela(cliente, LIMA) == ['D001']
+    assert ids_tesela(cliente, CUSCO) == ['D002']
+    assert ids_tesela(cliente, AREQUIPA) == []
+    assert all(os.path.exists(ruta(posicion)) for posicion in (LIMA, CUSCO, AREQUIPA))
+
+
+def test_escritura_de_otro_worker_solo_borra_sus_teselas(almacen, cliente):
+    preparar(almacen, cliente)
+    # Otro worker mueve D001 directamente en el almacén (este proceso no lo ve)
+    almacen.actualizar(ARCHIVO, 'D001', ubicacion('D001', AREQUIPA))
+
+    # La tesela de Cusco sigue en disco; las de la posición anterior y la nueva no
+    assert ids_tesela(cliente, CUSCO) == ['D002']
+    assert os.path.exists(ruta(CUSCO))
+    assert not os.path.exists(ruta(LIMA))
+    assert not os.path.exists(ruta(AREQUIPA))
+    assert ids_tesela(cliente, LIMA) == []
+    assert ids_tesela(cliente, AREQUIPA) == ['D001']
+
+
+def test_posiciones_intermedias_tambien_se_borran(almacen, cliente):
+    preparar(almacen, cliente)
+    # Dos escrituras de otros workers: la tesela de la posición intermedia
+    # pudo generarse entre ambas aunque este proceso nunca la indexó
+    almacen.actualizar(ARCHIVO, 'D001', ubicacion('D001', CUSCO))
+    almacen.actualizar(ARCHIVO, 'D001', ubicacion('D001', AREQUIPA))
+
+    assert ids_tesela(cliente, LIMA) == []
+    assert not os.path.exists(ruta(CUSCO))
+    assert ids_tesela(cliente, CUSCO) == ['D002']
+    assert ids_tesela(cliente, AREQUIPA) == ['D001']
+
+
+def test_coleccion_reemplazada_borra_todas_las_teselas(almacen, cliente):
+    preparar(almacen, cliente)
+    almacen.guardar(ARCHIVO, [ubicacion('D002', CUSCO), ubicacion('D003', LIMA)])
+
+    assert ids_tesela(cliente, AREQUIPA) == []
+    assert not os.path.exists(ruta(CUSCO))
+    assert ids_tesela(cliente, LIMA) == ['D003']